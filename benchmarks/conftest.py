@@ -0,0 +1,35 @@
+import tracemalloc
+
+from pytest import fixture
+
+# peak memory by benchmark name, reported at end of run
+peak_memory = {}
+
+
+@fixture
+def measure(benchmark, request):
+    """Benchmark given callable, also recording its peak memory from a single call
+
+    Peak memory (bytes traced by `tracemalloc`) is saved as `extra_info` w/
+    the benchmark's results (see --benchmark-json, --benchmark-autosave)
+    """
+    def run(fn, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            fn(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info['peak_memory_bytes'] = peak
+        peak_memory[request.node.name] = peak
+        return benchmark(fn, *args, **kwargs)
+    return run
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not peak_memory:
+        return
+    terminalreporter.section('peak memory')
+    width = max(len(name) for name in peak_memory)
+    for name, peak in peak_memory.items():
+        terminalreporter.write_line(f"{name:<{width}} {peak / 1024:>12,.1f} KiB")
@@ -0,0 +1,282 @@
+"""Fake upstream servers, for load testing
+
+Lightweight local stand-ins for the EHR FHIR API, PDMP facade, RxNav and
+logserver, each w/ configurable latency, jitter, payload size and error
+rate, counting calls by path.  Payloads are derived from the fixtures in
+`tests/test_fhir/`.  Used by `loadtest.py`; also runnable standalone:
+
+    python benchmarks/fake_upstreams.py [--set ehr.latency=0.2 ...]
+"""
+from collections import Counter
+import copy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from fhir_fixtures import BASE_RXCUI, RXNORM_SYSTEM, load_fixture
+
+# classIds in `rx-class-map.json`, and one filtered out
+DRUG_CLASSES = (
+    ('350297008', 'Opioid', 'MOA'),
+    ('16047007', 'Benzodiazepine', 'MOA'),
+    ('N0000175694', 'Nonsteroidal Anti-inflammatory Drug', 'EPC'),
+)
+
+DEFAULTS = {
+    # seconds added to every response, +/- up to `jitter`
+    'latency': 0.0,
+    'jitter': 0.0,
+    # share of requests answered w/ `error_status`
+    'error_rate': 0.0,
+    'error_status': 503,
+    # count of entries in bundles
+    'entries': 50,
+    # entries per EHR page; 0 for a single page
+    'page_size': 0,
+    # count of distinct RxCUIs among meds
+    'distinct_rxcuis': 50,
+}
+
+
+def rxcui(index, options):
+    return str(BASE_RXCUI + index % options['distinct_rxcuis'])
+
+
+def with_rxcui(resource, code):
+    """Return copy of given MedicationRequest coded w/ given RxCUI"""
+    resource = copy.deepcopy(resource)
+    concept = resource['medicationCodeableConcept']
+    concept['coding'] = [
+        coding for coding in concept['coding'] if coding['system'] != RXNORM_SYSTEM]
+    concept['coding'].append({'system': RXNORM_SYSTEM, 'code': code})
+    return resource
+
+
+class FakeUpstream(object):
+    """Threaded HTTP server answering given routes, in a daemon thread
+
+    `routes` is a sequence of (method, path regex, handler); handlers take
+    (upstream, match, query, body) and return (status, JSON serializable body).
+    GET responses are deterministic, so encoded once per URL, keeping the
+    cost of serving them out of the measurements.
+    """
+
+    def __init__(self, name, routes, options, seed=None):
+        self.name = name
+        self.routes = [(method, re.compile(pattern), handler) for method, pattern, handler in routes]
+        self.options = dict(DEFAULTS, **options)
+        self.calls = Counter()
+        self._responses = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                upstream.handle(self)
+
+            def do_POST(self):
+                upstream.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name=f'fake-{name}', daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def _delay(self):
+        with self._lock:
+            jitter = self._random.uniform(-1, 1) * self.options['jitter']
+            failed = self._random.random() < self.options['error_rate']
+        return max(self.options['latency'] + jitter, 0), failed
+
+    def handle(self, request_handler):
+        split_url = urlsplit(request_handler.path)
+        length = int(request_handler.headers.get('Content-Length') or 0)
+        body = request_handler.rfile.read(length) if length else b''
+
+        for method, pattern, handler in self.routes:
+            match = pattern.fullmatch(split_url.path)
+            if method == request_handler.command and match:
+                break
+        else:
+            self._respond(request_handler, 404, b'{"error": "not found"}')
+            return
+
+        with self._lock:
+            self.calls[f'{method} {pattern.pattern}'] += 1
+        delay, failed = self._delay()
+        time.sleep(delay)
+        if failed:
+            self._respond(request_handler, self.options['error_status'], b'{"error": "injected"}')
+            return
+        response = self._responses.get(request_handler.path)
+        if response is None:
+            status, payload = handler(self, match, parse_qs(split_url.query), body)
+            response = status, json.dumps(payload).encode('utf-8')
+            if method == 'GET':
+                self._responses[request_handler.path] = response
+        self._respond(request_handler, *response)
+
+    def _respond(self, request_handler, status, data):
+        request_handler.send_response(status)
+        request_handler.send_header('Content-Type', 'application/json')
+        request_handler.send_header('Content-Length', str(len(data)))
+        request_handler.end_headers()
+        request_handler.wfile.write(data)
+
+
+def ehr(options, seed=None):
+    patient = load_fixture('PatientBJackson.json')
+    bundle = load_fixture('MedicationRequestBundleR4.json')
+    templates = [entry['resource'] for entry in bundle['entry']]
+
+    def metadata(upstream, match, query, body):
+        return 200, {'resourceType': 'CapabilityStatement', 'status': 'active', 'fhirVersion': '4.0.1'}
+
+    def patient_by_id(upstream, match, query, body):
+        return 200, dict(patient, id=match.group(1))
+
+    def medication_requests(upstream, match, query, body):
+        entries = upstream.options['entries']
+        page_size = upstream.options['page_size'] or entries
+        offset = int(query.get('_getpagesoffset', ['0'])[0])
+        page = [
+            {'resource': with_rxcui(templates[i % len(templates)], rxcui(i, upstream.options))}
+            for i in range(offset, min(offset + page_size, entries))]
+        links = [{'relation': 'self', 'url': f'{upstream.url}/MedicationRequest'}]
+        if offset + page_size < entries:
+            links.append({
+                'relation': 'next',
+                'url': f'{upstream.url}/MedicationRequest?_getpagesoffset={offset + page_size}'})
+        return 200, {
+            'resourceType': 'Bundle', 'type': 'searchset', 'total': entries,
+            'link': links, 'entry': page}
+
+    return FakeUpstream('ehr', (
+        ('GET', r'/metadata', metadata),
+        ('GET', r'/Patient/([^/]+)', patient_by_id),
+        ('GET', r'/MedicationRequest', medication_requests),
+    ), options, seed)
+
+
+def pdmp(options, seed=None):
+    templates = load_fixture('PDMP-MedicationRequestBundleR4.json')['entry']
+
+    def medication_orders(upstream, match, query, body):
+        entries = [
+            {'resource': with_rxcui(templates[i % len(templates)], rxcui(i, upstream.options))}
+            for i in range(upstream.options['entries'])]
+        return 200, {'resourceType': 'Bundle', 'type': 'searchset', 'entry': entries}
+
+    return FakeUpstream('pdmp', (
+        ('GET', r'/v/r4/fhir/MedicationOrder', medication_orders),
+    ), options, seed)
+
+
+def rxnav(options, seed=None):
+    def classes_by_rxcui(upstream, match, query, body):
+        code = query.get('rxcui', [''])[0]
+        # a varying subset of classes per RxCUI; some w/o any
+        classes = [c for i, c in enumerate(DRUG_CLASSES) if int(code or 0) >> i & 1]
+        if not classes:
+            return 200, {}
+        return 200, {'rxclassDrugInfoList': {'rxclassDrugInfo': [
+            {
+                'minConcept': {'rxcui': code, 'tty': 'SCD'},
+                'rxclassMinConceptItem': {
+                    'classId': class_id, 'className': class_name, 'classType': class_type},
+                'rela': 'has_moa',
+                'relaSource': 'MEDRT',
+            } for class_id, class_name, class_type in classes]}}
+
+    return FakeUpstream('rxnav', (
+        ('GET', r'/REST/rxclass/class/byRxcui\.json', classes_by_rxcui),
+    ), options, seed)
+
+
+def logserver(options, seed=None):
+    def events(upstream, match, query, body):
+        received = json.loads(body or b'[]')
+        return 200, {'received': len(received) if isinstance(received, list) else 1}
+
+    return FakeUpstream('logserver', (
+        ('POST', r'/events', events),
+    ), options, seed)
+
+
+UPSTREAMS = {'ehr': ehr, 'pdmp': pdmp, 'rxnav': rxnav, 'logserver': logserver}
+
+
+def parse_settings(settings):
+    """Return options by upstream name from `name.option=value` settings
+
+    A `*` name applies to all upstreams
+    """
+    options = {name: {} for name in UPSTREAMS}
+    for setting in settings:
+        key, _, value = setting.partition('=')
+        name, _, option = key.partition('.')
+        if option not in DEFAULTS or (name != '*' and name not in UPSTREAMS):
+            raise ValueError(f"unknown setting: {setting}")
+        value = type(DEFAULTS[option])(value)
+        for target in (UPSTREAMS if name == '*' else (name,)):
+            options[target][option] = value
+    return options
+
+
+def start_upstreams(options, seed=None):
+    """Start all fake upstreams w/ given options by name; return them by name"""
+    return {
+        name: factory(options.get(name, {}), seed).start()
+        for name, factory in UPSTREAMS.items()}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--set', action='append', default=[], metavar='NAME.OPTION=VALUE',
+        help=f"upstream option, of: {', '.join(DEFAULTS)}")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    upstreams = start_upstreams(parse_settings(args.set), seed=args.seed)
+    for name, upstream in upstreams.items():
+        print(f"{name}: {upstream.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for upstream in upstreams.values():
+            upstream.stop()
+
+
+if __name__ == '__main__':
+    main()
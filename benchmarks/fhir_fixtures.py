@@ -0,0 +1,18 @@
+"""Fixtures shared by the benchmarks and fake upstreams
+
+Synthetic payloads are derived from the FHIR fixtures of the test suite,
+in `tests/test_fhir/`
+"""
+import json
+import os
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), '..', 'tests', 'test_fhir')
+RXNORM_SYSTEM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+
+# RxCUIs of synthetic meds start here
+BASE_RXCUI = 900000
+
+
+def load_fixture(filename):
+    with open(os.path.join(FIXTURES_DIR, filename), 'r') as fixture_file:
+        return json.load(fixture_file)
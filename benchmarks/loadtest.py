@@ -0,0 +1,285 @@
+"""Load test of the MedicationRequest FHIR router endpoint
+
+Starts fake upstreams (see `fake_upstreams.py`), seeds redis sessions
+launched from the fake EHR, runs the app under gunicorn against them, and
+drives `/fhir-router/<session_id>/MedicationRequest` w/ concurrent clients,
+round robin over --sessions (concurrent requests for the same patient are
+coalesced).  Reports throughput, latency percentiles and upstream calls per
+request, and saves them as a JSON baseline, to compare against later runs:
+
+    python benchmarks/loadtest.py --requests 500 --concurrency 16 \\
+        --set '*.latency=0.05' --set ehr.page_size=20 --output baseline.json
+    python benchmarks/loadtest.py ... --compare baseline.json
+
+Requires redis at --redis-url; runs from a checkout w/ requirements installed.
+Fake upstreams share the driving process; app output goes to --app-log
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import itertools
+import json
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import redis
+import requests
+
+from fake_upstreams import DEFAULTS, parse_settings, start_upstreams
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# flask-session default
+SESSION_KEY_PREFIX = 'session:'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def version():
+    try:
+        return subprocess.run(
+            ('git', 'describe', '--always', '--dirty'), cwd=REPO_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+        ).stdout.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return os.getenv('VERSION_STRING', 'unknown')
+
+
+def seed_session(redis_handle, session_id, iss, patient_id):
+    """Store a session as left by a SMART launch from the given EHR"""
+    session_data = {
+        'iss': iss,
+        'token_response': {'patient': patient_id, 'access_token': 'loadtest'},
+    }
+    redis_handle.setex(SESSION_KEY_PREFIX + session_id, 3600, pickle.dumps(session_data))
+
+
+def start_app(port, upstreams, args, run_id, log_file):
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_DIR,
+        SESSION_REDIS=args.redis_url,
+        REQUEST_CACHE_URL=args.redis_url,
+        PDMP_URL=upstreams['pdmp'].url,
+        RXNAV_URL=upstreams['rxnav'].url,
+        LOGSERVER_URL=upstreams['logserver'].url,
+        LOGSERVER_TOKEN='loadtest',
+        SCRIPT_ENDPOINT_URL='',
+        # start each run w/ a cold drug class cache
+        DRUG_CLASS_CACHE_PREFIX=f'loadtest-{run_id}:',
+        LOG_LEVEL=os.getenv('LOG_LEVEL', 'WARNING'),
+    )
+    process = subprocess.Popen(
+        (sys.executable, '-m', 'gunicorn',
+         '--workers', str(args.workers), '--threads', str(args.threads),
+         '--bind', f'127.0.0.1:{port}', 'sof_wrapper.app:create_app()'),
+        cwd=REPO_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(
+                f"gunicorn exited w/ status {process.returncode}; see {log_file.name}")
+        try:
+            requests.get(f'http://127.0.0.1:{port}/', timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn not ready in 30 seconds")
+
+
+def percentile(ordered, pct):
+    """Return nearest-rank percentile of given sorted values"""
+    if not ordered:
+        return None
+    return ordered[max(int(round(pct / 100 * len(ordered))) - 1, 0)]
+
+
+def drive(urls, count, concurrency, timeout):
+    """Request given URLs, round robin, `count` times from `concurrency` clients
+
+    Returns (list of (seconds, status, partial), elapsed seconds); status is
+    None on connection failure, partial if any source was left out
+    """
+    counter = itertools.count()
+    results = []
+    lock = threading.Lock()
+
+    def client():
+        with requests.Session() as session:
+            while True:
+                index = next(counter)
+                if index >= count:
+                    return
+                url = urls[index % len(urls)]
+                start = time.monotonic()
+                try:
+                    response = session.get(url, timeout=timeout)
+                    status = response.status_code
+                    partial = status == 200 and any(
+                        entry.get('resource', entry).get('resourceType') == 'OperationOutcome'
+                        for entry in response.json().get('entry', ()))
+                except requests.RequestException:
+                    status, partial = None, False
+                with lock:
+                    results.append((time.monotonic() - start, status, partial))
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(client) for _ in range(concurrency)]:
+            future.result()
+    return results, time.monotonic() - start
+
+
+def summarize(results, elapsed, upstreams):
+    latencies = sorted(seconds * 1000 for seconds, _, _ in results)
+    statuses = {}
+    for _, status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    count = len(results)
+    return {
+        'requests': count,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(count / elapsed, 2),
+        'errors': sum(1 for _, status, _ in results if status != 200),
+        'partial': sum(1 for _, _, partial in results if partial),
+        'statuses': statuses,
+        'latency_ms': {
+            'mean': round(sum(latencies) / count, 2),
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'max': round(latencies[-1], 2),
+        },
+        'upstream_calls': {
+            name: dict(upstream.calls) for name, upstream in upstreams.items()},
+        'upstream_calls_per_request': {
+            name: round(sum(upstream.calls.values()) / count, 3)
+            for name, upstream in upstreams.items()},
+    }
+
+
+# (path, True if higher is better) of compared metrics
+COMPARED = (
+    (('throughput_rps',), True),
+    (('latency_ms', 'p50'), False),
+    (('latency_ms', 'p95'), False),
+    (('latency_ms', 'p99'), False),
+    (('errors',), False),
+    (('partial',), False),
+) + tuple(
+    (('upstream_calls_per_request', name), False) for name in ('ehr', 'pdmp', 'rxnav', 'logserver'))
+
+
+def compare(baseline, current):
+    """Print given metrics side by side, w/ change relative to baseline"""
+    print(f"{'metric':<40} {baseline['version']:>12} {current['version']:>12} {'change':>9}")
+    for path, higher_is_better in COMPARED:
+        before, after = baseline['results'], current['results']
+        for key in path:
+            before, after = before.get(key, 0), after.get(key, 0)
+        change = ((after - before) / before * 100) if before else 0
+        worse = (change < 0) if higher_is_better else (change > 0)
+        flag = ' !' if worse and abs(change) >= 10 else ''
+        print(f"{'.'.join(path):<40} {before:>12} {after:>12} {change:>+8.1f}%{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10, help="requests before measuring")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--sessions', type=int, default=10, help="distinct sessions (patients)")
+    parser.add_argument('--workers', type=int, default=1, help="gunicorn workers")
+    parser.add_argument('--threads', type=int, default=2 * os.cpu_count() + 1, help="gunicorn threads")
+    parser.add_argument('--timeout', type=float, default=30, help="client timeout, in seconds")
+    parser.add_argument('--redis-url', default='redis://127.0.0.1:6379/0')
+    parser.add_argument(
+        '--set', action='append', default=[], metavar='NAME.OPTION=VALUE',
+        help=f"fake upstream option (NAME of ehr, pdmp, rxnav, logserver or *), of: {', '.join(DEFAULTS)}")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--app-log', help="file for app output; default a temporary file")
+    parser.add_argument('--output', help="save results as JSON baseline")
+    parser.add_argument('--compare', help="JSON baseline to compare results against")
+    args = parser.parse_args()
+
+    options = parse_settings(args.set)
+    run_id = uuid.uuid4().hex[:8]
+    session_ids = [f'loadtest-{run_id}-{i}' for i in range(args.sessions)]
+    redis_handle = redis.StrictRedis.from_url(args.redis_url)
+    upstreams = start_upstreams(options, seed=args.seed)
+    for i, session_id in enumerate(session_ids):
+        seed_session(
+            redis_handle, session_id, iss=upstreams['ehr'].url, patient_id=f'loadtest-patient-{i}')
+
+    log_file = (
+        open(args.app_log, 'w') if args.app_log
+        else tempfile.NamedTemporaryFile('w', prefix='loadtest-', suffix='.log', delete=False))
+    port = free_port()
+    urls = [
+        f'http://127.0.0.1:{port}/fhir-router/{session_id}/MedicationRequest'
+        for session_id in session_ids]
+    process = None
+    try:
+        process = start_app(port, upstreams, args, run_id, log_file)
+        drive(urls, args.warmup, min(args.concurrency, args.warmup or 1), args.timeout)
+        warmup_calls = {name: dict(upstream.calls) for name, upstream in upstreams.items()}
+        for upstream in upstreams.values():
+            upstream.reset()
+        results, elapsed = drive(urls, args.requests, args.concurrency, args.timeout)
+        # let queued audit events reach the logserver
+        time.sleep(2)
+        summary = summarize(results, elapsed, upstreams)
+        summary['warmup_upstream_calls'] = warmup_calls
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        log_file.close()
+        for upstream in upstreams.values():
+            upstream.stop()
+        redis_handle.delete(*(SESSION_KEY_PREFIX + session_id for session_id in session_ids))
+        for key in redis_handle.scan_iter(match=f'loadtest-{run_id}:*'):
+            redis_handle.delete(key)
+
+    report = {
+        'version': version(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'python': sys.version.split()[0],
+        'config': {
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'concurrency': args.concurrency,
+            'sessions': args.sessions,
+            'workers': args.workers,
+            'threads': args.threads,
+            'seed': args.seed,
+            'upstreams': {name: dict(DEFAULTS, **opts) for name, opts in options.items()},
+        },
+        'results': summary,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['config'] != report['config']:
+            print("warning: baseline config differs", file=sys.stderr)
+        compare(baseline, report)
+
+
+if __name__ == '__main__':
+    main()
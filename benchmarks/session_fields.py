@@ -0,0 +1,62 @@
+"""Benchmark of reading hot values from a pickled session blob vs hash fields
+
+Compares bytes transferred and decode time, for a representative session
+(w/ token response), w/o redis:
+
+    python benchmarks/session_fields.py
+"""
+import base64
+import os
+import pickle
+import timeit
+
+from sof_wrapper.session_fields import HOT_KEYS, decode_fields, encode_fields, lookup
+
+
+def jwt(size):
+    return base64.urlsafe_b64encode(os.urandom(size)).decode('ascii')
+
+
+def session_data():
+    return {
+        'iss': 'https://fhir.example.org/r4',
+        'launch_token_patient': '12742400',
+        'subject': 'Patient/12742400',
+        'user': 'Provider/4464007',
+        '_permanent': True,
+        'token_response': {
+            'access_token': jwt(1200),
+            'id_token': jwt(900),
+            'refresh_token': jwt(200),
+            'token_type': 'Bearer',
+            'expires_in': 570,
+            'scope': 'launch patient/*.read openid fhirUser',
+            'patient': '12742400',
+            'need_patient_banner': False,
+            'smart_style_url': 'https://fhir.example.org/style.json',
+        },
+    }
+
+
+def main(number=10000):
+    data = session_data()
+    blob = pickle.dumps(data)
+    fields = encode_fields(data)
+    keys = HOT_KEYS
+    # as returned by HMGET
+    values = [fields.get(key).encode('utf-8') if key in fields else None for key in keys]
+
+    def decode_blob():
+        decoded = pickle.loads(blob)
+        return {key: lookup(decoded, key) for key in keys}
+
+    blob_time = timeit.timeit(decode_blob, number=number)
+    fields_time = timeit.timeit(lambda: decode_fields(keys, values), number=number)
+
+    print(f"blob:   {len(blob)} bytes, {blob_time / number * 1e6:.2f} us to decode")
+    print(f"fields: {sum(len(v) for v in values if v)} bytes, "
+          f"{fields_time / number * 1e6:.2f} us to decode")
+
+
+if __name__ == '__main__':
+    main()
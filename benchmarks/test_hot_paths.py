@@ -0,0 +1,183 @@
+"""Micro-benchmarks of per-medication hot paths
+
+Time and peak memory of bundle handling, for synthetic bundles of 10 to
+5000 entries mixing the codings of the fixtures in `tests/test_fhir/`.
+Requires pytest-benchmark (the `benchmark` extra) and, for session reads,
+redis at SESSION_REDIS:
+
+    pytest benchmarks --benchmark-autosave
+    pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:10%
+"""
+import pickle
+
+from flask import jsonify
+from pytest import fixture, skip
+from redis.exceptions import ConnectionError
+
+from sof_wrapper.api.fhir import annotate_meds, collate_results
+from sof_wrapper.extensions import drug_class_cache
+from sof_wrapper.rxnav import (
+    RXNORM_SYSTEM,
+    add_drug_classes,
+    drug_class_filter,
+    get_drug_class_index,
+)
+from sof_wrapper.wrapped_session import get_redis_session_data, invalidate_session_data
+
+from fhir_fixtures import BASE_RXCUI, load_fixture
+
+SIZES = (10, 100, 1000, 5000)
+
+
+def with_codings(resource, codings):
+    return dict(resource, medicationCodeableConcept=dict(
+        resource['medicationCodeableConcept'], coding=codings))
+
+
+def synthetic_entries(count):
+    """Return (EMR entries, PDMP entries) totalling `count`
+
+    Of every 20 entries: 12 from the EMR, coded w/ RxNorm only; 7 from the
+    PDMP, coded w/ NDC then RxNorm; 1 from the PDMP, coded w/ NDC only.
+    Repeat fills are common, so there's one distinct RxCUI per 4 entries.
+    """
+    emr_resources = [entry['resource'] for entry in load_fixture('MedicationRequestBundleR4.json')['entry']]
+    # fixture's entries are resources, unwrapped
+    pdmp_resources = load_fixture('PDMP-MedicationRequestBundleR4.json')['entry']
+    distinct = max(count // 4, 1)
+
+    emr_entries, pdmp_entries = [], []
+    for i in range(count):
+        rxcui_coding = {'system': RXNORM_SYSTEM, 'code': str(BASE_RXCUI + i % distinct)}
+        if i % 20 < 12:
+            resource = emr_resources[i % len(emr_resources)]
+            emr_entries.append({'resource': with_codings(resource, [rxcui_coding])})
+            continue
+        resource = pdmp_resources[i % len(pdmp_resources)]
+        ndc_codings = [
+            coding for coding in resource['medicationCodeableConcept']['coding']
+            if coding['system'] != RXNORM_SYSTEM]
+        codings = ndc_codings if i % 20 == 19 else [*ndc_codings, rxcui_coding]
+        pdmp_entries.append({'resource': with_codings(resource, codings)})
+    return emr_entries, pdmp_entries
+
+
+def synthetic_class_ids(bundle, drug_class_index):
+    """Return relevant classIds by RxCUI of given bundle; a third have none"""
+    class_ids = sorted(drug_class_index.class_ids)
+    rxcuis = set()
+    for entry in bundle['entry']:
+        for coding in entry['resource']['medicationCodeableConcept']['coding']:
+            if coding['system'] == RXNORM_SYSTEM:
+                rxcuis.add(coding['code'])
+    return {
+        rxcui: tuple(sorted(
+            class_ids[(int(rxcui) + i) % len(class_ids)] for i in range(int(rxcui) % 3)))
+        for rxcui in rxcuis}
+
+
+@fixture
+def request_context(app):
+    with app.test_request_context():
+        yield
+
+
+@fixture(params=SIZES, ids=lambda size: f'{size}-entries')
+def sources(request):
+    """Returns (EMR bundle, PDMP bundle) of the parametrized total entries"""
+    emr_entries, pdmp_entries = synthetic_entries(request.param)
+    return (
+        {'resourceType': 'Bundle', 'type': 'searchset', 'entry': emr_entries},
+        {'resourceType': 'Bundle', 'type': 'searchset', 'entry': pdmp_entries},
+    )
+
+
+@fixture
+def bundle(sources):
+    return collate_results(*sources, {'entry': []})
+
+
+@fixture
+def drug_class_ids(request_context, bundle):
+    """Returns classIds by RxCUI of bundle, also cached as if looked up before"""
+    drug_class_index = get_drug_class_index()
+    class_ids = synthetic_class_ids(bundle, drug_class_index)
+    for rxcui, ids in class_ids.items():
+        drug_class_cache.set(rxcui, drug_class_index.digest, ids, ttl=3600)
+    yield class_ids
+    drug_class_cache.clear()
+
+
+def test_collate_results(measure, sources):
+    result = measure(collate_results, *sources, {'entry': []})
+    assert result['total'] == sum(len(source['entry']) for source in sources)
+
+
+def test_annotate_meds(measure, bundle, drug_class_ids):
+    result = measure(annotate_meds, bundle)
+    assert len(result['entry']) == len(bundle['entry'])
+
+
+def test_add_drug_classes(measure, bundle, drug_class_ids):
+    drug_class_index = get_drug_class_index()
+
+    def annotate():
+        return [
+            add_drug_classes(
+                entry['resource'], rxnav_url=None, drug_class_ids=drug_class_ids,
+                drug_class_index=drug_class_index)
+            for entry in bundle['entry']]
+
+    assert len(measure(annotate)) == len(bundle['entry'])
+
+
+def test_drug_class_filter(measure, bundle, drug_class_ids):
+    # RxNav responses list a drug's classes of several sources; only some relevant
+    rxnav_responses = [
+        {'rxclassDrugInfoList': {'rxclassDrugInfo': [
+            {'rxclassMinConceptItem': {'classId': class_id}}
+            for class_id in (*class_ids, 'N0000175694', 'D007396', 'N02AX')]}}
+        for class_ids in drug_class_ids.values()]
+
+    def filter_all():
+        return [tuple(drug_class_filter(rxnav_response)) for rxnav_response in rxnav_responses]
+
+    assert len(measure(filter_all)) == len(rxnav_responses)
+
+
+def test_json_encode(measure, request_context, bundle, drug_class_ids):
+    annotated_bundle = annotate_meds(bundle)
+    response = measure(jsonify, annotated_bundle)
+    assert response.status_code == 200
+
+
+def test_get_redis_session_data(measure, app, request_context):
+    redis_handle = app.config['SESSION_REDIS']
+    session_key = f"{app.config.get('SESSION_KEY_PREFIX', 'session:')}benchmark-session"
+    # as after launch: tokens dominate size
+    session_data = {
+        'iss': 'https://launch.smarthealthit.org/v/r4/fhir',
+        'launch_token_patient': '5c41cecf-cf81-434f-9da7-e24e5a99dbc2',
+        'token_response': {
+            'access_token': 'x' * 1200,
+            'id_token': 'y' * 900,
+            'refresh_token': 'z' * 400,
+            'scope': 'launch openid fhirUser patient/*.read',
+            'token_type': 'Bearer',
+            'expires_in': 3600,
+            'patient': '5c41cecf-cf81-434f-9da7-e24e5a99dbc2',
+        },
+    }
+    try:
+        redis_handle.set(session_key, pickle.dumps(session_data))
+    except ConnectionError:
+        skip("redis unavailable")
+
+    def read():
+        invalidate_session_data()
+        return get_redis_session_data('benchmark-session')
+
+    try:
+        assert measure(read) == session_data
+    finally:
+        redis_handle.delete(session_key)
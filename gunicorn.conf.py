@@ -0,0 +1,9 @@
+# gunicorn reads ./gunicorn.conf.py by default; settings are otherwise given on the command line
+import os
+
+
+def child_exit(server, worker):
+    # drop metrics of exited workers' `livesum` gauges; see sof_wrapper.metrics
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,10 +1,17 @@
-import requests
-
-from flask import Blueprint, current_app, g, request
+from flask import Blueprint, Response, current_app, g, jsonify, request
+import timeit
 
 from sof_wrapper.audit import audit_entry
+from sof_wrapper.deadline import remaining, start_deadline, upstream_timeout
+from sof_wrapper.extensions import upstream_sessions
+from sof_wrapper.fanout import SourceUnavailable, fan_out
 from sof_wrapper.jsonify_abort import jsonify_abort
-from sof_wrapper.rxnav import add_drug_classes
+from sof_wrapper.paging import bundle_pages, merge_pages
+from sof_wrapper.patient_cache import cache_patient, get_cached_patient, invalidate_patient
+from sof_wrapper.pdmp_client import pdmp_client
+from sof_wrapper.response_cache import cached_get
+from sof_wrapper.rxnav import add_drug_classes, get_drug_class_ids_batch, get_drug_class_index, rxnorm_code
+from sof_wrapper.singleflight import flight_key, single_flight
 from sof_wrapper.wrapped_session import get_session_value
 
 blueprint = Blueprint('fhir', __name__)
@@ -12,6 +19,9 @@ r2prefix = '/v/r2/fhir'
 r4prefix = '/v/r4/fhir'
 
 PROXY_HEADERS = ('Authorization', 'Cache-Control', 'Content-Type')
+# upstream response headers retained when streaming
+STREAMED_RESPONSE_HEADERS = (
+    'Content-Encoding', 'Content-Length', 'Content-Type', 'ETag', 'Last-Modified', 'Location')
 
 def collate_results(*result_sets):
     """Compile given result sets into a single bundle"""
@@ -21,40 +31,115 @@ def collate_results(*result_sets):
         if 'entry' in rs:
             results['entry'].extend(rs['entry'])
 
-    results['total'] = len(results['entry'])
+    results['total'] = match_count(results['entry'])
     return results
 
 
+def match_count(entries):
+    """Return count of given searchset entries, excluding OperationOutcomes"""
+    return sum(
+        1 for entry in entries
+        if entry.get('resource', entry).get('resourceType') != 'OperationOutcome')
+
+
 def annotate_meds(med_bundle):
-    """Annotate bundled resources and return a copy"""
+    """Annotate bundled resources and return a copy
+
+    Drug classes are looked up once per distinct RxCUI in the bundle.
+    Resources w/o a medicationCodeableConcept (such as OperationOutcomes)
+    are included as is.
+    """
+    rxnav_url = current_app.config["RXNAV_URL"]
+    rxcuis = set(
+        rxnorm_code(entry["resource"]) for entry in med_bundle['entry']
+        if "medicationCodeableConcept" in entry["resource"])
+    rxcuis.discard(None)
+    drug_class_ids = get_drug_class_ids_batch(
+        rxcuis, rxnav_url=rxnav_url, timeout=remaining())
+    drug_class_index = get_drug_class_index()
+
     annotated_bundle = med_bundle.copy()
     annotated_bundle['entry'] = []
 
     for resource in med_bundle['entry']:
+        if "medicationCodeableConcept" not in resource["resource"]:
+            annotated_bundle['entry'].append(resource)
+            continue
         annotated_bundle['entry'].append(
-            {"resource": add_drug_classes(resource["resource"], rxnav_url=current_app.config["RXNAV_URL"])}
+            {"resource": add_drug_classes(
+                resource["resource"],
+                rxnav_url=rxnav_url,
+                drug_class_ids=drug_class_ids,
+                drug_class_index=drug_class_index,
+            )}
         )
+
+    if rxcuis.difference(drug_class_ids):
+        annotated_bundle['entry'].append(
+            missing_source_outcome("RxNav drug classes"))
     return annotated_bundle
 
 
+def missing_source_outcome(source):
+    """Return searchset entry noting results from given source are unavailable"""
+    return {
+        "resource": {
+            "resourceType": "OperationOutcome",
+            "issue": [{
+                "severity": "warning",
+                "code": "incomplete",
+                "diagnostics": f"{source} unavailable; request deadline exceeded or source failing",
+            }],
+        },
+        "search": {"mode": "outcome"},
+    }
+
+
+def merged_meds(pdmp_fetch, emr_fetch):
+    """Return annotated bundle of meds fetched concurrently from PDMP and EMR
+
+    Bounded by MED_REQUEST_DEADLINE seconds, of which MED_ANNOTATION_BUDGET
+    is reserved for annotation.  Sources not responding in time are left
+    out, as are those failing fast (see `pdmp_client`), noted by an
+    OperationOutcome entry.
+    """
+    config = current_app.config
+    start_deadline(config['MED_REQUEST_DEADLINE'])
+    sources = {'PDMP': pdmp_fetch, 'EMR': emr_fetch}
+    results, _ = fan_out(
+        sources, timeout=max(remaining() - config['MED_ANNOTATION_BUDGET'], 0))
+
+    missing = [
+        missing_source_outcome(f"{source} results")
+        for source in sources if source not in results]
+    return annotate_meds(collate_results(*results.values(), {'entry': missing}))
+
+
 def emr_meds(emr_url, params, headers):
     upstream_headers = {}
     for header_name in PROXY_HEADERS:
         if header_name in request.headers:
             upstream_headers[header_name] = request.headers[header_name]
 
-    response = requests.get(
-        url=emr_url,
-        params=params,
-        headers=upstream_headers,
-    )
-    response.raise_for_status()
+    def fetch():
+        response = upstream_sessions.request(
+            'GET',
+            url=emr_url,
+            params=params,
+            headers=upstream_headers,
+            timeout=upstream_timeout(),
+        )
+        response.raise_for_status()
+        current_app.logger.debug(
+            "emr returned first page of MedicationRequests in %f seconds",
+            response.elapsed.total_seconds(),
+        )
+        return merge_pages(bundle_pages(response.json(), emr_url, upstream_headers))
+
+    bundle = single_flight.do(flight_key('emr', emr_url, params, upstream_headers), fetch)
     current_app.logger.debug(
-        "emr returned %d MedicationRequests in %f seconds",
-        len(response.json().get("entry", [])),
-        response.elapsed.total_seconds(),
-    )
-    return response.json()
+        "emr returned %d MedicationRequests", len(bundle.get("entry", [])))
+    return bundle
 
 
 @blueprint.route(f'{r4prefix}/emr/MedicationRequest', defaults={'patient_id': None})
@@ -142,22 +227,23 @@ def pdmp_med_orders(**kwargs):
 
 
 def pdmp_meds(pdmp_url, params):
-    response = requests.get(pdmp_url, params=params)
-    response.raise_for_status()
+    def fetch():
+        return pdmp_client.get(pdmp_url, params=params, timeout=upstream_sessions.timeout)
+
+    start_time = timeit.default_timer()
+    bundle = single_flight.do(flight_key('pdmp', pdmp_url, params), fetch)
     audit_entry(
         "PDMP facade returned {} MedicationRequest/Orders in {} seconds".format(
-            len(response.json().get("entry", [])),
-            response.elapsed.total_seconds(),
+            len(bundle.get("entry", [])),
+            timeit.default_timer() - start_time,
         ),
         extra={'tags': ['PDMP', 'MedicationRequest']}
     )
-    return response.json()
+    return bundle
 
 
-@blueprint.route(f'{r4prefix}/MedicationRequest/<string:patient_id>')
-@blueprint.route(f'{r4prefix}/MedicationRequest', defaults={'patient_id': None})
-def medication_request(patient_id=None):
-    """Return compiled list of MedicationRequests from available endpoints"""
+def pdmp_patient_args(patient_id):
+    """Return PDMP query parameters identifying the given patient"""
     pdmp_args = {}
     if patient_id:
         patient_fhir = patient_by_id(patient_id)
@@ -167,31 +253,33 @@ def medication_request(patient_id=None):
             'name'][0]['given'][0]
         pdmp_args['subject:Patient.birthdate'] = (
             f"eq{patient_fhir['birthDate']}")
+    return pdmp_args
+
+
+@blueprint.route(f'{r4prefix}/MedicationRequest/<string:patient_id>')
+@blueprint.route(f'{r4prefix}/MedicationRequest', defaults={'patient_id': None})
+def medication_request(patient_id=None):
+    """Return compiled list of MedicationRequests from available endpoints
 
-    return annotate_meds(collate_results(
-        pdmp_med_requests(**pdmp_args),
-        emr_med_requests(patient_id),
-    ))
+    PDMP and EMR requests are made concurrently
+    """
+    return merged_meds(
+        pdmp_fetch=lambda: pdmp_med_requests(**pdmp_patient_args(patient_id)),
+        emr_fetch=lambda: emr_med_requests(patient_id),
+    )
 
 
 @blueprint.route(f'{r2prefix}/MedicationOrder/<string:patient_id>')
 @blueprint.route(f'{r2prefix}/MedicationOrder', defaults={'patient_id': None})
 def medication_order(patient_id):
-    """Return compiled list of MedicationOrders from available endpoints"""
-    pdmp_args = {}
-    if patient_id:
-        patient_fhir = patient_by_id(patient_id)
-        pdmp_args['subject:Patient.name.family'] = patient_fhir[
-            'name'][0]['family']
-        pdmp_args['subject:Patient.name.given'] = patient_fhir[
-            'name'][0]['given'][0]
-        pdmp_args['subject:Patient.birthdate'] = (
-            f"eq{patient_fhir['birthDate']}")
+    """Return compiled list of MedicationOrders from available endpoints
 
-    return annotate_meds(collate_results(
-        pdmp_med_orders(**pdmp_args),
-        emr_med_orders(patient_id),
-    ))
+    PDMP and EMR requests are made concurrently
+    """
+    return merged_meds(
+        pdmp_fetch=lambda: pdmp_med_orders(**pdmp_patient_args(patient_id)),
+        emr_fetch=lambda: emr_med_orders(patient_id),
+    )
 
 
 @blueprint.route(f'{r2prefix}/Observation')
@@ -202,7 +290,8 @@ def observations():
     # todo: lookup from frontend with Patient details
     phr_params = {'patient._id': '53b07006-f454-ea11-8241-0a0332b55c97'}
 
-    phr_observations = requests.get(
+    phr_observations = upstream_sessions.request(
+        'GET',
         url=phr_url,
         params=phr_params,
         headers={
@@ -217,10 +306,9 @@ def observations():
 @blueprint.route(f'{r4prefix}/Patient/<string:id>')
 def patient_by_id(id):
     base_url = get_session_value('iss')
-    key = f'patient_{id}'
-    value = get_session_value(key)
-    if value:
-        return value
+    patient_fhir = get_cached_patient(base_url, id)
+    if patient_fhir:
+        return patient_fhir
 
     patient_url = f'{base_url}/Patient/{id}'
 
@@ -230,14 +318,19 @@ def patient_by_id(id):
         if header_name in request.headers:
             upstream_headers[header_name] = request.headers[header_name]
 
-    response = requests.get(
-        url=patient_url,
-        headers=upstream_headers,
-    )
-    response.raise_for_status()
-    current_app.logger.debug("returned Patient in %f seconds", response.elapsed.total_seconds())
-    patient_fhir = response.json()
-    # TODO when possible w/o session cookie: set_session_value(key, patient_fhir)
+    def fetch():
+        response = upstream_sessions.request(
+            'GET',
+            url=patient_url,
+            headers=upstream_headers,
+            timeout=upstream_timeout(),
+        )
+        response.raise_for_status()
+        current_app.logger.debug("returned Patient in %f seconds", response.elapsed.total_seconds())
+        return response.json()
+
+    patient_fhir = single_flight.do(flight_key('patient', patient_url, upstream_headers), fetch)
+    cache_patient(base_url, id, patient_fhir)
 
     return patient_fhir
 
@@ -250,7 +343,7 @@ def route_fhir(relative_path, session_id):
     current_app.logger.debug('received session_id as path parameter: %s', session_id)
 
     # prefer patient ID baked into access token JWT by EHR; fallback to initial transparent launch token for fEMR
-    patient_id = get_session_value('token_response', {}).get('patient') or get_session_value('launch_token_patient')
+    patient_id = get_session_value('token_response.patient') or get_session_value('launch_token_patient')
     if not patient_id:
         return jsonify_abort(status_code=400, message="no patient ID found in session; can't continue")
 
@@ -278,21 +371,78 @@ def route_fhir(relative_path, session_id):
         if header_name in request.headers:
             upstream_headers[header_name] = request.headers[header_name]
 
-    upstream_response = requests.request(
-        url=upstream_fhir_url,
+    if request.method == 'GET' and current_app.config['FHIR_ROUTER_CACHE_TTL']:
+        return cached_get(
+            upstream_fhir_url, list(request.args.items(multi=True)), upstream_headers,
+            patient_id)
+
+    streaming = current_app.config['FHIR_ROUTER_STREAMING']
+    if streaming:
+        # upstream bytes are passed through w/o decoding; only accept encodings the client does
+        upstream_headers['Accept-Encoding'] = request.headers.get('Accept-Encoding', 'identity')
+
+    upstream_response = upstream_sessions.request(
         method=request.method,
+        url=upstream_fhir_url,
         json=request.json,
         data=request.data,
         headers=upstream_headers,
         params=request.args,
+        stream=streaming,
     )
+    if request.method != 'GET':
+        invalidate_changed_patient(iss, relative_path)
+
+    if streaming:
+        current_app.logger.debug(
+            "FHIR server began returning %s in %f seconds",
+            relative_path,
+            upstream_response.elapsed.total_seconds(),
+        )
+        return stream_upstream_response(upstream_response)
+
     upstream_response.raise_for_status()
     current_app.logger.debug(
         "FHIR server returned %s in %f seconds",
         relative_path,
         upstream_response.elapsed.total_seconds(),
     )
-    return upstream_response.json()
+    resource = upstream_response.json()
+    if (request.method == 'GET' and current_app.config['FHIR_ROUTER_FOLLOW_NEXT']
+            and resource.get('resourceType') == 'Bundle'):
+        return merge_pages(bundle_pages(resource, upstream_fhir_url, upstream_headers))
+    return resource
+
+
+def invalidate_changed_patient(iss, relative_path):
+    """Remove Patient from cache if given path may have changed it"""
+    paths = relative_path.strip('/').split('/')
+    if len(paths) > 1 and paths[0] == 'Patient':
+        invalidate_patient(iss, paths[1])
+
+
+def stream_upstream_response(upstream_response):
+    """Return response passing upstream bytes through to the client as received
+
+    Status code and relevant headers are retained; the body is neither
+    decoded nor parsed, keeping memory use flat regardless of payload size
+    """
+    headers = {
+        header_name: upstream_response.headers[header_name]
+        for header_name in STREAMED_RESPONSE_HEADERS
+        if header_name in upstream_response.headers
+    }
+    body = upstream_response.raw.stream(
+        current_app.config['FHIR_ROUTER_CHUNK_SIZE'], decode_content=False)
+
+    response = Response(body, status=upstream_response.status_code, headers=headers)
+    response.call_on_close(upstream_response.close)
+    return response
+
+
+@blueprint.errorhandler(SourceUnavailable)
+def source_unavailable(error):
+    return jsonify(message=str(error)), 503
 
 
 @blueprint.after_request
@@ -5,6 +5,8 @@ import os
 import uuid
 
 from sof_wrapper.audit import audit_entry
+from sof_wrapper.debug_output import debug_output_path
+from sof_wrapper.pdmp_client import pdmp_client
 
 base_blueprint = Blueprint('base', __name__)
 
@@ -14,6 +16,12 @@ def root():
     return {'ok': True}
 
 
+@base_blueprint.route('/status/pdmp')
+def pdmp_status():
+    """Return PDMP client circuit breaker state and latency, for monitoring"""
+    return pdmp_client.status()
+
+
 @base_blueprint.route('/auditlog', methods=('POST',))
 def auditlog_addevent():
     """Add event to audit log
@@ -143,14 +151,10 @@ def save_data():
                 message=f"missing required '{item}' in post"), 400
 
     filename = body.get('filename', str(uuid.uuid4()))
-    location = current_app.config['DEBUG_OUTPUT_DIR']
-    if not (os.path.isdir(location)):
-        return jsonify(
-            message="ill configured, can't find DEBUG_OUTPUT_DIR"), 400
-    full_path = os.path.join(location, filename)
-    if os.path.dirname(full_path) != location:
-        return jsonify(
-            message="no path info allowed in `filename` parameter"), 400
+    try:
+        full_path = debug_output_path(filename)
+    except ValueError as ex:
+        return jsonify(message=str(ex)), 400
 
     if os.path.exists(full_path):
         pass  # overwrite by design on subsequent request
@@ -5,9 +5,12 @@ from logging import config as logging_config
 import os
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from sof_wrapper import auth, api
-from sof_wrapper.audit import audit_entry, audit_log_init
-from sof_wrapper.extensions import oauth, sess
+from sof_wrapper import auth, api, metrics, profiler, tracing
+from sof_wrapper.audit import audit_aggregation_init, audit_entry, audit_log_init
+from sof_wrapper.commands import register_commands
+from sof_wrapper.extensions import drug_class_cache, oauth, sess, upstream_sessions
+from sof_wrapper.session_fields import FieldsRedisSessionInterface
+from sof_wrapper.warmup import start_warmup
 
 
 def create_app(testing=False, cli=False):
@@ -21,6 +24,10 @@ def create_app(testing=False, cli=False):
     configure_logging(app)
     configure_extensions(app, cli)
     register_blueprints(app)
+    register_commands(app)
+    tracing.init_app(app)
+    metrics.init_app(app)
+    profiler.init_app(app)
     configure_proxy(app)
 
     return app
@@ -39,6 +46,7 @@ def configure_logging(app):
     app.logger.debug(
         "cosri confidential backend logging initialized",
         extra={'tags': ['testing', 'logging', 'app']})
+    audit_aggregation_init(app)
 
     if not app.config['LOGSERVER_URL']:
         return
@@ -55,6 +63,17 @@ def configure_extensions(app, cli):
     """
     oauth.init_app(app)
     sess.init_app(app)
+    if app.config['SESSION_FIELDS']:
+        app.session_interface = FieldsRedisSessionInterface(
+            app.config['SESSION_REDIS'],
+            app.config.get('SESSION_KEY_PREFIX', 'session:'),
+            app.config.get('SESSION_USE_SIGNER', False),
+            app.config.get('SESSION_PERMANENT', True),
+            fields_prefix=app.config['SESSION_FIELDS_PREFIX'])
+    upstream_sessions.init_app(app)
+    drug_class_cache.init_app(app)
+    # on first request, as the app factory also serves CLI commands
+    app.before_first_request(lambda: start_warmup(app))
 
 
 def register_blueprints(app):
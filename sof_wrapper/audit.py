@@ -2,25 +2,142 @@
 
 functions to simplify adding context and extra data to log messages destined for audit logs
 """
+from collections import Counter, OrderedDict
 from copy import deepcopy
 from flask import current_app, has_app_context
 import logging
+import threading
+import time
 
 from sof_wrapper.logserverhandler import LogServerHandler
+from sof_wrapper.spool import Spool
 from sof_wrapper.wrapped_session import get_session_value
 
 EVENT_LOG_NAME = "confidential_backend_event_logger"
 
 
+def session_context():
+    """Return (user, subject) of the current session, as added to audit entries"""
+    if not has_app_context():
+        return None, None
+    return get_session_value('user'), get_session_value('subject')
+
+
+class AuditAggregator(object):
+    """Fold repeated audit events into one periodic summary event
+
+    The first event per key (such as an RxCUI) within `window` seconds is
+    logged as usual; repeats are only counted, and reported once the window
+    closes in a summary event per user and subject, with counts by key.
+    Counts pending at shutdown are dropped; first events were already logged.
+    """
+
+    def __init__(self, tag, window=0):
+        self.tag = tag
+        self.window = window
+        self.version = None
+        # expiry by key, in order first seen; all share the window, so expire in order
+        self._seen = OrderedDict()
+        # repeats counted by key, per (user, subject)
+        self._counts = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def repeated(self, key):
+        """Return True if key was logged within the window, counting the repeat"""
+        if not self.window:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            while self._seen and next(iter(self._seen.values())) <= now:
+                self._seen.popitem(last=False)
+            if key not in self._seen:
+                self._seen[key] = now + self.window
+                return False
+
+        # session values may require a redis request; don't hold the lock
+        context = session_context()
+        with self._lock:
+            self._counts.setdefault(context, Counter())[key] += 1
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return True
+
+    def flush(self):
+        """Log summary of repeats counted since last flush, if any"""
+        with self._lock:
+            counts_by_context, self._counts = self._counts, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        for (user, subject), counts in counts_by_context.items():
+            extra = {
+                'tags': [self.tag, 'aggregated'],
+                'counts': dict(counts),
+                'window': self.window,
+                'version': self.version,
+            }
+            if user:
+                extra['user'] = user
+            if subject:
+                extra['subject'] = subject
+            logging.getLogger(EVENT_LOG_NAME).warning(
+                f"{sum(counts.values())} repeated '{self.tag}' events for {len(counts)} codes",
+                extra=extra)
+
+
+rxnorm_code_lookup_failed = AuditAggregator('rxnorm-code-lookup-failed')
+rxnorm_drug_class_not_found = AuditAggregator('rxnorm-drug-class-not-found')
+
+
 def audit_log_init(app):
+    spool = None
+    if app.config['LOGSERVER_SPOOL_DIR']:
+        spool = Spool(
+            app.config['LOGSERVER_SPOOL_DIR'],
+            segment_size=app.config['LOGSERVER_SPOOL_SEGMENT_SIZE'],
+            max_bytes=app.config['LOGSERVER_SPOOL_MAX_BYTES'])
+
     log_server_handler = LogServerHandler(
         jwt=app.config['LOGSERVER_TOKEN'],
-        url=app.config['LOGSERVER_URL'])
+        url=app.config['LOGSERVER_URL'],
+        batch_size=app.config['LOGSERVER_BATCH_SIZE'],
+        flush_interval=app.config['LOGSERVER_FLUSH_INTERVAL'],
+        queue_size=app.config['LOGSERVER_QUEUE_SIZE'],
+        bulk=app.config['LOGSERVER_BULK'],
+        overflow=app.config['LOGSERVER_OVERFLOW'],
+        spool=spool)
     event_logger = logging.getLogger(EVENT_LOG_NAME)
     event_logger.setLevel(logging.INFO)
     event_logger.addHandler(log_server_handler)
 
 
+def log_server_handlers():
+    return [
+        handler for handler in logging.getLogger(EVENT_LOG_NAME).handlers
+        if isinstance(handler, LogServerHandler)]
+
+
+def audit_queue_depth():
+    """Return count of audit events queued in memory, not yet sent or spooled"""
+    return sum(handler.depth for handler in log_server_handlers())
+
+
+def audit_spool_depth():
+    """Return bytes of audit events spooled, not yet shipped"""
+    return sum(handler.spool.depth() for handler in log_server_handlers() if handler.spool)
+
+
+def audit_aggregation_init(app):
+    for aggregator in (rxnorm_code_lookup_failed, rxnorm_drug_class_not_found):
+        aggregator.window = app.config['AUDIT_AGGREGATION_WINDOW']
+        aggregator.version = app.config['VERSION_STRING']
+
+
 def audit_entry(message, level='info', extra=None):
     """Log entry, adding in session info such as active user"""
     try:
@@ -1,9 +1,8 @@
 from flask import Blueprint, current_app, redirect, request, url_for, session
-import requests
 
 from sof_wrapper.audit import audit_entry
 from sof_wrapper.auth.helpers import extract_payload, format_as_jwt
-from sof_wrapper.extensions import oauth
+from sof_wrapper.extensions import oauth, upstream_sessions
 
 
 # SMIT launch token encoding scheme
@@ -88,7 +87,8 @@ def launch():
 
     # fetch conformance statement from /metadata
     ehr_metadata_url = '%s/metadata' % iss
-    metadata = requests.get(
+    metadata = upstream_sessions.request(
+        'GET',
         ehr_metadata_url,
         headers={'Accept': 'application/json'},
     )
@@ -0,0 +1,131 @@
+"""Flask CLI commands
+
+Registered with the app by `create_app`; invoke via `flask <command>`
+"""
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+import os
+import pickle
+
+from sof_wrapper.extensions import drug_class_cache
+from sof_wrapper.rxclass_index import build_index, pairs_from_export, pairs_from_rxnav_snapshot
+from sof_wrapper.rxnav import drug_class_map_path, get_drug_class_index
+from sof_wrapper.session_fields import migrate_sessions
+from sof_wrapper.warmup import rxcuis_from_file, warm_up
+
+
+@click.command('reload-drug-class-map')
+def reload_drug_class_map():
+    """Signal workers on this host to reload the drug class map
+
+    Workers reload the map when its mtime changes; update it.  The map file
+    is local to each host (or container), so only workers sharing this
+    filesystem reload; update the file and run this on each host
+    """
+    filepath = drug_class_map_path()
+    os.utime(filepath)
+    click.echo(f"updated mtime of {filepath}; workers on this host reload on next use")
+
+
+@click.command('build-rxclass-index')
+@click.option(
+    '--export', 'export_file', type=click.File('r'),
+    help="delimited RxClass export, w/ `rxcui` and `classId` columns")
+@click.option(
+    '--rxnav-snapshot', 'snapshot_file', type=click.File('r'),
+    help="JSON lines of harvested RxNav byRxcui.json responses")
+@click.option('--output', help="index file to write; defaults to RXCLASS_INDEX_PATH")
+@with_appcontext
+def build_rxclass_index(export_file, snapshot_file, output):
+    """Build local RxClass index, retaining classIds relevant to rx-class-map.json"""
+    output = output or current_app.config['RXCLASS_INDEX_PATH']
+    if not output:
+        raise click.UsageError("--output required w/o RXCLASS_INDEX_PATH configured")
+    if bool(export_file) == bool(snapshot_file):
+        raise click.UsageError("provide one of --export or --rxnav-snapshot")
+
+    if export_file:
+        pairs = pairs_from_export(export_file)
+    else:
+        pairs = pairs_from_rxnav_snapshot(snapshot_file)
+
+    count = build_index(output, pairs, get_drug_class_index().class_ids)
+    click.echo(f"indexed {count} RxCUIs to {output}")
+
+
+@click.command('evict-drug-class-cache')
+@click.argument('rxcuis', nargs=-1)
+@click.option('--all', 'evict_all', is_flag=True, help="evict all cached drug classes")
+@with_appcontext
+def evict_drug_class_cache(rxcuis, evict_all):
+    """Evict given RxCUIs (or all) from the shared drug class cache
+
+    Only the redis tier is shared; workers' in-process entries expire after
+    DRUG_CLASS_CACHE_L1_TTL
+    """
+    if bool(rxcuis) == evict_all:
+        raise click.UsageError("provide RxCUIs or --all")
+
+    if evict_all:
+        drug_class_cache.clear()
+        click.echo("evicted all cached drug classes")
+    else:
+        drug_class_cache.evict(rxcuis, get_drug_class_index().digest)
+        click.echo(f"evicted {len(rxcuis)} RxCUIs from drug class cache")
+
+
+@click.command('warm-drug-class-cache')
+@click.option(
+    '--file', 'rxcuis_file', type=click.File('r'), help="RxCUIs to preload, one per line")
+@click.option(
+    '--recent', type=int,
+    help="also preload RxCUIs fetched within given seconds; defaults to DRUG_CLASS_WARMUP_RECENT")
+@click.option('--rate', type=float, help="max RxNav requests per second")
+@click.option('--concurrency', type=int, help="max concurrent RxNav requests")
+@with_appcontext
+def warm_drug_class_cache(rxcuis_file, recent, rate, concurrency):
+    """Preload drug class cache with RxCUIs from given file and those recently fetched"""
+    config = current_app.config
+    rxcuis = set(drug_class_cache.recently_seen(
+        config['DRUG_CLASS_WARMUP_RECENT'] if recent is None else recent))
+    if rxcuis_file:
+        rxcuis.update(rxcuis_from_file(rxcuis_file))
+
+    def progress(done, total):
+        if done % 100 == 0 or done == total:
+            click.echo(f"{done}/{total}")
+
+    loaded, failed, elapsed = warm_up(
+        rxcuis,
+        rxnav_url=config['RXNAV_URL'],
+        rate=rate or config['DRUG_CLASS_WARMUP_RATE'],
+        concurrency=concurrency or config['RXNAV_MAX_CONCURRENCY'],
+        progress=progress,
+    )
+    click.echo(f"loaded {loaded} RxCUIs ({failed} failed) of {len(rxcuis)} in {elapsed:.1f}s")
+
+
+@click.command('migrate-session-fields')
+@with_appcontext
+def migrate_session_fields():
+    """Mirror hot values of existing sessions to redis hashes; see SESSION_FIELDS
+
+    Run on enabling SESSION_FIELDS; until migrated (or saved), sessions are
+    read from the pickled session
+    """
+    config = current_app.config
+    count = migrate_sessions(
+        config['SESSION_REDIS'],
+        key_prefix=config.get('SESSION_KEY_PREFIX', 'session:'),
+        fields_prefix=config['SESSION_FIELDS_PREFIX'],
+        serializer=pickle)
+    click.echo(f"migrated {count} sessions")
+
+
+def register_commands(app):
+    app.cli.add_command(reload_drug_class_map)
+    app.cli.add_command(build_rxclass_index)
+    app.cli.add_command(evict_drug_class_cache)
+    app.cli.add_command(warm_drug_class_cache)
+    app.cli.add_command(migrate_session_fields)
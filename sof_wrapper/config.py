@@ -6,6 +6,11 @@ import os
 import redis
 
 DEBUG_OUTPUT_DIR = os.getenv("DEBUG_OUTPUT_DIR", '/tmp')
+# profile requests flagged w/ `X-Profile` header or `_profile` query param; see sof_wrapper.profiler
+PROFILING = os.getenv("PROFILING", "false").lower() == "true"
+# client addresses allowed to request profiles on non-development deploys
+PROFILE_ALLOW_LIST = [addr for addr in os.getenv("PROFILE_ALLOW_LIST", "").split(",") if addr]
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
 SERVER_NAME = os.getenv("SERVER_NAME")
 SECRET_KEY = os.getenv("SECRET_KEY")
 # URL scheme to use outside of request context
@@ -13,6 +18,24 @@ PREFERRED_URL_SCHEME = os.getenv("PREFERRED_URL_SCHEME", 'http')
 
 SESSION_TYPE = os.getenv("SESSION_TYPE", 'redis')
 SESSION_REDIS = redis.from_url(os.getenv("SESSION_REDIS", "redis://127.0.0.1:6379"))
+# also store hot session values as JSON fields of a redis hash, for cheap partial reads
+SESSION_FIELDS = os.getenv("SESSION_FIELDS", "false").lower() == "true"
+SESSION_FIELDS_PREFIX = os.getenv("SESSION_FIELDS_PREFIX", 'session-fields:')
+
+# cache EHR Patient resources for given seconds; 0 to disable
+PATIENT_CACHE_TTL = int(os.getenv("PATIENT_CACHE_TTL", 300))
+PATIENT_CACHE_PREFIX = os.getenv("PATIENT_CACHE_PREFIX", 'patient:')
+
+# share in-flight upstream request results across workers via redis, in addition to threads
+SINGLE_FLIGHT_REDIS = os.getenv("SINGLE_FLIGHT_REDIS", "false").lower() == "true"
+SINGLE_FLIGHT_PREFIX = os.getenv("SINGLE_FLIGHT_PREFIX", 'flight:')
+# seconds to wait on another worker's in-flight request
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", 10))
+
+# seconds allowed for merged PDMP & EMR medication requests; sources not responding in time are left out
+MED_REQUEST_DEADLINE = float(os.getenv("MED_REQUEST_DEADLINE", 3))
+# portion of MED_REQUEST_DEADLINE reserved for drug class annotation
+MED_ANNOTATION_BUDGET = float(os.getenv("MED_ANNOTATION_BUDGET", 0.5))
 
 REQUEST_CACHE_URL = os.environ.get('REQUEST_CACHE_URL', 'redis://localhost:6379/0')
 REQUEST_CACHE_EXPIRE = 24 * 60 * 60  # 24 hours
@@ -26,13 +49,41 @@ SOF_AUTHORIZE_URL = os.getenv("SOF_AUTHORIZE_URL")
 
 LOGSERVER_TOKEN = os.getenv('LOGSERVER_TOKEN')
 LOGSERVER_URL = os.getenv('LOGSERVER_URL')
+# audit events are queued and sent in batches of up to LOGSERVER_BATCH_SIZE, at least every LOGSERVER_FLUSH_INTERVAL seconds
+LOGSERVER_BATCH_SIZE = int(os.getenv('LOGSERVER_BATCH_SIZE', 50))
+LOGSERVER_FLUSH_INTERVAL = float(os.getenv('LOGSERVER_FLUSH_INTERVAL', 1.0))
+LOGSERVER_QUEUE_SIZE = int(os.getenv('LOGSERVER_QUEUE_SIZE', 1000))
+# POST each batch as one JSON array; requires logserver bulk insert, otherwise events are POSTed one by one
+LOGSERVER_BULK = os.getenv('LOGSERVER_BULK', 'false').lower() == 'true'
+# when queue is full: 'drop-oldest' or 'block'
+LOGSERVER_OVERFLOW = os.getenv('LOGSERVER_OVERFLOW', 'drop-oldest')
+# optional directory to durably spool audit events to, prior to shipping to the logserver
+LOGSERVER_SPOOL_DIR = os.getenv('LOGSERVER_SPOOL_DIR')
+LOGSERVER_SPOOL_SEGMENT_SIZE = int(os.getenv('LOGSERVER_SPOOL_SEGMENT_SIZE', 4 * 1024 * 1024))
+# per worker process; oldest segments are dropped beyond
+LOGSERVER_SPOOL_MAX_BYTES = int(os.getenv('LOGSERVER_SPOOL_MAX_BYTES', 512 * 1024 * 1024))
+# seconds within which repeated audit events (eg unmapped drug classes) are folded into one summary
+AUDIT_AGGREGATION_WINDOW = int(os.getenv('AUDIT_AGGREGATION_WINDOW', 5 * 60))
 
 # NB log level hardcoded at INFO for logserver
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG').upper()
+# time upstream hops per request, reported via Server-Timing header and a log line
+REQUEST_TRACING = os.getenv('REQUEST_TRACING', 'false').lower() == 'true'
+# serve Prometheus metrics at /metrics; requires the `metrics` extra, see sof_wrapper.metrics
+METRICS = os.getenv('METRICS', 'false').lower() == 'true'
 
 LAUNCH_DEST = os.getenv("LAUNCH_DEST")
 
 PDMP_URL = os.getenv("PDMP_URL")
+# send a second, hedged PDMP request when the first is slower than given latency percentile
+PDMP_HEDGE = os.getenv("PDMP_HEDGE", "true").lower() == "true"
+PDMP_HEDGE_PERCENTILE = float(os.getenv("PDMP_HEDGE_PERCENTILE", 95))
+PDMP_HEDGE_MIN_SAMPLES = int(os.getenv("PDMP_HEDGE_MIN_SAMPLES", 20))
+# fail fast after given consecutive PDMP failures, retrying after given seconds
+PDMP_BREAKER_THRESHOLD = int(os.getenv("PDMP_BREAKER_THRESHOLD", 5))
+PDMP_BREAKER_RESET = float(os.getenv("PDMP_BREAKER_RESET", 30))
+# distinct PDMP queries retaining last good results, served while failing
+PDMP_LAST_GOOD_SIZE = int(os.getenv("PDMP_LAST_GOOD_SIZE", 100))
 # TODO use better indicator
 # use an empty string to indicate demo deploy
 SCRIPT_ENDPOINT_URL = os.getenv("SCRIPT_ENDPOINT_URL")
@@ -41,4 +92,57 @@ PHR_URL = os.getenv("PHR_URL")
 PHR_TOKEN = os.getenv("PHR_TOKEN")
 
 RXNAV_URL = os.getenv("RXNAV_URL", "https://rxnav.nlm.nih.gov")
+# local RxClass index, built by `flask build-rxclass-index`; consulted prior to RxNav
+RXCLASS_INDEX_PATH = os.getenv("RXCLASS_INDEX_PATH")
+# concurrent RxNav lookups, shared by all worker threads
+RXNAV_MAX_CONCURRENCY = int(os.getenv("RXNAV_MAX_CONCURRENCY", 8))
+# drug class cache: in-process LRU (L1) in front of redis at REQUEST_CACHE_URL (L2)
+DRUG_CLASS_CACHE_SIZE = int(os.getenv("DRUG_CLASS_CACHE_SIZE", 4096))
+DRUG_CLASS_CACHE_L1_TTL = int(os.getenv("DRUG_CLASS_CACHE_L1_TTL", 60 * 60))
+# seconds beyond REQUEST_CACHE_EXPIRE expired classIds are served should RxNav fail
+DRUG_CLASS_CACHE_STALE_TTL = int(os.getenv("DRUG_CLASS_CACHE_STALE_TTL", 7 * 24 * 60 * 60))
+# seconds RxCUIs w/o any relevant drug class are cached
+DRUG_CLASS_NEGATIVE_TTL = int(os.getenv("DRUG_CLASS_NEGATIVE_TTL", 60 * 60))
+DRUG_CLASS_CACHE_PREFIX = os.getenv("DRUG_CLASS_CACHE_PREFIX", 'rxclass:')
+# preload drug class cache on first request (such as a readiness probe); see `flask warm-drug-class-cache`
+DRUG_CLASS_WARMUP_ON_STARTUP = os.getenv("DRUG_CLASS_WARMUP_ON_STARTUP", "false").lower() == "true"
+# optional file of RxCUIs to preload, one per line
+DRUG_CLASS_WARMUP_FILE = os.getenv("DRUG_CLASS_WARMUP_FILE")
+# also preload RxCUIs fetched from RxNav within this many seconds
+DRUG_CLASS_WARMUP_RECENT = int(os.getenv("DRUG_CLASS_WARMUP_RECENT", 7 * 24 * 60 * 60))
+# max RxNav requests per second while warming up
+DRUG_CLASS_WARMUP_RATE = float(os.getenv("DRUG_CLASS_WARMUP_RATE", 10))
+# startup warm-up runs in one worker (of any host sharing redis) per this many seconds
+DRUG_CLASS_WARMUP_LOCK_TTL = int(os.getenv("DRUG_CLASS_WARMUP_LOCK_TTL", 10 * 60))
+
+# match gunicorn `--threads` as configured in Dockerfile: 2n+1
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", 2 * os.cpu_count() + 1))
+# threads available for concurrent upstream requests (eg PDMP & EMR), shared by all worker threads
+FANOUT_MAX_WORKERS = int(os.getenv("FANOUT_MAX_WORKERS", 2 * WORKER_THREADS))
+
+# pooled HTTP connections kept per upstream origin (EHR, PDMP, PHR, RxNav, logserver);
+# as many as the concurrent requests one origin may see, lest connections be discarded
+UPSTREAM_POOL_MAXSIZE = int(os.getenv(
+    "UPSTREAM_POOL_MAXSIZE", max(FANOUT_MAX_WORKERS, RXNAV_MAX_CONCURRENCY)))
+# default upstream timeouts, in seconds
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 3.05))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", 30))
+# close upstream sessions unused for given seconds
+UPSTREAM_IDLE_TIMEOUT = int(os.getenv("UPSTREAM_IDLE_TIMEOUT", 300))
+
+# pass non-intercepted /fhir-router responses through as streamed bytes, w/o parsing
+FHIR_ROUTER_STREAMING = os.getenv("FHIR_ROUTER_STREAMING", "false").lower() == "true"
+FHIR_ROUTER_CHUNK_SIZE = int(os.getenv("FHIR_ROUTER_CHUNK_SIZE", 64 * 1024))
+# merge all searchset pages (following `next` links) for buffered /fhir-router GETs
+FHIR_ROUTER_FOLLOW_NEXT = os.getenv("FHIR_ROUTER_FOLLOW_NEXT", "false").lower() == "true"
+
+# cache /fhir-router GET responses w/ validators (ETag, Last-Modified) for given seconds; 0 to disable
+# cached GETs are always buffered, and revalidated upstream on every request
+FHIR_ROUTER_CACHE_TTL = int(os.getenv("FHIR_ROUTER_CACHE_TTL", 0))
+FHIR_ROUTER_CACHE_PREFIX = os.getenv("FHIR_ROUTER_CACHE_PREFIX", 'fhir-response:')
+
+# limits on following searchset `next` links, as done for EMR medications
+EMR_MAX_PAGES = int(os.getenv("EMR_MAX_PAGES", 20))
+EMR_MAX_ENTRIES = int(os.getenv("EMR_MAX_ENTRIES", 2000))
+EMR_PAGING_DEADLINE = float(os.getenv("EMR_PAGING_DEADLINE", 10))
 VERSION_STRING = os.getenv("VERSION_STRING")
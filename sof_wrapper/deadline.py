@@ -0,0 +1,45 @@
+"""Deadline
+
+Per request latency budget.  Upstream timeouts are capped by the time
+remaining, so one slow dependency can't hold a worker thread past the budget.
+"""
+from flask import g, has_app_context
+from requests.exceptions import Timeout
+import timeit
+
+from sof_wrapper.extensions import upstream_sessions
+
+
+def start_deadline(seconds):
+    """Set deadline for the current request, given seconds from now"""
+    g.deadline = timeit.default_timer() + seconds
+
+
+def remaining(default=None):
+    """Return seconds remaining before the current request's deadline, or default if none set"""
+    if not (has_app_context() and g.get('deadline')):
+        return default
+    return g.deadline - timeit.default_timer()
+
+
+def capped_timeout(timeout):
+    """Return given requests timeout, capped by the current request's deadline
+
+    :raises Timeout: if the deadline has already passed
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise Timeout("request deadline exceeded")
+    if isinstance(timeout, tuple):
+        return tuple(min(t, left) for t in timeout)
+    return min(timeout, left)
+
+
+def upstream_timeout():
+    """Return timeout for upstream requests, capped by the current request's deadline
+
+    :raises Timeout: if the deadline has already passed
+    """
+    return capped_timeout(upstream_sessions.timeout)
@@ -0,0 +1,21 @@
+"""Debug output
+
+Helpers for writing debugging artifacts to DEBUG_OUTPUT_DIR
+"""
+from flask import current_app
+import os
+
+
+def debug_output_path(filename):
+    """Return full path for given filename within DEBUG_OUTPUT_DIR
+
+    :raises ValueError: if DEBUG_OUTPUT_DIR isn't a directory, or if the
+      filename includes path info
+    """
+    location = current_app.config['DEBUG_OUTPUT_DIR']
+    if not (os.path.isdir(location)):
+        raise ValueError("ill configured, can't find DEBUG_OUTPUT_DIR")
+    full_path = os.path.join(location, filename)
+    if os.path.dirname(full_path) != location:
+        raise ValueError("no path info allowed in `filename` parameter")
+    return full_path
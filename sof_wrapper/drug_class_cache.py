@@ -0,0 +1,181 @@
+"""Drug class cache
+
+Two tier cache of the (relevant) RxClass classIds per RxCUI:
+- L1: bounded, in-process LRU with a TTL, so lookups of common drugs
+  never leave the process
+- L2: redis, shared by all workers, holding only the compact classId list
+
+Entries are keyed by a digest of the relevant classIds (see
+`rx-class-map.json`), so changes to the map don't serve stale filtering.
+Expired entries are retained for DRUG_CLASS_CACHE_STALE_TTL seconds, to be
+served should RxNav fail.
+"""
+from collections import OrderedDict
+from flask import current_app
+import json
+import redis
+from redis.exceptions import RedisError
+import threading
+import time
+
+from sof_wrapper.stats import get_stats
+
+stats = get_stats('drug_class_cache')
+
+
+class LRUCache(object):
+    """Thread safe, bounded LRU cache with per entry expiry"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return value for key if present and fresh, otherwise None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DrugClassCache(object):
+    """Process-wide drug class cache; configured by `init_app`"""
+
+    def __init__(self):
+        self.l1 = LRUCache(maxsize=4096, ttl=60 * 60)
+        self.l2 = None
+        self.prefix = 'rxclass:'
+        self.stale_ttl = 0
+
+    def init_app(self, app):
+        config = app.config
+        self.l1 = LRUCache(
+            maxsize=config['DRUG_CLASS_CACHE_SIZE'], ttl=config['DRUG_CLASS_CACHE_L1_TTL'])
+        self.l2 = None
+        if not config['TESTING']:
+            self.l2 = redis.StrictRedis.from_url(config['REQUEST_CACHE_URL'])
+        self.prefix = config['DRUG_CLASS_CACHE_PREFIX']
+        self.stale_ttl = config['DRUG_CLASS_CACHE_STALE_TTL']
+
+    def key(self, digest, rxcui):
+        return f"{self.prefix}{digest[:16]}:{rxcui}"
+
+    def get_many(self, rxcuis, digest):
+        """Look up classIds for given RxCUIs, checking L1 then (in one request) L2
+
+        :returns: tuple of dicts keyed by RxCUI: (fresh classIds, stale classIds)
+        """
+        fresh, stale = {}, {}
+        l2_keys = {}
+        for rxcui in rxcuis:
+            class_ids = self.l1.get(self.key(digest, rxcui))
+            if class_ids is not None:
+                stats.incr('l1_hit')
+                if not class_ids:
+                    stats.incr('negative_hit')
+                fresh[rxcui] = class_ids
+            else:
+                l2_keys[rxcui] = self.key(digest, rxcui)
+
+        l2_values = []
+        if l2_keys and self.l2 is not None:
+            try:
+                l2_values = self.l2.mget(list(l2_keys.values()))
+            except RedisError as ex:
+                current_app.logger.warning("drug class cache unavailable: %s", ex)
+
+        now = time.time()
+        for (rxcui, key), value in zip(l2_keys.items(), l2_values):
+            if value is None:
+                continue
+            entry = json.loads(value)
+            class_ids = tuple(entry['class_ids'])
+            if entry['expires'] > now:
+                stats.incr('l2_hit')
+                if not class_ids:
+                    stats.incr('negative_hit')
+                fresh[rxcui] = class_ids
+                self.l1.set(key, class_ids, ttl=min(self.l1.ttl, entry['expires'] - now))
+            else:
+                stale[rxcui] = class_ids
+
+        stats.incr('miss', len(rxcuis) - len(fresh))
+        return fresh, stale
+
+    def set(self, rxcui, digest, class_ids, ttl):
+        """Cache given classIds for ttl seconds, retained as stale for some time beyond"""
+        key = self.key(digest, rxcui)
+        class_ids = tuple(class_ids)
+        self.l1.set(key, class_ids, ttl=min(self.l1.ttl, ttl))
+        if self.l2 is None:
+            return
+
+        entry = json.dumps({'class_ids': class_ids, 'expires': time.time() + ttl})
+        try:
+            self.l2.setex(key, int(ttl + self.stale_ttl), entry)
+        except RedisError as ex:
+            current_app.logger.warning("drug class cache unavailable: %s", ex)
+
+    def evict(self, rxcuis, digest):
+        """Remove given RxCUIs from both tiers"""
+        keys = [self.key(digest, rxcui) for rxcui in rxcuis]
+        for key in keys:
+            self.l1.delete(key)
+        if self.l2 is not None and keys:
+            self.l2.delete(*keys)
+
+    def clear(self):
+        """Remove all entries from both tiers"""
+        self.l1.clear()
+        if self.l2 is not None:
+            for key in self.l2.scan_iter(match=f"{self.prefix}*"):
+                self.l2.delete(key)
+
+    def record_seen(self, rxcuis):
+        """Note given RxCUIs as recently fetched from RxNav, for warming the cache"""
+        if self.l2 is None or not rxcuis:
+            return
+        try:
+            self.l2.zadd(f"{self.prefix}seen", {rxcui: time.time() for rxcui in rxcuis})
+        except RedisError as ex:
+            current_app.logger.warning("drug class cache unavailable: %s", ex)
+
+    def recently_seen(self, seconds):
+        """Return RxCUIs fetched within given seconds, pruning older"""
+        if self.l2 is None:
+            return []
+        key = f"{self.prefix}seen"
+        self.l2.zremrangebyscore(key, '-inf', time.time() - seconds)
+        return [rxcui.decode('utf-8') for rxcui in self.l2.zrange(key, 0, -1)]
+
+    def hit_ratio(self):
+        counts = stats.snapshot()
+        hits = counts.get('l1_hit', 0) + counts.get('l2_hit', 0)
+        total = hits + counts.get('miss', 0)
+        return hits / total if total else None
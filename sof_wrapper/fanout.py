@@ -0,0 +1,105 @@
+"""Fan out
+
+functions to run independent upstream requests concurrently from within a request
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from flask import current_app, g
+from flask.globals import _request_ctx_stack
+from requests.exceptions import ConnectionError, Timeout
+import threading
+import timeit
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class SourceUnavailable(Exception):
+    """Raised by a task to mark its source unavailable, leaving it out of `fan_out` results"""
+
+
+def get_executor(name='fanout', max_workers=None):
+    """Return process-wide, bounded thread pool for given name
+
+    Pools are created on first use and shared by all worker threads.
+    Use a distinct name for tasks submitted from within another pool's
+    tasks, to avoid exhausting a pool with tasks awaiting their own work.
+    """
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(
+                max_workers=max_workers or current_app.config['FANOUT_MAX_WORKERS'],
+                thread_name_prefix=name,
+            )
+        return _executors[name]
+
+
+def in_request_context(fn):
+    """Wrap given function to run in another thread, within the current request context
+
+    Similar to `flask.copy_current_request_context`, but also carries over
+    the values set on `flask.g`, such as `g.session_id` set by `route_fhir`.
+    Outside a request (eg CLI commands) only the app context is carried over.
+    """
+    app = current_app._get_current_object()
+    g_values = {name: g.get(name) for name in g}
+    request_ctx = nullcontext()
+    if _request_ctx_stack.top is not None:
+        request_ctx = _request_ctx_stack.top.copy()
+
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            for name, value in g_values.items():
+                setattr(g, name, value)
+            with request_ctx:
+                return fn(*args, **kwargs)
+    return wrapper
+
+
+def timed(fn):
+    """Wrap given function to return a tuple of (result, elapsed seconds)"""
+    def wrapper(*args, **kwargs):
+        start_time = timeit.default_timer()
+        result = fn(*args, **kwargs)
+        return result, timeit.default_timer() - start_time
+    return wrapper
+
+
+def fan_out(tasks, timeout=None):
+    """Run given callables concurrently, returning results and timings by name
+
+    Each task runs in a pooled worker thread within the current request
+    context, so wall time tracks the slowest task rather than the sum.
+    Exceptions raised by a task are re-raised in the calling thread.
+
+    Tasks not complete within `timeout` seconds, or raising
+    `requests.exceptions.Timeout`, `requests.exceptions.ConnectionError`
+    (as on a read timeout while streaming the response) or
+    `SourceUnavailable`, are left out of the results.
+
+    :param tasks: dict of callables, keyed by name
+    :returns: tuple of dicts, (results, timings) keyed by task name
+    """
+    executor = get_executor()
+    futures = {
+        name: executor.submit(timed(in_request_context(task)))
+        for name, task in tasks.items()
+    }
+    done, _ = wait(futures.values(), timeout=timeout)
+
+    results, timings = {}, {}
+    for name, future in futures.items():
+        if future not in done:
+            current_app.logger.warning("%s not complete within %s seconds", name, timeout)
+            continue
+        try:
+            results[name], timings[name] = future.result()
+        except (Timeout, ConnectionError, SourceUnavailable) as ex:
+            current_app.logger.warning("%s unavailable: %s", name, ex)
+
+    current_app.logger.debug(
+        "fan out completed in %f seconds; %s",
+        max(timings.values(), default=0),
+        ", ".join(f"{name}: {elapsed:f}" for name, elapsed in timings.items()),
+    )
+    return results, timings
@@ -1,32 +1,224 @@
+from collections import deque
 import json
 import logging
+import os
 from pythonjsonlogger.jsonlogger import JsonFormatter
-import requests
 from requests.exceptions import RequestException
+import threading
+import time
+
+from sof_wrapper.extensions import upstream_sessions
+from sof_wrapper.stats import get_stats
+
+stats = get_stats('logserver')
 
 
 class LogServerHandler(logging.Handler):
-    """Specialized logging handler capable of nesting json and passing auth"""
+    """Specialized logging handler capable of nesting json and passing auth
+
+    Events are formatted in the logging thread and queued; a background
+    thread POSTs them in batches to the logserver, as a JSON array given
+    `bulk`, otherwise one event per request.  Should the bounded queue fill,
+    `overflow` determines whether the oldest queued event is dropped
+    ('drop-oldest') or logging blocks for room ('block').
+    Queued events are flushed on `flush` and `close`, as called by
+    `logging.shutdown` on exit.
 
-    def __init__(self, url, jwt):
+    Given a `Spool`, batches are durably spooled instead (sent directly
+    should spooling fail), and a second thread ships spooled events,
+    retrying w/ exponential backoff (up to `max_backoff` seconds) while the
+    logserver is unavailable.  Once caught up, it also drains spools left
+    by exited processes.
+    """
+
+    def __init__(
+            self, url, jwt, batch_size=50, flush_interval=1.0, queue_size=1000,
+            overflow='drop-oldest', spool=None, max_backoff=60, bulk=False):
         super().__init__()
+        if overflow not in ('drop-oldest', 'block'):
+            raise ValueError(f"unknown logserver overflow policy: {overflow}")
         self.jwt = jwt
         self.url = f"{url}/events"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.spool = spool
+        self.max_backoff = max_backoff
+        self.bulk = bulk
         self.setFormatter(JsonFormatter(
             "%(asctime)s %(name)s %(levelname)s %(message)s"))
 
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._flusher = None
+        self._shipper = None
+        self._orphans = []
+        self._flusher_pid = None
+        self._closed = False
+
+    @property
+    def depth(self):
+        """Count of events queued, not yet sent"""
+        return len(self._queue)
+
+    def handle(self, record):
+        """Emit record if it passes filters, w/o holding the handler lock
+
+        `emit` is thread safe, and may block for room; holding the lock would
+        block all logging to this handler, rather than only the caller.
+        """
+        passed = self.filter(record)
+        if passed:
+            self.emit(record)
+        return passed
+
     def emit(self, record):
-        log_entry = self.format(record)
-        log_entry = {"event": json.loads(log_entry)}
+        try:
+            log_entry = {"event": json.loads(self.format(record))}
+        except Exception:
+            self.handleError(record)
+            return
+
+        with self._condition:
+            self._start_flusher()
+            while len(self._queue) >= self.queue_size:
+                if self.overflow == 'block' and not self._closed:
+                    self._condition.wait()
+                    continue
+                self._queue.popleft()
+                stats.incr('dropped')
+            self._queue.append(log_entry)
+            stats.incr('queued')
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify_all()
+
+    def _start_flusher(self):
+        # (re)start after fork, as threads don't survive it
+        if self._closed or (self._flusher and self._flusher_pid == os.getpid()):
+            return
+        self._flusher = threading.Thread(
+            target=self._run, name='logserver-flusher', daemon=True)
+        self._flusher_pid = os.getpid()
+        self._flusher.start()
+        if self.spool:
+            self._shipper = threading.Thread(
+                target=self._ship, name='logserver-shipper', daemon=True)
+            self._shipper.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                while (len(self._queue) < self.batch_size and not self._closed
+                        and time.monotonic() < deadline):
+                    self._condition.wait(deadline - time.monotonic())
+                if self._closed:
+                    return
+            self._send_batch()
+
+    def _take_batch(self):
+        with self._condition:
+            batch = [
+                self._queue.popleft()
+                for _ in range(min(self.batch_size, len(self._queue)))]
+            # make room for any blocked
+            self._condition.notify_all()
+        return batch
+
+    def _send_batch(self):
+        with self._send_lock:
+            batch = self._take_batch()
+            if not batch:
+                return
+            if self.spool:
+                try:
+                    self.spool.append(batch)
+                    return
+                except OSError as ex:
+                    logging.getLogger('root').error("error spooling audit events: %s", ex)
+            self.send(batch)
+
+    def _ship(self):
+        """Ship spooled events until closed, backing off while the logserver fails"""
+        backoff = 0
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+                self._condition.wait(backoff)
+                if self._closed:
+                    return
+
+            # w/o bulk, commit per event, so a failure doesn't resend those sent
+            max_events = self.batch_size if self.bulk else 1
+            spool = self.spool
+            events, position = spool.read(max_events)
+            if not events and not self._orphans:
+                self._orphans = self.spool.orphans()
+            while not events and self._orphans:
+                spool = self._orphans[0]
+                events, position = spool.read(max_events)
+                if not events:
+                    self._orphans.pop(0).close()
+            if not events:
+                backoff = self.flush_interval
+                continue
+            try:
+                self.post(events)
+            except RequestException as ex:
+                stats.incr('retried', len(events))
+                backoff = min(max(backoff * 2, self.flush_interval), self.max_backoff)
+                logging.getLogger('root').error(
+                    "error shipping spooled events to logserver %s; retry in %ss: %s",
+                    self.url, backoff, ex)
+                continue
+            spool.commit(position)
+            stats.incr('sent', len(events))
+            backoff = 0
+
+    def post(self, batch):
+        """POST given events to logserver, in a single request given `bulk`"""
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.jwt}"
         }
-        try:
-            response = requests.post(url=self.url, headers=headers, json=log_entry)
+        for body in [batch] if self.bulk else batch:
+            response = upstream_sessions.request(
+                'POST', url=self.url, headers=headers, json=body)
             response.raise_for_status()
+
+    def send(self, batch):
+        """POST given events to logserver, logging failures"""
+        try:
+            self.post(batch)
         except RequestException as ex:
             # bootstrap problems - attempt to log to root logger
+            stats.incr('failed', len(batch))
             root_logger = logging.getLogger('root')
             root_logger.error("error submitting message to logserver: %s", self.url)
             root_logger.exception(ex)
+            return
+        stats.incr('sent', len(batch))
+
+    def flush(self):
+        """Send all queued events"""
+        while self._queue:
+            self._send_batch()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._flusher and self._flusher_pid == os.getpid():
+            self._flusher.join(timeout=self.flush_interval + 1)
+            if self._shipper:
+                self._shipper.join(timeout=self.flush_interval + 1)
+        # spooled events not yet shipped remain for next start
+        self.flush()
+        if self.spool:
+            self.spool.close()
+        for orphan in self._orphans:
+            orphan.close()
+        super().close()
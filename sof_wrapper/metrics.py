@@ -0,0 +1,111 @@
+"""Metrics
+
+Optional Prometheus metrics, served at `/metrics` when METRICS is enabled:
+- request latency per Flask endpoint
+- upstream latency and errors per source, from request tracing spans
+- all `sof_wrapper.stats` counters (cache hits & misses, redis session
+  reads, PDMP breaker, audit events queued/sent/dropped, ...)
+- audit event queue and spool depth
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty directory shared
+by the workers, so metrics are aggregated across them; see gunicorn.conf.py.
+Requires the `metrics` extra (prometheus_client).
+"""
+from flask import Blueprint, Response, g, request
+import os
+import time
+
+from sof_wrapper import stats
+from sof_wrapper.audit import audit_queue_depth, audit_spool_depth
+
+blueprint = Blueprint('metrics', __name__)
+_metrics = {}
+
+
+def create_metrics():
+    from prometheus_client import Counter, Gauge, Histogram
+
+    return {
+        'request_latency': Histogram(
+            'sof_request_duration_seconds', "Request latency by endpoint",
+            ['endpoint', 'method', 'status']),
+        'upstream_latency': Histogram(
+            'sof_upstream_duration_seconds', "Upstream request latency by source",
+            ['source', 'method']),
+        'upstream_errors': Counter(
+            'sof_upstream_errors_total', "Upstream requests failed or w/ 5xx status",
+            ['source', 'error']),
+        'stats': Counter(
+            'sof_stats_total', "Counters of caches, clients and audit logging",
+            ['group', 'key']),
+        'audit_queue_depth': Gauge(
+            'sof_audit_queue_depth', "Audit events queued in memory, not yet sent",
+            multiprocess_mode='livesum'),
+        'audit_spool_bytes': Gauge(
+            'sof_audit_spool_bytes', "Audit event bytes spooled, not yet shipped",
+            multiprocess_mode='livesum'),
+    }
+
+
+def count_stat(name, key, amount):
+    _metrics['stats'].labels(name, key).inc(amount)
+
+
+def start_timer():
+    g.metrics_start = time.monotonic()
+
+
+def observe_request(response):
+    if 'metrics_start' not in g:
+        return response
+    _metrics['request_latency'].labels(
+        request.endpoint or 'unknown', request.method, response.status_code,
+    ).observe(time.monotonic() - g.metrics_start)
+
+    for span in g.get('spans', ()):
+        _metrics['upstream_latency'].labels(
+            span.source, span.attrs.get('method', '')).observe(span.duration)
+        if 'error' in span.attrs:
+            _metrics['upstream_errors'].labels(span.source, span.attrs['error']).inc()
+        elif span.attrs.get('status', 0) >= 500:
+            _metrics['upstream_errors'].labels(span.source, str(span.attrs['status'])).inc()
+
+    _metrics['audit_queue_depth'].set(audit_queue_depth())
+    _metrics['audit_spool_bytes'].set(audit_spool_depth())
+    return response
+
+
+@blueprint.route('/metrics')
+def metrics():
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        REGISTRY,
+        CollectorRegistry,
+        generate_latest,
+        multiprocess,
+    )
+
+    registry = REGISTRY
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    if not app.config['METRICS']:
+        return
+    try:
+        import prometheus_client  # noqa: F401
+    except ImportError:
+        raise RuntimeError("METRICS requires prometheus_client; install sof_wrapper[metrics]")
+
+    # metrics are process-wide, as are the counters they're fed from
+    if not _metrics:
+        _metrics.update(create_metrics())
+    if count_stat not in stats.listeners:
+        stats.listeners.append(count_stat)
+
+    app.before_request(start_timer)
+    app.after_request(observe_request)
+    app.register_blueprint(blueprint)
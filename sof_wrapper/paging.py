@@ -0,0 +1,125 @@
+"""Paging
+
+functions to follow FHIR searchset Bundle `next` links, merging all pages
+into a single Bundle
+"""
+from concurrent.futures import TimeoutError
+from flask import current_app
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+import timeit
+
+from sof_wrapper.deadline import remaining
+from sof_wrapper.extensions import upstream_sessions
+from sof_wrapper.fanout import get_executor
+from sof_wrapper.tracing import span, url_template
+from sof_wrapper.upstream import origin
+
+
+def next_link(bundle):
+    """Return URL of the page following given Bundle, if any"""
+    for link in bundle.get('link', ()):
+        if link.get('relation') == 'next':
+            return link.get('url')
+
+
+def fetch_page(url, headers, timeout):
+    """Fetch a single Bundle page; safe to call outside of app context"""
+    response = upstream_sessions.request(
+        'GET', url=url, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def bundle_pages(first_page, url, headers):
+    """Generate given first page, followed by any pages linked as `next`
+
+    The next page is requested from a pooled thread as soon as its link is
+    known, so it downloads while the caller consumes the current page.
+    Only links to the origin of `url` are followed, as they're sent
+    the same (authorization) headers.
+
+    Stops short of the last page when EMR_MAX_PAGES, EMR_MAX_ENTRIES or
+    EMR_PAGING_DEADLINE (in seconds) is reached, the request's deadline
+    passes, or a page times out or fails; the last page generated then
+    retains its `next` link.
+    """
+    config = current_app.config
+    deadline = timeit.default_timer() + min(
+        config['EMR_PAGING_DEADLINE'], remaining(config['EMR_PAGING_DEADLINE']))
+    executor = get_executor('paging')
+
+    page, page_count, entry_count = first_page, 1, 0
+    while True:
+        entry_count += len(page.get('entry', ()))
+        link = next_link(page)
+        future = None
+        timeout = deadline - timeit.default_timer()
+        if link and origin(link) != origin(url):
+            current_app.logger.warning("not following next link to foreign origin: %s", link)
+        elif link and page_count >= config['EMR_MAX_PAGES']:
+            current_app.logger.warning("stopped paging %s at %d pages", url, page_count)
+        elif link and entry_count >= config['EMR_MAX_ENTRIES']:
+            current_app.logger.warning("stopped paging %s at %d entries", url, entry_count)
+        elif link and timeout <= 0:
+            current_app.logger.warning(
+                "stopped paging %s at %d pages; deadline exceeded", url, page_count)
+        elif link:
+            future = executor.submit(fetch_page, link, headers, timeout)
+
+        yield page
+        if future is None:
+            return
+
+        try:
+            # prefetched outside the app context; trace time spent waiting
+            with span('ehr', method='GET', url=url_template(link), prefetched=True):
+                page = future.result(timeout=max(deadline - timeit.default_timer(), 0))
+        except (TimeoutError, Timeout):
+            current_app.logger.warning(
+                "stopped paging %s at %d pages; deadline exceeded", url, page_count)
+            return
+        except (ConnectionError, HTTPError) as ex:
+            current_app.logger.warning(
+                "stopped paging %s at %d pages; next page failed: %s", url, page_count, ex)
+            return
+        page_count += 1
+
+
+def incomplete_outcome(url):
+    """Return searchset entry noting pages from given `next` url were not fetched"""
+    return {
+        "resource": {
+            "resourceType": "OperationOutcome",
+            "issue": [{
+                "severity": "warning",
+                "code": "incomplete",
+                "diagnostics": f"results incomplete; pages from {url} not fetched",
+            }],
+        },
+        "search": {"mode": "outcome"},
+    }
+
+
+def merge_pages(pages):
+    """Merge given Bundle pages into one Bundle, consuming pages as generated
+
+    Should paging have stopped short, the merged Bundle keeps the `next`
+    link of the last page merged, and notes as much in an OperationOutcome
+    entry.
+    """
+    pages = iter(pages)
+    merged = dict(next(pages))
+    merged['entry'] = list(merged.get('entry', ()))
+    last_page = merged
+    for page in pages:
+        merged['entry'].extend(page.get('entry', ()))
+        last_page = page
+
+    unfetched = next_link(last_page)
+    if 'link' in merged:
+        merged['link'] = [
+            link for link in merged['link'] if link.get('relation') != 'next']
+    if unfetched:
+        merged.setdefault('link', []).append({'relation': 'next', 'url': unfetched})
+        merged['entry'].append(incomplete_outcome(unfetched))
+    return merged
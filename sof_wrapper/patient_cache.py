@@ -0,0 +1,106 @@
+"""Patient cache
+
+Short lived cache of EHR Patient resources, shared across requests and
+workers via redis.  Entries are scoped to the caller's credential
+(authorization and session), so a Patient is only served from cache to
+callers the EHR already returned it to.  All scopes of a Patient are kept
+in one hash, keyed by (iss, patient id), so changes invalidate them at once;
+a sorted set alongside tracks when each expires, for pruning on write.
+"""
+from flask import current_app, g, request, session
+import hashlib
+import json
+from redis.exceptions import RedisError
+import time
+
+from sof_wrapper.tracing import span
+
+# drop scopes expired by ARGV[1] from hash KEYS[1], then add given scope,
+# lest the hash grow as long as any scope keeps refreshing its expiry
+CACHE_PATIENT = """
+local expired = redis.call('zrangebyscore', KEYS[2], '-inf', ARGV[1])
+for _, scope in ipairs(expired) do
+    redis.call('hdel', KEYS[1], scope)
+end
+redis.call('zremrangebyscore', KEYS[2], '-inf', ARGV[1])
+redis.call('hset', KEYS[1], ARGV[2], ARGV[3])
+redis.call('zadd', KEYS[2], ARGV[4], ARGV[2])
+redis.call('expire', KEYS[1], ARGV[5])
+redis.call('expire', KEYS[2], ARGV[5])
+return #expired
+"""
+
+
+def patient_cache_key(iss, patient_id):
+    prefix = current_app.config['PATIENT_CACHE_PREFIX']
+    return f"{prefix}{iss}|{patient_id}"
+
+
+def expiry_key(key):
+    """Return key of sorted set tracking expiry of given hash's scopes"""
+    return f"{key}:expires"
+
+
+def credential_scope():
+    """Return digest of the caller's credential, or None if there's none"""
+    # sessions w/o data are new, not (yet) launched
+    scope = [
+        request.headers.get('Authorization'),
+        g.get('session_id') or (session.sid if session else None),
+    ]
+    if not any(scope):
+        return None
+    return hashlib.sha256(json.dumps(scope).encode('utf-8')).hexdigest()
+
+
+def get_cached_patient(iss, patient_id):
+    """Return Patient resource cached for the caller, or None if not available"""
+    scope = credential_scope()
+    if not current_app.config['PATIENT_CACHE_TTL'] or scope is None:
+        return None
+
+    redis_handle = current_app.config['SESSION_REDIS']
+    with span('redis', key='patient') as current:
+        try:
+            cached = redis_handle.hget(patient_cache_key(iss, patient_id), scope)
+        except RedisError as ex:
+            current_app.logger.warning("patient cache unavailable: %s", ex)
+            return None
+        entry = json.loads(cached) if cached else None
+        # the hash expires w/ its latest entry; older entries expire here
+        if entry and entry['expires'] < time.time():
+            entry = None
+        if current:
+            current.set(cache='hit' if entry else 'miss')
+
+    if entry:
+        return entry['patient']
+
+
+def cache_patient(iss, patient_id, patient_fhir):
+    """Cache given Patient resource for the caller, for PATIENT_CACHE_TTL seconds"""
+    ttl = current_app.config['PATIENT_CACHE_TTL']
+    scope = credential_scope()
+    if not ttl or scope is None:
+        return
+
+    redis_handle = current_app.config['SESSION_REDIS']
+    key = patient_cache_key(iss, patient_id)
+    now = time.time()
+    entry = {'expires': now + ttl, 'patient': patient_fhir}
+    try:
+        redis_handle.eval(
+            CACHE_PATIENT, 2, key, expiry_key(key),
+            now, scope, json.dumps(entry), entry['expires'], ttl)
+    except RedisError as ex:
+        current_app.logger.warning("patient cache unavailable: %s", ex)
+
+
+def invalidate_patient(iss, patient_id):
+    """Remove Patient from cache for all callers, as necessary on any change"""
+    redis_handle = current_app.config['SESSION_REDIS']
+    key = patient_cache_key(iss, patient_id)
+    try:
+        redis_handle.delete(key, expiry_key(key))
+    except RedisError as ex:
+        current_app.logger.warning("patient cache unavailable: %s", ex)
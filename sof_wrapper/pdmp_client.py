@@ -0,0 +1,247 @@
+"""PDMP client
+
+Resilient client for the PDMP SCRIPT facade:
+- tracks response latency percentiles
+- hedges slow requests with a second request after the p95 latency
+- fails fast via a circuit breaker after consecutive errors or timeouts,
+  serving the last good result for the same query when available, noted
+  by an OperationOutcome entry
+"""
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from copy import deepcopy
+from datetime import datetime, timezone
+from flask import current_app
+import threading
+import time
+import timeit
+
+from requests.exceptions import HTTPError, RequestException, Timeout
+
+from sof_wrapper.deadline import capped_timeout
+from sof_wrapper.extensions import upstream_sessions
+from sof_wrapper.fanout import SourceUnavailable, get_executor
+from sof_wrapper.singleflight import flight_key
+from sof_wrapper.stats import get_stats
+from sof_wrapper.tracing import span, url_template
+
+stats = get_stats('pdmp')
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+class CircuitOpenError(SourceUnavailable):
+    """Raised when the circuit breaker is open and no last good result is available"""
+
+
+class LatencyTracker(object):
+    """Track latency of the most recent requests, for percentile estimates"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent, min_samples=1):
+        """Return latency at given percentile, or None given too few samples"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < max(min_samples, 1):
+            return None
+        index = min(int(len(samples) * percent / 100), len(samples) - 1)
+        return samples[index]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class CircuitBreaker(object):
+    """Open after `threshold` consecutive failures; allow a trial request after `reset_timeout` seconds"""
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def allow(self):
+        """Determine if a request may be attempted"""
+        with self._lock:
+            state = self.state
+            if state == HALF_OPEN:
+                # allow a single trial request, holding others until it completes
+                self.opened_at = time.monotonic()
+            return state != OPEN
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+def fetch(url, params, timeout):
+    """Request given PDMP query; safe to call outside of app context"""
+    start_time = timeit.default_timer()
+    response = upstream_sessions.request('GET', url, params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json(), timeit.default_timer() - start_time
+
+
+def stale_outcome(fetched_at):
+    """Return searchset entry noting PDMP results are those last fetched at given time"""
+    fetched = datetime.fromtimestamp(fetched_at, timezone.utc).isoformat(timespec='seconds')
+    return {
+        "resource": {
+            "resourceType": "OperationOutcome",
+            "issue": [{
+                "severity": "warning",
+                "code": "transient",
+                "diagnostics": f"PDMP unavailable; results as of {fetched}",
+            }],
+        },
+        "search": {"mode": "outcome"},
+    }
+
+
+class PdmpClient(object):
+    """Process-wide PDMP client, configured on first use"""
+
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self._breaker = None
+        self._last_good = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def breaker(self):
+        if self._breaker is None:
+            self._breaker = CircuitBreaker(
+                threshold=current_app.config['PDMP_BREAKER_THRESHOLD'],
+                reset_timeout=current_app.config['PDMP_BREAKER_RESET'],
+            )
+        return self._breaker
+
+    def get(self, url, params, timeout):
+        """Return PDMP results for given query
+
+        :param timeout: requests timeout for PDMP, capped here by the
+          current request's deadline
+        :raises CircuitOpenError: if failing fast, w/o a last good result
+        :raises RequestException: on upstream failure, w/o a last good result
+        """
+        key = flight_key(url, params)
+        if not self.breaker.allow():
+            stats.incr('short_circuited')
+            return self._last_good_or_raise(key, CircuitOpenError("PDMP circuit open"))
+
+        fetch_timeout = None
+        try:
+            fetch_timeout = capped_timeout(timeout)
+            # fetched outside the app context, so traced here
+            with span('pdmp', method='GET', url=url_template(url)):
+                result = self._hedged_fetch(url, params, fetch_timeout)
+        except HTTPError as ex:
+            if ex.response is not None and ex.response.status_code < 500:
+                # client errors don't indicate PDMP health, but PDMP did respond
+                self.breaker.record_success()
+                raise
+            self.breaker.record_failure()
+            return self._last_good_or_raise(key, ex)
+        except Timeout as ex:
+            # timeouts cut short by the request's deadline don't indicate PDMP health
+            if fetch_timeout == timeout:
+                self.breaker.record_failure()
+            else:
+                stats.incr('deadline_exceeded')
+            return self._last_good_or_raise(key, ex)
+        except RequestException as ex:
+            self.breaker.record_failure()
+            return self._last_good_or_raise(key, ex)
+
+        self.breaker.record_success()
+        with self._lock:
+            self._last_good[key] = (result, time.time())
+            self._last_good.move_to_end(key)
+            while len(self._last_good) > current_app.config['PDMP_LAST_GOOD_SIZE']:
+                self._last_good.popitem(last=False)
+        return result
+
+    def _hedged_fetch(self, url, params, timeout):
+        """Fetch, sending a second (hedge) request if the first is slower than usual"""
+        config = current_app.config
+        executor = get_executor('pdmp')
+        futures = [executor.submit(fetch, url, params, timeout)]
+
+        hedge_delay = self.latency.percentile(
+            config['PDMP_HEDGE_PERCENTILE'], min_samples=config['PDMP_HEDGE_MIN_SAMPLES'])
+        if config['PDMP_HEDGE'] and hedge_delay is not None:
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                try:
+                    # time has passed since the first request; don't outlast the deadline
+                    hedge_timeout = capped_timeout(timeout)
+                except Timeout:
+                    hedge_timeout = None
+                if hedge_timeout is not None:
+                    stats.incr('hedged')
+                    futures.append(executor.submit(fetch, url, params, hedge_timeout))
+
+        error = None
+        pending = futures
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result, elapsed = future.result()
+                except RequestException as ex:
+                    error = ex
+                    continue
+                self.latency.record(elapsed)
+                if future is not futures[0]:
+                    stats.incr('hedge_won')
+                return result
+        raise error
+
+    def _last_good_or_raise(self, key, error):
+        with self._lock:
+            last_good = self._last_good.get(key)
+        if last_good is None:
+            raise error
+        stats.incr('stale_served')
+        current_app.logger.warning("serving last good PDMP result: %s", error)
+        result, fetched_at = last_good
+        result = deepcopy(result)
+        result.setdefault('entry', []).append(stale_outcome(fetched_at))
+        return result
+
+    def status(self):
+        """Return breaker state and latency summary, for monitoring"""
+        return {
+            'state': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'latency_samples': len(self.latency),
+            'latency_p50': self.latency.percentile(50),
+            'latency_p95': self.latency.percentile(95),
+            'counts': stats.snapshot(),
+        }
+
+
+pdmp_client = PdmpClient()
@@ -0,0 +1,116 @@
+"""Profiler
+
+Opt-in profiling of a single request, for investigating a slow one.
+
+With PROFILING enabled, a request bearing the `X-Profile` header or
+`_profile` query parameter is profiled, provided the deploy is non
+production (ENV=development) or the client address is in
+PROFILE_ALLOW_LIST.  Writes to DEBUG_OUTPUT_DIR:
+- `<name>.pstats`: cProfile of the request thread, for `pstats` or snakeviz
+- `<name>.collapsed`: if requested (`X-Profile: collapsed` or
+  `_profile=collapsed`), stacks sampled every PROFILE_SAMPLE_INTERVAL
+  seconds from the request thread and the shared worker pools (which other
+  requests may be using concurrently), for flamegraph.pl or speedscope
+
+Hooks are only installed when PROFILING is enabled; otherwise no overhead.
+"""
+from collections import Counter
+import cProfile
+from datetime import datetime
+from flask import current_app, g, request
+import sys
+import threading
+
+from sof_wrapper.debug_output import debug_output_path
+
+# thread name prefixes of the worker pools, see `fanout.get_executor`
+POOL_THREAD_PREFIXES = ('fanout', 'paging', 'rxnav', 'pdmp')
+
+
+class StackSampler(threading.Thread):
+    """Periodically sample stacks of given and worker pool threads, collapsed"""
+
+    def __init__(self, thread_ids, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_ids = set(thread_ids)
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            sampled = self.thread_ids.union(
+                thread.ident for thread in threading.enumerate()
+                if thread.name.startswith(POOL_THREAD_PREFIXES))
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in sampled:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write(self, path):
+        with open(path, 'w') as collapsed:
+            for stack, count in self.stacks.items():
+                collapsed.write(f"{stack} {count}\n")
+
+
+def profile_requested():
+    """Return the requested profile mode, if requested and allowed, otherwise None"""
+    mode = request.headers.get('X-Profile') or request.args.get('_profile')
+    if not mode:
+        return None
+    if (current_app.config['ENV'] != 'development'
+            and request.remote_addr not in current_app.config['PROFILE_ALLOW_LIST']):
+        current_app.logger.warning("profile request from %s denied", request.remote_addr)
+        return None
+    return mode
+
+
+def start_profile():
+    mode = profile_requested()
+    if not mode:
+        return
+
+    if mode == 'collapsed':
+        g.stack_sampler = StackSampler(
+            [threading.get_ident()], current_app.config['PROFILE_SAMPLE_INTERVAL'])
+        g.stack_sampler.start()
+    g.profile = cProfile.Profile()
+    g.profile.enable()
+
+
+def end_profile(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    profile.disable()
+    stack_sampler = g.pop('stack_sampler', None)
+    if stack_sampler:
+        stack_sampler.stop()
+
+    name = f"profile-{datetime.utcnow():%Y%m%dT%H%M%S.%f}-{request.endpoint or 'unknown'}"
+    try:
+        profile.dump_stats(debug_output_path(f"{name}.pstats"))
+        if stack_sampler:
+            stack_sampler.write(debug_output_path(f"{name}.collapsed"))
+    except ValueError as ex:
+        current_app.logger.error("unable to write profile: %s", ex)
+        return response
+    response.headers['X-Profile-Output'] = name
+    return response
+
+
+def init_app(app):
+    if not app.config['PROFILING']:
+        return
+    app.before_request(start_profile)
+    app.after_request(end_profile)
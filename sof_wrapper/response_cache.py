@@ -0,0 +1,136 @@
+"""Response cache
+
+Cache of proxied FHIR GET responses, revalidated upstream via conditional
+requests (`If-None-Match` / `If-Modified-Since`) so unchanged resources
+aren't downloaded again.  Entries are scoped by iss, authorization,
+session and patient, so cached data never crosses users.
+"""
+from flask import Response, current_app, g, request
+import hashlib
+import json
+from redis.exceptions import RedisError
+from werkzeug.http import unquote_etag
+
+from sof_wrapper.extensions import upstream_sessions
+from sof_wrapper.stats import get_stats
+
+stats = get_stats('fhir_router_cache')
+
+# entry fields stored as text; `body` is stored as received
+TEXT_FIELDS = ('content_type', 'etag', 'last_modified')
+
+
+def response_cache_key(url, params, headers, patient_id):
+    # params are (name, value) pairs; repeated names keep their given order
+    scope = json.dumps([
+        url,
+        sorted(params, key=lambda param: param[0]),
+        headers.get('Authorization'),
+        g.get('session_id'),
+        patient_id,
+    ])
+    prefix = current_app.config['FHIR_ROUTER_CACHE_PREFIX']
+    return f"{prefix}{hashlib.sha256(scope.encode('utf-8')).hexdigest()}"
+
+
+def load_entry(key):
+    redis_handle = current_app.config['SESSION_REDIS']
+    try:
+        entry = redis_handle.hgetall(key)
+    except RedisError as ex:
+        current_app.logger.warning("response cache unavailable: %s", ex)
+        return None
+    if not entry:
+        return None
+
+    entry = {k.decode('utf-8'): v for k, v in entry.items()}
+    for field in TEXT_FIELDS:
+        entry[field] = entry.get(field, b'').decode('utf-8')
+    return entry
+
+
+def store_entry(key, entry):
+    redis_handle = current_app.config['SESSION_REDIS']
+    try:
+        with redis_handle.pipeline() as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping=entry)
+            pipe.expire(key, current_app.config['FHIR_ROUTER_CACHE_TTL'])
+            pipe.execute()
+    except RedisError as ex:
+        current_app.logger.warning("response cache unavailable: %s", ex)
+
+
+def cacheable(upstream_response):
+    """Determine if given upstream response may be cached and revalidated"""
+    if upstream_response.status_code != 200:
+        return False
+    if 'no-store' in upstream_response.headers.get('Cache-Control', ''):
+        return False
+    return 'ETag' in upstream_response.headers or 'Last-Modified' in upstream_response.headers
+
+
+def not_modified(entry):
+    """Determine if the client's own conditional request matches given entry
+
+    ETags listed in `If-None-Match` are compared weakly, as it calls for;
+    `If-Modified-Since` only applies in its absence.
+    """
+    if request.if_none_match:
+        return request.if_none_match.star_tag or bool(entry['etag']) and (
+            request.if_none_match.contains_weak(unquote_etag(entry['etag'])[0]))
+    return bool(entry['last_modified']) and (
+        request.headers.get('If-Modified-Since') == entry['last_modified'])
+
+
+def cached_get(url, params, headers, patient_id):
+    """Proxy GET to given upstream URL, using and maintaining the response cache
+
+    :param params: list of (name, value) query parameter pairs, as repeated
+      names are significant to FHIR searches
+    :returns: Flask Response, with a status of 304 if the client's
+      conditional request headers match
+    """
+    key = response_cache_key(url, params, headers, patient_id)
+    entry = load_entry(key)
+
+    upstream_headers = dict(headers)
+    if entry:
+        stats.incr('revalidate')
+        if entry['etag']:
+            upstream_headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            upstream_headers['If-Modified-Since'] = entry['last_modified']
+
+    upstream_response = upstream_sessions.request(
+        'GET', url=url, params=params, headers=upstream_headers)
+
+    if entry and upstream_response.status_code == 304:
+        stats.incr('hit')
+        current_app.logger.debug("FHIR server confirmed cached %s unchanged", url)
+    else:
+        upstream_response.raise_for_status()
+        stats.incr('miss')
+        entry = {
+            'body': upstream_response.content,
+            'content_type': upstream_response.headers.get('Content-Type', 'application/json'),
+            'etag': upstream_response.headers.get('ETag', ''),
+            'last_modified': upstream_response.headers.get('Last-Modified', ''),
+        }
+        if cacheable(upstream_response):
+            store_entry(key, entry)
+
+    response_headers = {}
+    if entry['etag']:
+        response_headers['ETag'] = entry['etag']
+    if entry['last_modified']:
+        response_headers['Last-Modified'] = entry['last_modified']
+
+    if not_modified(entry):
+        return Response(status=304, headers=response_headers)
+    return Response(
+        entry['body'],
+        status=200,
+        content_type=entry['content_type'],
+        headers=response_headers,
+    )
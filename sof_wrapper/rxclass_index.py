@@ -0,0 +1,150 @@
+"""RxClass index
+
+Compact, local SQLite index mapping RxCUI to the RxClass classIds relevant
+to COSRI (those in `rx-class-map.json`), so drug class annotation needn't
+call RxNav for known RxCUIs.
+
+Built by the `build-rxclass-index` command, from a bulk export of RxCUI,
+classId pairs or a snapshot of harvested RxNav `byRxcui` responses.
+"""
+from contextlib import closing
+import csv
+from flask import current_app
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+SCHEMA = (
+    "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    # class_ids: space delimited; empty for RxCUIs known to have no relevant classes
+    "CREATE TABLE rxclass (rxcui TEXT PRIMARY KEY, class_ids TEXT NOT NULL) WITHOUT ROWID",
+)
+
+
+def class_ids_digest(class_ids):
+    """Return digest of given (relevant) classIds, to detect a stale index"""
+    return hashlib.sha256(' '.join(sorted(class_ids)).encode('utf-8')).hexdigest()
+
+
+def pairs_from_rxnav_snapshot(lines):
+    """Generate (rxcui, classId) pairs from JSON lines of RxNav byRxcui responses
+
+    RxCUIs without any class are generated with a classId of None
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        response = json.loads(line)
+        rxcui = response["userInput"]["rxcui"]
+        yield rxcui, None
+        for rx_class in response.get("rxclassDrugInfoList", {}).get("rxclassDrugInfo", []):
+            yield rxcui, rx_class["rxclassMinConceptItem"]["classId"]
+
+
+def pairs_from_export(lines):
+    """Generate (rxcui, classId) pairs from delimited text w/ `rxcui` and `classId` columns"""
+    lines = iter(lines)
+    header = next(lines)
+    dialect = csv.Sniffer().sniff(header, delimiters=',\t|')
+    fieldnames = next(csv.reader([header], dialect))
+    for row in csv.DictReader(lines, fieldnames=fieldnames, dialect=dialect):
+        yield row['rxcui'], row['classId']
+
+
+def build_index(path, pairs, relevant_class_ids):
+    """Write index of given (rxcui, classId) pairs, retaining only relevant classIds
+
+    Written to a temporary file then renamed, so readers never see a partial index
+    :returns: number of RxCUIs indexed
+    """
+    class_ids_by_rxcui = {}
+    for rxcui, class_id in pairs:
+        class_ids = class_ids_by_rxcui.setdefault(rxcui, set())
+        if class_id in relevant_class_ids:
+            class_ids.add(class_id)
+
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.execute(
+            "INSERT INTO meta VALUES ('class_ids_digest', ?)",
+            (class_ids_digest(relevant_class_ids),))
+        connection.executemany(
+            "INSERT INTO rxclass VALUES (?, ?)",
+            ((rxcui, ' '.join(sorted(ids))) for rxcui, ids in class_ids_by_rxcui.items()))
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+    return len(class_ids_by_rxcui)
+
+
+class RxClassIndex(object):
+    """Read only access to an index file, w/ a connection per lookup
+
+    Connections are cheap to open and closed once done, as lookups run on
+    pooled threads outliving the index (replaced when rebuilt).
+    An index built from a set of relevant classIds other than given is stale
+    """
+
+    def __init__(self, path, relevant_class_ids):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        self.relevant_class_ids = relevant_class_ids
+        self.stale = self.digest() != class_ids_digest(relevant_class_ids)
+
+    def connect(self):
+        return closing(sqlite3.connect(f"file:{self.path}?mode=ro", uri=True))
+
+    def digest(self):
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT value FROM meta WHERE key = 'class_ids_digest'").fetchone()
+        return row[0] if row else None
+
+    def lookup(self, rxcuis):
+        """Return relevant classIds for given RxCUIs, keyed by RxCUI; unknown RxCUIs are left out"""
+        rxcuis = list(rxcuis)
+        found = {}
+        with self.connect() as connection:
+            # stay within SQLite's limit on bound parameters
+            for start in range(0, len(rxcuis), 500):
+                chunk = rxcuis[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT rxcui, class_ids FROM rxclass WHERE rxcui IN ({','.join('?' * len(chunk))})",
+                    chunk)
+                found.update((rxcui, tuple(class_ids.split())) for rxcui, class_ids in rows)
+        return found
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_rxclass_index(path, relevant_class_ids):
+    """Return process-wide index at given path, or None if unavailable or stale
+
+    Reopened when the file's mtime or relevant classIds change.  An index built from a different
+    set of relevant classIds (see `rx-class-map.json`) is considered stale
+    and ignored until rebuilt.
+    """
+    if not path or not os.path.exists(path):
+        return None
+
+    mtime = os.stat(path).st_mtime_ns
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if (index is None or index.mtime != mtime or
+                index.relevant_class_ids is not relevant_class_ids):
+            index = RxClassIndex(path, relevant_class_ids)
+            if index.stale:
+                current_app.logger.warning(
+                    "ignoring stale RxClass index %s; rebuild w/ `flask build-rxclass-index`", path)
+            _indexes[path] = index
+    return None if index.stale else index
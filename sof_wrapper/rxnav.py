@@ -1,40 +1,82 @@
+from collections import defaultdict
+from concurrent.futures import wait
 from flask import current_app
+from functools import partial
+from requests.exceptions import RequestException
 import json
-import timeit
 import os
+import threading
+import timeit
+from types import MappingProxyType
+
+from sof_wrapper.audit import (
+    audit_entry,
+    rxnorm_code_lookup_failed,
+    rxnorm_drug_class_not_found,
+)
+from sof_wrapper.deadline import upstream_timeout
+from sof_wrapper.drug_class_cache import stats as cache_stats
+from sof_wrapper.extensions import drug_class_cache, upstream_sessions
+from sof_wrapper.fanout import get_executor, in_request_context
+from sof_wrapper.rxclass_index import class_ids_digest, get_rxclass_index
+from sof_wrapper.singleflight import flight_key, single_flight
+from sof_wrapper.tracing import span
+
+
+RXNORM_SYSTEM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+DRUG_CLASS_EXTENSION_URL = "http://cosri.org/fhir/drug_class"
+# distinct codings w/ memoized drug class names, per drug class index
+EXTENSIONS_MEMO_SIZE = 16384
+
+
+def rxnorm_code(med):
+    """Return RxNorm code (RxCUI) of given med, or None if not available"""
+    for med_code in med["medicationCodeableConcept"]["coding"]:
+        if med_code["system"] == RXNORM_SYSTEM:
+            return med_code["code"]
 
-from sof_wrapper.audit import audit_entry
-from sof_wrapper.extensions import CS_Singleton
 
+def add_drug_classes(med, rxnav_url, drug_class_ids=None, drug_class_index=None):
+    """Add Drug Classes
 
-def add_drug_classes(med, rxnav_url):
-    """Add Drug Classes"""
+    Returns an annotated copy; the given med (including nested dicts) is
+    left as is.
+
+    :param drug_class_ids: optional RxClass classIds keyed by RxCUI, as
+      looked up in bulk by `get_drug_class_ids_batch`
+    :param drug_class_index: optional drug class index, loaded once per bundle
+    """
 
     meds = []
     med_text = med["medicationCodeableConcept"]["text"]
 
     for med_code in med["medicationCodeableConcept"]["coding"]:
         meds.append(f"{med_code['system']}|{med_code['code']}")
-        if med_code["system"] == "http://www.nlm.nih.gov/research/umls/rxnorm":
+        if med_code["system"] == RXNORM_SYSTEM:
             break
     else:
         # exit early if no RxNorm code found
-        audit_entry(
-            f"RxNorm code unavailable: '{med_text}' ({meds})",
-            extra={'tags': ['RxNorm', 'rxnorm-code-lookup-failed']},
-            level='warn')
+        if not rxnorm_code_lookup_failed.repeated(med_text):
+            audit_entry(
+                f"RxNorm code unavailable: '{med_text}' ({meds})",
+                extra={'tags': ['RxNorm', 'rxnorm-code-lookup-failed']},
+                level='warn')
         return med
 
     rxcui = med_code["code"]
 
-    rxnav_response = get_drug_classes(rxcui, rxnav_url)
-    drug_class_map = load_drug_class_map()
-    cosri_drug_classes = set(
-        drug_class_map[drug_class_id]
-        for drug_class_id in drug_class_filter(rxnav_response) if drug_class_id in drug_class_map
-    )
+    if drug_class_ids is None:
+        class_ids = get_drug_class_ids(rxcui, rxnav_url)
+    else:
+        class_ids = drug_class_ids.get(rxcui)
+    if class_ids is None:
+        # lookup failed or didn't complete in time; unknown rather than w/o classes
+        return med
+    if drug_class_index is None:
+        drug_class_index = get_drug_class_index()
+    extensions = drug_class_index.extensions(RXNORM_SYSTEM, rxcui, class_ids)
 
-    if not cosri_drug_classes:
+    if not extensions and not rxnorm_drug_class_not_found.repeated(rxcui):
         msg = f"drug class unavailable: {med_text} ({meds})"
         audit_entry(
             msg,
@@ -44,17 +86,77 @@ def add_drug_classes(med, rxnav_url):
         # submit error for ELK alerts as this should get attention
         current_app.logger.warning(msg)
 
-    annotated_med = med.copy()
-    med_cc_extensions = annotated_med["medicationCodeableConcept"].get("extension", [])
+    # copy on write: only the dicts along the path to the new extension list
+    med_cc = med["medicationCodeableConcept"]
+    annotated_med = dict(med)
+    annotated_med["medicationCodeableConcept"] = dict(
+        med_cc, extension=[*med_cc.get("extension", ()), *extensions])
+    return annotated_med
 
-    for cosri_drug_class in cosri_drug_classes:
-        med_cc_extensions.append({
-            "url": "http://cosri.org/fhir/drug_class",
-            "valueString": cosri_drug_class,
-        })
 
-    annotated_med["medicationCodeableConcept"]["extension"] = med_cc_extensions
-    return annotated_med
+def local_drug_class_ids(rxcuis):
+    """Return classIds for given RxCUIs found in the local RxClass index, keyed by RxCUI"""
+    index = get_rxclass_index(
+        current_app.config['RXCLASS_INDEX_PATH'], get_drug_class_index().class_ids)
+    if index is None:
+        return {}
+    return index.lookup(rxcuis)
+
+
+def get_drug_class_ids(rxcui, rxnav_url):
+    """Get relevant RxClass classIds for given RxCUI; see `get_drug_class_ids_batch`
+
+    :returns: tuple of classIds, or None if unavailable, such as on RxNav failure
+    """
+    return get_drug_class_ids_batch([rxcui], rxnav_url).get(rxcui)
+
+
+def get_drug_class_ids_batch(rxcuis, rxnav_url, timeout=None):
+    """Get relevant RxClass classIds for given RxCUIs, keyed by RxCUI
+
+    Consults the local index, then the drug class cache; the remainder are
+    looked up via `get_drug_classes_batch` and cached.  Should RxNav fail,
+    expired cache entries are served.  RxCUIs otherwise unavailable within
+    `timeout` seconds are left out.
+    """
+    rxcuis = set(rxcuis)
+    class_ids = local_drug_class_ids(rxcuis)
+    drug_class_index = get_drug_class_index()
+
+    with span('redis', key='drug-class-cache') as current:
+        fresh, stale = drug_class_cache.get_many(
+            rxcuis.difference(class_ids), drug_class_index.digest)
+        if current:
+            current.set(hits=len(fresh), misses=len(rxcuis) - len(class_ids) - len(fresh))
+    class_ids.update(fresh)
+
+    def cache_late(rxcui, rxnav_response):
+        cache_drug_class_ids(rxcui, rxnav_response, drug_class_index)
+        drug_class_cache.record_seen([rxcui])
+
+    rxnav_responses = get_drug_classes_batch(
+        rxcuis.difference(class_ids), rxnav_url=rxnav_url, timeout=timeout,
+        late_callback=cache_late)
+    for rxcui, rxnav_response in rxnav_responses.items():
+        class_ids[rxcui] = cache_drug_class_ids(rxcui, rxnav_response, drug_class_index)
+    drug_class_cache.record_seen(rxnav_responses.keys())
+
+    for rxcui in stale.keys() - class_ids.keys():
+        cache_stats.incr('stale_served')
+        class_ids[rxcui] = stale[rxcui]
+    return class_ids
+
+
+def cache_drug_class_ids(rxcui, rxnav_response, drug_class_index):
+    """Cache and return relevant RxClass classIds from given RxNav response"""
+    class_ids = tuple(sorted(
+        drug_class_index.class_ids.intersection(drug_class_filter(rxnav_response))))
+    # negative results expire sooner, should RxClass or the map catch up
+    ttl = current_app.config['REQUEST_CACHE_EXPIRE']
+    if not class_ids:
+        ttl = current_app.config['DRUG_CLASS_NEGATIVE_TTL']
+    drug_class_cache.set(rxcui, drug_class_index.digest, class_ids, ttl=ttl)
+    return class_ids
 
 
 def get_drug_classes(rxcui, rxnav_url):
@@ -62,30 +164,147 @@ def get_drug_classes(rxcui, rxnav_url):
 
     https://rxnav.nlm.nih.gov/api-RxClass.getClassByRxNormDrugId.html
     """
+    def fetch():
+        response = upstream_sessions.request(
+            'GET',
+            url=f"{rxnav_url}/REST/rxclass/class/byRxcui.json",
+            params={"rxcui": rxcui},
+            timeout=upstream_timeout(),
+        )
+        response.raise_for_status()
+        return response.json()
+
     start_time = timeit.default_timer()
-    cached_session = CS_Singleton().cached_session
-    response = cached_session.get(
-        url=f"{rxnav_url}/REST/rxclass/class/byRxcui.json",
-        params={"rxcui": rxcui},
-    )
+    rxnav_response = single_flight.do(flight_key('rxnav', rxnav_url, rxcui), fetch)
     request_time = timeit.default_timer() - start_time
-    if request_time > 0.01:
-        current_app.logger.debug(f"uncached rxnav {rxcui} request time: {request_time}")
-    return response.json()
+    current_app.logger.debug(f"rxnav {rxcui} request time: {request_time}")
+    return rxnav_response
+
+
+def get_drug_classes_batch(rxcuis, rxnav_url, timeout=None, late_callback=None):
+    """Get drug classes for given RxCUIs from RxNav API, keyed by RxCUI
+
+    Each distinct RxCUI is looked up once; lookups run concurrently, limited
+    process-wide to RXNAV_MAX_CONCURRENCY.  Lookups failed or not complete
+    within `timeout` seconds are left out.
+
+    :param late_callback: optional function called, within the app context,
+      w/ the RxCUI and response of each lookup succeeding after `timeout`
+    """
+    executor = get_executor(
+        'rxnav', max_workers=current_app.config['RXNAV_MAX_CONCURRENCY'])
+    futures = {
+        rxcui: executor.submit(in_request_context(get_drug_classes), rxcui, rxnav_url)
+        for rxcui in set(rxcuis)
+    }
+    done, _ = wait(futures.values(), timeout=timeout)
+
+    app = current_app._get_current_object()
+
+    def call_late_callback(rxcui, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with app.app_context():
+            late_callback(rxcui, future.result())
+
+    rxnav_responses = {}
+    for rxcui, future in futures.items():
+        if future not in done:
+            if late_callback is not None:
+                future.add_done_callback(partial(call_late_callback, rxcui))
+            continue
+        try:
+            rxnav_responses[rxcui] = future.result()
+        except RequestException as ex:
+            current_app.logger.warning("RxNav lookup of %s failed: %s", rxcui, ex)
+    if len(rxnav_responses) < len(futures):
+        current_app.logger.warning(
+            "%d of %d RxNav lookups incomplete", len(futures) - len(rxnav_responses), len(futures))
+    return rxnav_responses
 
 
 def drug_class_filter(rxnav_response):
     """Generator for collecting drug class names from RxNav JSON response"""
-    for rx_class in rxnav_response["rxclassDrugInfoList"]["rxclassDrugInfo"]:
+    # response for RxCUIs w/o any class lacks `rxclassDrugInfoList`
+    for rx_class in rxnav_response.get("rxclassDrugInfoList", {}).get("rxclassDrugInfo", []):
         yield rx_class["rxclassMinConceptItem"]["classId"]
 
 
-def load_drug_class_map(filename="rx-class-map.json"):
-    # TODO cache contents
+class DrugClassIndex(object):
+    """Immutable index of COSRI drug class names by RxClass classId, and the inverse"""
+
+    def __init__(self, drug_class_map, mtime=None):
+        self.mtime = mtime
+        self.by_class_id = MappingProxyType(dict(drug_class_map))
+        self.class_ids = frozenset(drug_class_map)
+        # identifies cached classIds filtered by this map
+        self.digest = class_ids_digest(self.class_ids)
+
+        class_ids_by_name = defaultdict(list)
+        for class_id, class_name in drug_class_map.items():
+            class_ids_by_name[class_name].append(class_id)
+        self.class_ids_by_name = MappingProxyType(
+            {name: tuple(sorted(ids)) for name, ids in class_ids_by_name.items()})
+        # sorted class names by coding, w/ the classIds they're of
+        self._class_names = {}
+        self._class_names_lock = threading.Lock()
+
+    def class_names(self, class_ids):
+        """Return set of COSRI drug class names for given RxClass classIds"""
+        return set(self.by_class_id[class_id] for class_id in self.class_ids.intersection(class_ids))
+
+    def extensions(self, system, code, class_ids):
+        """Return drug class extensions for given coding and its RxClass classIds
+
+        Class names are memoized by coding, recomputed only should its
+        classIds change.  Returns new extension dicts, safe to modify.
+        """
+        memo = self._class_names.get((system, code))
+        if memo is not None and memo[0] == class_ids:
+            class_names = memo[1]
+        else:
+            class_names = tuple(sorted(self.class_names(class_ids)))
+            with self._class_names_lock:
+                if len(self._class_names) >= EXTENSIONS_MEMO_SIZE:
+                    self._class_names.clear()
+                self._class_names[(system, code)] = (tuple(class_ids), class_names)
+
+        return [
+            {"url": DRUG_CLASS_EXTENSION_URL, "valueString": class_name}
+            for class_name in class_names]
+
+
+_drug_class_indexes = {}
+_drug_class_indexes_lock = threading.Lock()
+
+
+def drug_class_map_path(filename="rx-class-map.json"):
     # TODO move datafile and rxnav to separate directory
     module_path = os.path.dirname(__file__)
-    filepath = os.path.join(module_path, filename)
+    return os.path.join(module_path, filename)
 
-    with open(filepath, 'r') as map_file:
-        drug_class_map = json.loads(map_file.read())
-    return drug_class_map
+
+def get_drug_class_index(filename="rx-class-map.json"):
+    """Return process-wide drug class index, loaded on first use
+
+    Reloaded only when the file's mtime changes, such as by the
+    `reload-drug-class-map` command, run on the same host
+    """
+    filepath = drug_class_map_path(filename)
+    mtime = os.stat(filepath).st_mtime_ns
+    index = _drug_class_indexes.get(filepath)
+    if index is not None and index.mtime == mtime:
+        return index
+
+    with _drug_class_indexes_lock:
+        index = _drug_class_indexes.get(filepath)
+        if index is None or index.mtime != mtime:
+            with open(filepath, 'r') as map_file:
+                index = DrugClassIndex(json.loads(map_file.read()), mtime=mtime)
+            _drug_class_indexes[filepath] = index
+    return index
+
+
+def load_drug_class_map(filename="rx-class-map.json"):
+    """Return (read only) map of COSRI drug class names by RxClass classId"""
+    return get_drug_class_index(filename).by_class_id
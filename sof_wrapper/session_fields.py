@@ -0,0 +1,95 @@
+"""Session fields
+
+Optional mirror of frequently read ("hot") session values as the fields of
+a redis hash, JSON encoded, alongside the pickled session blob maintained by
+flask-session.  Enables reading only what's needed via HMGET, w/o fetching
+and unpickling the entire session (including the token response).
+"""
+from flask_session.sessions import RedisSessionInterface
+import json
+
+# dotted keys name values nested in dicts
+HOT_KEYS = ('iss', 'user', 'subject', 'launch_token_patient', 'token_response.patient')
+# present in every mirrored session, to tell from sessions yet to be migrated
+VERSION_FIELD = '_v'
+
+
+def lookup(data, key, default=None):
+    """Return value for given (dotted) key from session data"""
+    value = data
+    for part in key.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return default
+        value = value[part]
+    return value
+
+
+def encode_fields(session_data):
+    """Return hot values of given session data as JSON encoded hash fields"""
+    fields = {VERSION_FIELD: '1'}
+    for key in HOT_KEYS:
+        value = lookup(session_data, key)
+        if value is not None:
+            fields[key] = json.dumps(value, default=str)
+    return fields
+
+
+def decode_fields(keys, values):
+    """Return dict of given keys and their HMGET values, skipping those unset"""
+    return {
+        key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+
+def write_session_fields(redis_handle, fields_key, session_data, ttl):
+    pipeline = redis_handle.pipeline()
+    pipeline.delete(fields_key)
+    pipeline.hset(fields_key, mapping=encode_fields(session_data))
+    if ttl is not None:
+        pipeline.expire(fields_key, ttl)
+    pipeline.execute()
+
+
+class FieldsRedisSessionInterface(RedisSessionInterface):
+    """flask-session redis interface, also mirroring hot values to a hash"""
+
+    def __init__(self, redis, key_prefix, use_signer=False, permanent=True,
+                 fields_prefix='session-fields:'):
+        super().__init__(redis, key_prefix, use_signer, permanent)
+        self.fields_prefix = fields_prefix
+
+    def open_session(self, app, request):
+        session = super().open_session(app, request)
+        # hot values as loaded; `modified` misses changes to nested values
+        session.saved_fields = encode_fields(dict(session))
+        return session
+
+    def save_session(self, app, session, response):
+        super().save_session(app, session, response)
+        fields_key = self.fields_prefix + session.sid
+        ttl = int(app.permanent_session_lifetime.total_seconds())
+        fields = encode_fields(dict(session))
+        if not session.modified and fields == getattr(session, 'saved_fields', None):
+            # blob expiry was just extended; extend the hash's alike
+            if session:
+                self.redis.expire(fields_key, ttl)
+            return
+        if not session:
+            self.redis.delete(fields_key)
+            return
+        write_session_fields(self.redis, fields_key, dict(session), ttl=ttl)
+        session.saved_fields = fields
+
+
+def migrate_sessions(redis_handle, key_prefix, fields_prefix, serializer):
+    """Mirror hot values of all existing blob sessions; return count migrated"""
+    count = 0
+    for key in redis_handle.scan_iter(match=f"{key_prefix}*"):
+        session_id = key.decode('utf-8')[len(key_prefix):]
+        encoded, ttl = redis_handle.pipeline().get(key).ttl(key).execute()
+        if encoded is None:
+            continue
+        write_session_fields(
+            redis_handle, f"{fields_prefix}{session_id}", serializer.loads(encoded),
+            ttl=ttl if ttl > 0 else None)
+        count += 1
+    return count
@@ -0,0 +1,146 @@
+"""Single flight
+
+Coalesce concurrent, identical upstream requests, so callers arriving while
+a request is in flight share its result rather than repeating it.
+
+Coalesces across threads within a process, and optionally (see
+SINGLE_FLIGHT_REDIS) across workers, via a short lived redis lock.
+Results shared across workers must be JSON serializable.
+"""
+from copy import deepcopy
+from flask import current_app, has_app_context
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from sof_wrapper.deadline import remaining
+from sof_wrapper.stats import get_stats
+
+stats = get_stats('single_flight')
+
+# seconds followers wait for a leader, w/o an app context
+DEFAULT_TIMEOUT = 10
+
+# bounds of the interval, in seconds, between checks on another worker's flight
+POLL_INTERVAL = 0.01
+MAX_POLL_INTERVAL = 0.25
+
+# delete lock only if still held by given flight, not one acquired after it expired
+RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def follower_timeout():
+    """Return seconds a follower waits for its leader, capped by the request's deadline"""
+    if not has_app_context():
+        return DEFAULT_TIMEOUT
+    timeout = current_app.config['SINGLE_FLIGHT_TIMEOUT']
+    return max(min(timeout, remaining(timeout)), 0)
+
+
+def flight_key(*parts):
+    """Return key identifying a request by given parts, such as URL and headers"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Share one call of a function, and its result, among concurrent callers with the same key
+
+    Callers sharing a result each receive their own copy, so it's safe to mutate
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.followers += 1
+
+        if not leader:
+            stats.incr('shared')
+            if not call.done.wait(follower_timeout()):
+                # leader is stuck; don't wait on it any longer
+                stats.incr('follower_timeout')
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return deepcopy(call.result)
+
+        stats.incr('called')
+        try:
+            call.result = self._call(key, fn)
+        except BaseException as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                followers = call.followers
+            call.done.set()
+
+        return deepcopy(call.result) if followers else call.result
+
+    def _call(self, key, fn):
+        if not (has_app_context() and current_app.config['SINGLE_FLIGHT_REDIS']):
+            return fn()
+        return redis_flight(key, fn)
+
+
+def redis_flight(key, fn):
+    """Call given function unless another worker holds the lock for key, then share its result"""
+    config = current_app.config
+    redis_handle = config['SESSION_REDIS']
+    prefix = config['SINGLE_FLIGHT_PREFIX']
+    lock_key = f"{prefix}{key}:lock"
+    timeout = config['SINGLE_FLIGHT_TIMEOUT']
+
+    flight_id = uuid.uuid4().hex
+    if redis_handle.set(lock_key, flight_id, nx=True, px=int(timeout * 1000)):
+        try:
+            result = fn()
+            redis_handle.set(
+                f"{prefix}{key}:{flight_id}", json.dumps(result), px=int(timeout * 1000))
+            return result
+        finally:
+            redis_handle.eval(RELEASE_LOCK, 1, lock_key, flight_id)
+
+    leader_id = redis_handle.get(lock_key)
+    deadline = time.monotonic() + follower_timeout()
+    interval = POLL_INTERVAL
+    while leader_id and time.monotonic() < deadline:
+        # leader stores its result prior to releasing the lock; check in same order
+        leader_done = redis_handle.get(lock_key) != leader_id
+        result = redis_handle.get(f"{prefix}{key}:{leader_id.decode('utf-8')}")
+        if result is not None:
+            stats.incr('shared_across_workers')
+            return json.loads(result)
+        if leader_done:
+            # leader failed w/o a result
+            break
+        # back off, lest many followers poll redis at a steady rate
+        time.sleep(max(min(interval, deadline - time.monotonic()), 0))
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+    return fn()
+
+
+single_flight = SingleFlight()
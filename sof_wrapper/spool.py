@@ -0,0 +1,207 @@
+"""Spool
+
+Durable, append-only on-disk queue of audit events, shipped to the
+logserver by `LogServerHandler`.
+
+Events are written as JSON lines to numbered segment files, fsync'd once
+per batch.  The shipper's position (segment and offset) is checkpointed,
+and fully shipped segments deleted, so events survive outages and restarts.
+Each process claims its own spool directory (a numbered slot under the
+configured directory), reclaimed on restart.  Slots left by processes
+since exited, and not reclaimed, are adopted by a shipper to drain.
+"""
+import errno
+import fcntl
+import json
+import os
+import threading
+
+from sof_wrapper.stats import get_stats
+
+stats = get_stats('spool')
+
+MAX_SLOTS = 64
+
+
+def lock_slot(path):
+    """Return lock file of given spool slot, or None if claimed by another process"""
+    lock_file = open(os.path.join(path, 'lock'), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError as ex:
+        lock_file.close()
+        if ex.errno in (errno.EACCES, errno.EAGAIN):
+            return None
+        raise
+    return lock_file
+
+
+def claim_spool_dir(base_dir):
+    """Return (path, lock file) of the first spool slot not claimed by another process"""
+    for slot in range(MAX_SLOTS):
+        path = os.path.join(base_dir, str(slot))
+        os.makedirs(path, exist_ok=True)
+        lock_file = lock_slot(path)
+        if lock_file is not None:
+            return path, lock_file
+    raise RuntimeError(f"no spool slot available in {base_dir}")
+
+
+class Spool(object):
+    """Segmented, checkpointed, on-disk queue of JSON events
+
+    Total size is capped at `max_bytes`; beyond, the oldest segments are dropped
+    """
+
+    def __init__(
+            self, directory, segment_size=4 * 1024 * 1024, max_bytes=512 * 1024 * 1024, slot=None):
+        """Open spool in first unclaimed slot under given directory, or given (path, lock file)"""
+        self.base_dir = directory
+        self.directory, self._lock_file = slot or claim_spool_dir(directory)
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self._checkpoint_path = os.path.join(self.directory, 'checkpoint')
+        self._position = self._read_checkpoint()
+        segments = self._segments()
+        # never append to a prior segment, its tail may be incomplete
+        self._write_seq = (segments[-1] + 1) if segments else self._position[0]
+        self._writer = None
+        # bytes of all segments, kept as appended and removed
+        self._bytes = sum(os.path.getsize(self._segment_path(seq)) for seq in segments)
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}.jsonl")
+
+    def _segments(self):
+        return sorted(
+            int(name.split('.')[0]) for name in os.listdir(self.directory)
+            if name.endswith('.jsonl'))
+
+    def _read_checkpoint(self):
+        try:
+            with open(self._checkpoint_path, 'r') as checkpoint:
+                seq, offset = checkpoint.read().split()
+                return int(seq), int(offset)
+        except FileNotFoundError:
+            segments = self._segments()
+            return (segments[0] if segments else 0), 0
+
+    def _write_checkpoint(self, position):
+        tmp_path = f"{self._checkpoint_path}.tmp"
+        with open(tmp_path, 'w') as checkpoint:
+            checkpoint.write(f"{position[0]} {position[1]}")
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(tmp_path, self._checkpoint_path)
+
+    def append(self, events):
+        """Durably append given events; a single fsync per call"""
+        data = ''.join(json.dumps(event) + '\n' for event in events).encode('utf-8')
+        with self._lock:
+            if self._writer is None or self._writer.tell() >= self.segment_size:
+                if self._writer is not None:
+                    self._writer.close()
+                    self._write_seq += 1
+                self._writer = open(self._segment_path(self._write_seq), 'ab')
+            self._writer.write(data)
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._bytes += len(data)
+            stats.incr('appended', len(events))
+            if self._bytes > self.max_bytes:
+                self._enforce_cap()
+
+    def _remove_segment(self, seq):
+        path = self._segment_path(seq)
+        self._bytes -= os.path.getsize(path)
+        os.remove(path)
+
+    def _enforce_cap(self):
+        for seq in self._segments()[:-1]:
+            if self._bytes <= self.max_bytes:
+                break
+            self._remove_segment(seq)
+            stats.incr('dropped_segments')
+            if self._position[0] <= seq:
+                self._position = (seq + 1, 0)
+                self._write_checkpoint(self._position)
+
+    def read(self, max_events):
+        """Return (events, position) of up to `max_events` not yet shipped
+
+        Pass the returned position to `commit` once shipped
+        """
+        with self._lock:
+            seq, offset = self._position
+            events = []
+            while len(events) < max_events:
+                try:
+                    with open(self._segment_path(seq), 'rb') as segment:
+                        segment.seek(offset)
+                        for line in segment:
+                            if not line.endswith(b'\n'):
+                                # incomplete tail, as of a crash
+                                break
+                            events.append(json.loads(line))
+                            offset += len(line)
+                            if len(events) == max_events:
+                                break
+                except FileNotFoundError:
+                    pass
+                if len(events) == max_events or seq >= self._write_seq:
+                    break
+                # done w/ prior segment; continue w/ next
+                seq, offset = seq + 1, 0
+            return events, (seq, offset)
+
+    def commit(self, position):
+        """Checkpoint given position as shipped, deleting shipped segments"""
+        with self._lock:
+            self._write_checkpoint(position)
+            self._position = position
+            for seq in self._segments():
+                if seq < position[0]:
+                    self._remove_segment(seq)
+            stats.incr('committed')
+
+    def depth(self):
+        """Return bytes spooled, not yet shipped"""
+        with self._lock:
+            seq, offset = self._position
+            segments = self._segments()
+            if seq not in segments:
+                offset = 0
+            return sum(
+                os.path.getsize(self._segment_path(s)) for s in segments if s >= seq) - offset
+
+    def orphans(self):
+        """Return spools of other slots w/ events not yet shipped, left by exited processes
+
+        Each is claimed until closed; close once drained
+        """
+        orphans = []
+        for name in sorted(os.listdir(self.base_dir)):
+            path = os.path.join(self.base_dir, name)
+            if path == self.directory or not os.path.isdir(path):
+                continue
+            lock_file = lock_slot(path)
+            if lock_file is None:
+                continue
+            orphan = Spool(
+                self.base_dir, segment_size=self.segment_size, max_bytes=self.max_bytes,
+                slot=(path, lock_file))
+            if orphan.depth():
+                stats.incr('adopted')
+                orphans.append(orphan)
+            else:
+                orphan.close()
+        return orphans
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        self._lock_file.close()
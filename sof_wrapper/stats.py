@@ -0,0 +1,50 @@
+"""Stats
+
+In-process, thread safe counters for monitoring caches and upstream use
+"""
+from collections import Counter
+import threading
+
+_registry = {}
+_registry_lock = threading.Lock()
+# callables given (name, key, amount) on every increment, such as to export metrics
+listeners = []
+
+
+class Stats(object):
+    """Named group of thread safe counters, such as a cache's hits and misses"""
+
+    def __init__(self, name):
+        self.name = name
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            self._counts[key] += amount
+        for listener in listeners:
+            listener(self.name, key, amount)
+
+    def snapshot(self):
+        """Return a copy of current counts"""
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+def get_stats(name):
+    """Return the process-wide Stats for given name, created on first use"""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = Stats(name)
+        return _registry[name]
+
+
+def all_stats():
+    """Return snapshots of all named Stats"""
+    with _registry_lock:
+        groups = list(_registry.values())
+    return {stats.name: stats.snapshot() for stats in groups}
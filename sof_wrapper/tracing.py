@@ -0,0 +1,148 @@
+"""Tracing
+
+Request-scoped spans timing each upstream hop (EHR, PDMP, PHR, RxNav, redis
+session reads), reported per request as a `Server-Timing` response header
+and a single structured log line
+"""
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context, request
+import re
+import time
+from urllib.parse import urlsplit
+
+# upstream sources, by config key of their base URL; others are the EHR
+SOURCE_URL_CONFIG = (
+    ('pdmp', 'PDMP_URL'),
+    ('phr', 'PHR_URL'),
+    ('rxnav', 'RXNAV_URL'),
+    ('logserver', 'LOGSERVER_URL'),
+)
+
+# path segments w/ digits are (mostly) ids
+ID_SEGMENT = re.compile(r'.*\d.*')
+# FHIR resource types, such as `Patient`; not all caps, such as RxNav's `REST`
+RESOURCE_TYPE = re.compile(r'[A-Z][a-z][A-Za-z]*')
+# FHIR operations and keywords, such as `$everything` and `_history`
+FHIR_KEYWORD = re.compile(r'[$_][A-Za-z-]+')
+
+
+class Span(object):
+    """Timing and attributes of one upstream hop"""
+
+    def __init__(self, source, **attrs):
+        self.source = source
+        self.attrs = attrs
+        self.start = time.monotonic()
+        self.duration = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def as_dict(self):
+        return dict(source=self.source, duration_ms=round(self.duration * 1000, 1), **self.attrs)
+
+
+def tracing():
+    """Determine if within a traced request (or thread thereof)"""
+    return has_app_context() and g.get('spans') is not None
+
+
+def start_trace():
+    g.trace_start = time.monotonic()
+    g.spans = []
+
+
+@contextmanager
+def span(source, **attrs):
+    """Record a span for the enclosed upstream hop, if within a traced request
+
+    Yields the Span, or None if not tracing, for setting further attributes
+    """
+    if not tracing():
+        yield None
+        return
+
+    spans = g.spans
+    current = Span(source, **attrs)
+    try:
+        yield current
+    except Exception as ex:
+        current.set(error=type(ex).__name__)
+        raise
+    finally:
+        current.duration = time.monotonic() - current.start
+        # shared w/ worker threads, see `in_request_context`; append is thread safe
+        spans.append(current)
+
+
+def url_template(url):
+    """Return path of given URL w/ id-like segments replaced, to group by
+
+    The segment directly following a FHIR resource type, unless an operation
+    or keyword, is an id, masked whether or not it includes digits
+    """
+    template = []
+    after_resource_type = False
+    for segment in urlsplit(url).path.split('/'):
+        if segment and (
+                (after_resource_type and not FHIR_KEYWORD.fullmatch(segment)) or
+                ID_SEGMENT.fullmatch(segment)):
+            segment = '{id}'
+            after_resource_type = False
+        else:
+            after_resource_type = bool(RESOURCE_TYPE.fullmatch(segment))
+        template.append(segment)
+    return '/'.join(template)
+
+
+def source_name(url):
+    """Return name of the configured upstream source for given URL"""
+    for name, config_key in SOURCE_URL_CONFIG:
+        base_url = current_app.config.get(config_key)
+        if base_url and url.startswith(base_url):
+            return name
+    return 'ehr'
+
+
+def server_timing(spans, total):
+    """Return Server-Timing header value: total and duration per source"""
+    durations = {}
+    counts = {}
+    for s in spans:
+        durations[s.source] = durations.get(s.source, 0) + s.duration
+        counts[s.source] = counts.get(s.source, 0) + 1
+    metrics = [f'total;dur={total * 1000:.1f}']
+    metrics.extend(
+        f'{source};dur={duration * 1000:.1f};desc="{counts[source]} calls"'
+        for source, duration in durations.items())
+    return ', '.join(metrics)
+
+
+def end_trace(response):
+    """Add Server-Timing header to given response and log the request's spans"""
+    if 'trace_start' not in g:
+        return response
+    total = time.monotonic() - g.trace_start
+    spans = list(g.spans)
+
+    response.headers['Server-Timing'] = server_timing(spans, total)
+    response.headers['Timing-Allow-Origin'] = '*'
+    current_app.logger.info(
+        "request trace",
+        extra={
+            'tags': ['trace'],
+            'method': request.method,
+            'path': request.url_rule.rule if request.url_rule else request.path,
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 1),
+            'spans': [s.as_dict() for s in spans],
+        })
+    return response
+
+
+def init_app(app):
+    # spans also feed upstream metrics
+    if app.config['REQUEST_TRACING'] or app.config['METRICS']:
+        app.before_request(start_trace)
+    if app.config['REQUEST_TRACING']:
+        app.after_request(end_trace)
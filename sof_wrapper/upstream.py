@@ -0,0 +1,112 @@
+"""Upstream HTTP sessions
+
+Process-wide registry of pooled, keep-alive `requests` sessions, one per
+upstream origin (EHR `iss`, PDMP, PHR, RxNav, logserver), so connections
+and TLS sessions are reused across requests and worker threads.
+"""
+from http.cookiejar import DefaultCookiePolicy
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from sof_wrapper.tracing import source_name, span, tracing, url_template
+
+
+def origin(url):
+    """Return the origin (scheme and netloc) of given URL, used to key sessions"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+class UpstreamSession(requests.Session):
+    """Session applying a default timeout to every request
+
+    Shared across users, so cookies set by upstream servers are never persisted
+    """
+
+    def __init__(self, timeout=None, pool_maxsize=10):
+        super().__init__()
+        self.timeout = timeout
+        self.last_used = time.monotonic()
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        self.last_used = time.monotonic()
+        if not tracing():
+            return super().request(method, url, **kwargs)
+
+        with span(source_name(url), method=method, url=url_template(url)) as current:
+            response = super().request(method, url, **kwargs)
+            current.set(
+                status=response.status_code,
+                bytes=int(response.headers.get('Content-Length', 0)) or (
+                    None if kwargs.get('stream') else len(response.content)))
+            if response.status_code == 304:
+                current.set(cache='revalidated')
+        return response
+
+
+class UpstreamSessions(object):
+    """Registry handing out a pooled session per upstream origin
+
+    Usable prior to `init_app` with default settings, as is necessary for
+    logging handlers configured before extensions.  Sessions idle longer than
+    `idle_timeout` seconds are closed and evicted on subsequent lookups.
+    """
+
+    def __init__(self, app=None):
+        self.pool_maxsize = 10
+        self.timeout = (3.05, 30)
+        self.idle_timeout = 300
+        self._sessions = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.pool_maxsize = app.config['UPSTREAM_POOL_MAXSIZE']
+        self.timeout = (
+            app.config['UPSTREAM_CONNECT_TIMEOUT'],
+            app.config['UPSTREAM_READ_TIMEOUT'],
+        )
+        self.idle_timeout = app.config['UPSTREAM_IDLE_TIMEOUT']
+        self.clear()
+
+    def session_for(self, url):
+        """Return the pooled session for the origin of given URL"""
+        key = origin(url)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.get(key)
+            if session is None:
+                session = UpstreamSession(
+                    timeout=self.timeout, pool_maxsize=self.pool_maxsize)
+                self._sessions[key] = session
+            session.last_used = now
+            return session
+
+    def request(self, method, url, **kwargs):
+        """Send request via the pooled session for the origin of given URL"""
+        return self.session_for(url).request(method, url, **kwargs)
+
+    def clear(self):
+        """Close and remove all sessions"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def _evict_idle(self, now):
+        for key, session in list(self._sessions.items()):
+            if now - session.last_used > self.idle_timeout:
+                session.close()
+                del self._sessions[key]
@@ -0,0 +1,141 @@
+"""Drug class cache warm-up
+
+Preloads the drug class cache, such as after a deploy or redis flush, so
+the first medication lists don't pay full RxNav latency.  At startup, only
+one worker warms up the (shared) cache, so the rate limit holds overall.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app
+import os
+from redis.exceptions import RedisError
+import socket
+import threading
+import time
+import timeit
+
+from sof_wrapper.extensions import drug_class_cache
+from sof_wrapper.rxnav import (
+    get_drug_class_ids_batch,
+    get_drug_class_index,
+    local_drug_class_ids,
+)
+
+
+class RateLimiter(object):
+    """Thread safe limit of `rate` acquisitions per second, evenly spaced"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def rxcuis_from_file(lines):
+    """Generate RxCUIs, one per line, skipping blank lines and comments"""
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if line:
+            yield line
+
+
+def uncached(rxcuis):
+    """Return those of given RxCUIs neither in the local index nor cached"""
+    rxcuis = set(rxcuis)
+    rxcuis.difference_update(local_drug_class_ids(rxcuis))
+    fresh, _ = drug_class_cache.get_many(rxcuis, get_drug_class_index().digest)
+    return rxcuis.difference(fresh)
+
+
+def warm_up(rxcuis, rxnav_url, rate, concurrency, progress=None):
+    """Look up (and so cache) drug classes of given RxCUIs not yet cached
+
+    :param rate: max RxNav requests per second
+    :param concurrency: max concurrent RxNav requests
+    :param progress: optional callable, given count done and total
+    :returns: tuple of (count loaded, count failed, elapsed seconds)
+    """
+    start_time = timeit.default_timer()
+    rxcuis = uncached(rxcuis)
+    limiter = RateLimiter(rate)
+    app = current_app._get_current_object()
+
+    def load(rxcui):
+        limiter.acquire()
+        with app.app_context():
+            return rxcui in get_drug_class_ids_batch([rxcui], rxnav_url)
+
+    loaded = failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='warmup') as executor:
+        futures = [executor.submit(load, rxcui) for rxcui in rxcuis]
+        for done, future in enumerate(as_completed(futures), start=1):
+            if future.result():
+                loaded += 1
+            else:
+                failed += 1
+            if progress:
+                progress(done, len(futures))
+    return loaded, failed, timeit.default_timer() - start_time
+
+
+def warmup_rxcuis(app):
+    """Return RxCUIs to preload at startup, per configuration"""
+    rxcuis = set()
+    if app.config['DRUG_CLASS_WARMUP_FILE']:
+        with open(app.config['DRUG_CLASS_WARMUP_FILE'], 'r') as warmup_file:
+            rxcuis.update(rxcuis_from_file(warmup_file))
+    rxcuis.update(drug_class_cache.recently_seen(app.config['DRUG_CLASS_WARMUP_RECENT']))
+    return rxcuis
+
+
+def acquire_warmup_lock(app):
+    """Return True unless another worker started warm-up within DRUG_CLASS_WARMUP_LOCK_TTL
+
+    The lock isn't released, so workers started (or restarted) later skip warm-up
+    """
+    redis_handle = drug_class_cache.l2
+    if redis_handle is None:
+        return True
+    try:
+        return bool(redis_handle.set(
+            f"{drug_class_cache.prefix}warmup-lock",
+            f"{socket.gethostname()}:{os.getpid()}",
+            nx=True,
+            ex=app.config['DRUG_CLASS_WARMUP_LOCK_TTL']))
+    except RedisError as ex:
+        app.logger.warning("skipping drug class cache warm-up: %s", ex)
+        return False
+
+
+def start_warmup(app):
+    """Preload drug class cache in a background thread, if so configured"""
+    if not app.config['DRUG_CLASS_WARMUP_ON_STARTUP']:
+        return
+    if not acquire_warmup_lock(app):
+        app.logger.debug("drug class cache warm-up started by another worker")
+        return
+
+    def run():
+        with app.app_context():
+            try:
+                loaded, failed, elapsed = warm_up(
+                    warmup_rxcuis(app),
+                    rxnav_url=app.config['RXNAV_URL'],
+                    rate=app.config['DRUG_CLASS_WARMUP_RATE'],
+                    concurrency=app.config['RXNAV_MAX_CONCURRENCY'],
+                )
+            except Exception as ex:
+                app.logger.exception("drug class cache warm-up failed: %s", ex)
+                return
+            app.logger.info(
+                "drug class cache warm-up loaded %d RxCUIs (%d failed) in %.1fs",
+                loaded, failed, elapsed)
+
+    threading.Thread(target=run, name='drug-class-warmup', daemon=True).start()
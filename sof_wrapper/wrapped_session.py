@@ -1,5 +1,16 @@
 import pickle
-from flask import g, current_app, request, session
+from flask import g, current_app, has_app_context, request, session
+
+from sof_wrapper.session_fields import (
+    HOT_KEYS,
+    VERSION_FIELD,
+    decode_fields,
+    lookup,
+)
+from sof_wrapper.stats import get_stats
+from sof_wrapper.tracing import span
+
+stats = get_stats('session')
 
 
 def get_session_value(key, default=None):
@@ -11,37 +22,91 @@ def get_session_value(key, default=None):
 
     Until resolved, this function tries local and configured session
     and returns a value if found.
+
+    Dotted keys, such as `token_response.patient`, name nested values.
     """
-    if key in session:
-        return session.get(key, default)
+    if key.split('.')[0] in session:
+        return lookup(session, key, default)
 
     # session_id stored on entry point in `fhir_router`
     if 'session_id' in g:
-        return get_redis_session_data(g.session_id).get(key, default)
+        if current_app.config['SESSION_FIELDS'] and key in HOT_KEYS:
+            return get_session_fields(g.session_id).get(key, default)
+        return lookup(get_redis_session_data(g.session_id), key, default)
 
 
 def set_session_value(key, value):
     if request.cookies.get("session"):
         session[key] = value
+        invalidate_session_data()
         return
 
     raise NotImplementedError("Can't set session variables w/o session cookie")
 
 
+def invalidate_session_data():
+    """Discard session data memoized for the current request"""
+    if has_app_context():
+        g.pop('redis_session_data', None)
+        g.pop('redis_session_fields', None)
+
+
 def get_redis_session_data(session_id):
-    """Load session data associated with given session_id"""
+    """Load session data associated with given session_id
+
+    Memoized on `flask.g` for the life of the request (or app context);
+    treat as read only
+    """
     if session_id is None:
         return {}
 
+    memo = g.get('redis_session_data') if has_app_context() else None
+    if memo is not None and memo[0] == session_id:
+        return memo[1]
+
     # TODO: further investigate using SessionHandler
     redis_handle = current_app.config['SESSION_REDIS']
     session_prefix = current_app.config.get('SESSION_KEY_PREFIX', 'session:')
 
-    encoded_session_data = redis_handle.get(f'{session_prefix}{session_id}')
+    with span('redis', key='session') as current:
+        encoded_session_data = redis_handle.get(f'{session_prefix}{session_id}')
+        if current:
+            current.set(bytes=len(encoded_session_data or b''))
+    stats.incr('redis_read')
 
     # why doesn't this use the flask default JSON serializer?
     # (probably because the session is designed to hold non JSON serializable objects, like datetime)
     session_data = pickle.loads(encoded_session_data)
+    if has_app_context():
+        g.redis_session_data = (session_id, session_data)
     return session_data
 
 
+def get_session_fields(session_id):
+    """Load hot session values (see `HOT_KEYS`) associated with given session_id
+
+    Reads only the mirrored hash fields; sessions lacking them, not yet
+    migrated (see `migrate-session-fields` command) nor saved since, are
+    read from the pickled session.  Memoized like `get_redis_session_data`
+    """
+    memo = g.get('redis_session_fields') if has_app_context() else None
+    if memo is not None and memo[0] == session_id:
+        return memo[1]
+
+    redis_handle = current_app.config['SESSION_REDIS']
+    fields_key = f"{current_app.config['SESSION_FIELDS_PREFIX']}{session_id}"
+    keys = (VERSION_FIELD,) + HOT_KEYS
+    with span('redis', key='session-fields'):
+        values = redis_handle.hmget(fields_key, keys)
+    stats.incr('redis_fields_read')
+
+    if values[0] is None:
+        session_data = get_redis_session_data(session_id)
+        stats.incr('fields_unmigrated')
+        fields = {key: lookup(session_data, key) for key in HOT_KEYS}
+    else:
+        fields = decode_fields(keys[1:], values[1:])
+
+    if has_app_context():
+        g.redis_session_fields = (session_id, fields)
+    return fields
@@ -1,13 +1,52 @@
 from pytest import fixture
+from pytest_redis import factories
+from sof_wrapper.config import SESSION_REDIS
 
-
-@fixture
-def app():
-    from sof_wrapper.app import create_app
-    return create_app(testing=True)
+real_redis_connection = SESSION_REDIS.connection_pool.get_connection('testing-connection')
+redis_factory = factories.redis_noproc(host=real_redis_connection.host)
+redis_handle = factories.redisdb('redis_factory')
 
 
 @fixture
 def client(app):
     with app.test_client() as c:
         yield c
+
+
+@fixture
+def pdmp_medication_request():
+    """Returns a sample FHIR R4 MedicationRequest from the PDMP SCRIPT facade"""
+
+    return {
+      "authoredOn": "2018-09-20",
+      "dispenseRequest": {
+        "expectedSupplyDuration": {
+          "code": "d",
+          "system": "http://unitsofmeasure.org",
+          "unit": "days",
+          "value": 10
+        },
+        "quantity": {
+          "value": 25
+        }
+      },
+      "medicationCodeableConcept": {
+        "coding": [
+          {
+            "code": "16714062201",
+            "display": "ZOLPIDEM TARTRATE 10 MG TABLET",
+            "system": "http://hl7.org/fhir/sid/ndc"
+          },
+          {
+            "code": "854873",
+            "display": "ZOLPIDEM TARTRATE 10 MG TABLET",
+            "system": "http://www.nlm.nih.gov/research/umls/rxnorm"
+          }
+        ],
+        "text": "ZOLPIDEM TARTRATE 10 MG TABLET"
+      },
+      "requester": {
+        "display": "HID TEST PRESCRIBER"
+      },
+      "resourceType": "MedicationRequest"
+    }
@@ -31,3 +31,216 @@ def test_auditlog_post(client):
     }
     response = client.post('/auditlog', json=data)
     assert response.status_code == 200
+
+
+def test_audit_aggregator(caplog):
+    from sof_wrapper.audit import AuditAggregator
+
+    aggregator = AuditAggregator('rxnorm-drug-class-not-found', window=60)
+    assert not aggregator.repeated('309362')
+    assert aggregator.repeated('309362')
+    assert aggregator.repeated('309362')
+    assert not aggregator.repeated('854873')
+
+    aggregator.flush()
+    summary = caplog.records[-1]
+    assert summary.counts == {'309362': 2}
+    assert 'aggregated' in summary.tags
+
+    # nothing more to report
+    aggregator.flush()
+    assert caplog.records[-1] is summary
+
+
+def test_audit_aggregator_session(app, caplog):
+    from sof_wrapper.audit import AuditAggregator
+
+    aggregator = AuditAggregator('rxnorm-drug-class-not-found', window=60)
+    assert not aggregator.repeated('309362')
+    with app.test_request_context():
+        from flask import session
+        session['user'] = 'testy@example.com'
+        session['subject'] = 'Patient/123'
+        assert aggregator.repeated('309362')
+
+    # a summary per user and subject, as other audit entries
+    aggregator.flush()
+    summary = caplog.records[-1]
+    assert summary.counts == {'309362': 1}
+    assert summary.user == 'testy@example.com'
+    assert summary.subject == 'Patient/123'
+
+
+def test_logserver_handler_batches(requests_mock):
+    import logging
+    from sof_wrapper.logserverhandler import LogServerHandler
+
+    events = requests_mock.post('https://logs.test/events')
+    handler = LogServerHandler(
+        url='https://logs.test', jwt='token', batch_size=10, flush_interval=60, bulk=True)
+    logger = logging.getLogger('test_logserver_handler_batches')
+    logger.addHandler(handler)
+    try:
+        for i in range(3):
+            logger.warning("event %d", i)
+        # queued, not sent from the logging thread
+        assert handler.depth == 3
+        handler.flush()
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    assert events.call_count == 1
+    assert [e['event']['message'] for e in events.last_request.json()] == [
+        'event 0', 'event 1', 'event 2']
+
+
+def test_logserver_handler_drop_oldest(requests_mock):
+    import logging
+    from sof_wrapper.logserverhandler import LogServerHandler
+
+    events = requests_mock.post('https://logs.test/events')
+    handler = LogServerHandler(
+        url='https://logs.test', jwt='token', batch_size=10, flush_interval=60,
+        queue_size=2)
+    for i in range(3):
+        handler.handle(logging.makeLogRecord({'msg': f"event {i}", 'levelno': logging.INFO}))
+    handler.close()
+
+    # w/o bulk, one event per request
+    assert [r.json()['event']['message'] for r in events.request_history] == ['event 1', 'event 2']
+
+
+def test_logserver_handler_block(requests_mock):
+    import logging
+    import threading
+    from sof_wrapper.logserverhandler import LogServerHandler
+
+    requests_mock.post('https://logs.test/events')
+    handler = LogServerHandler(
+        url='https://logs.test', jwt='token', batch_size=10, flush_interval=60,
+        queue_size=1, overflow='block')
+    handler.handle(logging.makeLogRecord({'msg': "event 0", 'levelno': logging.INFO}))
+    blocked = threading.Thread(target=handler.handle, args=(
+        logging.makeLogRecord({'msg': "event 1", 'levelno': logging.INFO}),))
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+    # handler lock isn't held while blocked
+    assert handler.lock.acquire(timeout=1)
+    handler.lock.release()
+
+    handler.flush()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    handler.close()
+
+
+def test_spool(tmp_path):
+    from sof_wrapper.spool import Spool
+
+    spool = Spool(str(tmp_path), segment_size=64)
+    spool.append([{'event': i} for i in range(3)])
+    spool.append([{'event': 3}])
+    assert spool.depth() > 0
+
+    events, position = spool.read(3)
+    assert events == [{'event': 0}, {'event': 1}, {'event': 2}]
+    spool.commit(position)
+    spool.close()
+
+    # resumes from checkpoint
+    spool = Spool(str(tmp_path), segment_size=64)
+    events, position = spool.read(10)
+    assert events == [{'event': 3}]
+    spool.commit(position)
+    assert spool.depth() == 0
+    assert spool.read(10)[0] == []
+    spool.close()
+
+
+def test_spool_cap(tmp_path):
+    from sof_wrapper.spool import Spool
+
+    spool = Spool(str(tmp_path), segment_size=64, max_bytes=128)
+    for i in range(20):
+        spool.append([{'event': i}])
+    # oldest segments dropped
+    events, _ = spool.read(20)
+    assert 0 < len(events) < 20
+    assert events[-1] == {'event': 19}
+    assert spool.depth() <= 128 + 64
+    spool.close()
+
+
+def test_logserver_handler_spool(tmp_path, requests_mock):
+    import logging
+    import time
+    from sof_wrapper.logserverhandler import LogServerHandler
+    from sof_wrapper.spool import Spool
+
+    events = requests_mock.post('https://logs.test/events', status_code=503)
+    spool = Spool(str(tmp_path))
+    handler = LogServerHandler(
+        url='https://logs.test', jwt='token', flush_interval=0.01, spool=spool)
+    handler.handle(logging.makeLogRecord({'msg': "event", 'levelno': logging.INFO}))
+    deadline = time.monotonic() + 5
+    while events.call_count < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # retained while logserver is unavailable
+    assert spool.depth() > 0
+
+    events = requests_mock.post('https://logs.test/events')
+    while spool.depth() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    handler.close()
+    assert spool.depth() == 0
+    assert events.last_request.json()['event']['message'] == "event"
+
+
+def test_logserver_handler_spools_batches(tmp_path, mocker, requests_mock):
+    import logging
+    from sof_wrapper.logserverhandler import LogServerHandler
+    from sof_wrapper.spool import Spool
+
+    requests_mock.post('https://logs.test/events')
+    spool = Spool(str(tmp_path))
+    append = mocker.spy(spool, 'append')
+    handler = LogServerHandler(
+        url='https://logs.test', jwt='token', flush_interval=60, spool=spool)
+    for i in range(3):
+        handler.handle(logging.makeLogRecord({'msg': f"event {i}", 'levelno': logging.INFO}))
+    # queued as logged; spooled (w/ one fsync) per batch
+    assert handler.depth == 3
+    append.assert_not_called()
+    handler.flush()
+    assert append.call_count == 1
+    assert len(append.call_args[0][0]) == 3
+    handler.close()
+
+
+def test_logserver_handler_ships_orphaned_spool(tmp_path, requests_mock):
+    import logging
+    import time
+    from sof_wrapper.logserverhandler import LogServerHandler
+    from sof_wrapper.spool import Spool
+
+    events = requests_mock.post('https://logs.test/events')
+    # spool of a worker since exited, its slot not reclaimed
+    exited = Spool(str(tmp_path))
+    spool = Spool(str(tmp_path))
+    exited.append([{'event': {'message': "orphaned"}}])
+    exited.close()
+
+    handler = LogServerHandler(
+        url='https://logs.test', jwt='token', flush_interval=0.01, spool=spool)
+    handler.handle(logging.makeLogRecord({'msg': "event", 'levelno': logging.INFO}))
+    deadline = time.monotonic() + 5
+    while events.call_count < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    handler.close()
+    assert sorted(r.json()['event']['message'] for r in events.request_history) == [
+        "event", "orphaned"]
+    drained = Spool(str(tmp_path))
+    assert drained.depth() == 0
+    drained.close()
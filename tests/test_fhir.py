@@ -1,9 +1,10 @@
+from copy import deepcopy
 import json
 import os
 import pickle
+import re
+import time
 from pytest import fixture
-from pytest_redis import factories
-from sof_wrapper.config import SESSION_REDIS
 
 emr_endpoint = "https://launch.smarthealthit.org/v/r4/fhir"
 patient_id = '5c41cecf-cf81-434f-9da7-e24e5a99dbc2'
@@ -31,6 +32,22 @@ def emr_med_request_bundle(request):
     return json_from_file(request, "MedicationRequestBundleR4.json")
 
 
+@fixture
+def emr_med_request_last_page(emr_med_request_bundle):
+    """Final page of the EMR MedicationRequest searchset, as linked by `next`"""
+    return {
+        'resourceType': 'Bundle',
+        'type': 'searchset',
+        'entry': emr_med_request_bundle['entry'][:2],
+    }
+
+
+def mock_next_page(requests_mock, bundle, next_page):
+    """Mock request for the page linked as `next` from given bundle"""
+    from sof_wrapper.paging import next_link
+    return requests_mock.get(next_link(bundle), json=next_page)
+
+
 @fixture
 def patient_b_jackson(request):
     return json_from_file(request, "PatientBJackson.json")
@@ -41,11 +58,6 @@ def pdmp_med_request_bundle(request):
     return json_from_file(request, "PDMP-MedicationRequestBundleR4.json")
 
 
-real_redis_connection = SESSION_REDIS.connection_pool.get_connection('testing-connection')
-redis_factory = factories.redis_noproc(host=real_redis_connection.host)
-redis_handle = factories.redisdb('redis_factory')
-
-
 @fixture
 def redis_session(client, redis_handle):
     """Loads a redis-session with a mock patient id and iss"""
@@ -79,54 +91,81 @@ def auth_extensions():
     ]
 
 
-@fixture
-def pdmp_medication_request():
-    """Returns a sample FHIR R4 MedicationRequest from the PDMP SCRIPT facade"""
+def test_emr_med_request(
+        app_w_iss, requests_mock, emr_med_request_bundle, emr_med_request_last_page):
+    """Test EMR MedicationRequest"""
+    # Mock EMR response for MedicationRequest
+    requests_mock.get(
+        '/'.join((emr_endpoint, 'MedicationRequest')),
+        json=emr_med_request_bundle)
+    mock_next_page(requests_mock, emr_med_request_bundle, emr_med_request_last_page)
 
-    return {
-      "authoredOn": "2018-09-20",
-      "dispenseRequest": {
-        "expectedSupplyDuration": {
-          "code": "d",
-          "system": "http://unitsofmeasure.org",
-          "unit": "days",
-          "value": 10
-        },
-        "quantity": {
-          "value": 25
-        }
-      },
-      "medicationCodeableConcept": {
-        "coding": [
-          {
-            "code": "16714062201",
-            "display": "ZOLPIDEM TARTRATE 10 MG TABLET",
-            "system": "http://hl7.org/fhir/sid/ndc"
-          },
-          {
-            "code": "854873",
-            "display": "ZOLPIDEM TARTRATE 10 MG TABLET",
-            "system": "http://www.nlm.nih.gov/research/umls/rxnorm"
-          }
-        ],
-        "text": "ZOLPIDEM TARTRATE 10 MG TABLET"
-      },
-      "requester": {
-        "display": "HID TEST PRESCRIBER"
-      },
-      "resourceType": "MedicationRequest"
-    }
+    result = app_w_iss.get('/v/r4/fhir/emr/MedicationRequest')
+    assert result.json['entry'] == (
+        emr_med_request_bundle['entry'] + emr_med_request_last_page['entry'])
+    assert 'next' not in [link['relation'] for link in result.json['link']]
 
 
-def test_emr_med_request(app_w_iss, requests_mock, emr_med_request_bundle):
-    """Test EMR MedicationRequest"""
-    # Mock EMR response for MedicationRequest
+def test_emr_med_request_max_pages(
+        app_w_iss, requests_mock, emr_med_request_bundle, emr_med_request_last_page):
+    """Confirm paging stops at configured limit, keeping the next link"""
+    from sof_wrapper.paging import next_link
+    app_w_iss.application.config['EMR_MAX_PAGES'] = 1
     requests_mock.get(
         '/'.join((emr_endpoint, 'MedicationRequest')),
         json=emr_med_request_bundle)
+    next_page = mock_next_page(
+        requests_mock, emr_med_request_bundle, emr_med_request_last_page)
 
     result = app_w_iss.get('/v/r4/fhir/emr/MedicationRequest')
-    assert result.json == emr_med_request_bundle
+    assert result.json['entry'][:-1] == emr_med_request_bundle['entry']
+    assert result.json['entry'][-1]['resource']['resourceType'] == 'OperationOutcome'
+    assert next_link(result.json) == next_link(emr_med_request_bundle)
+    assert not next_page.called
+
+
+def test_emr_med_request_next_page_timeout(
+        app_w_iss, requests_mock, emr_med_request_bundle):
+    """Confirm a timed out next page ends paging w/ partial results, rather than failing"""
+    from requests.exceptions import ReadTimeout
+    from sof_wrapper.paging import next_link
+    requests_mock.get(
+        '/'.join((emr_endpoint, 'MedicationRequest')),
+        json=emr_med_request_bundle)
+    requests_mock.get(next_link(emr_med_request_bundle), exc=ReadTimeout)
+
+    result = app_w_iss.get('/v/r4/fhir/emr/MedicationRequest')
+    assert result.status_code == 200
+    assert result.json['entry'][:-1] == emr_med_request_bundle['entry']
+    assert result.json['entry'][-1]['resource']['resourceType'] == 'OperationOutcome'
+    assert next_link(result.json) == next_link(emr_med_request_bundle)
+
+
+def test_emr_med_request_next_page_error(
+        app_w_iss, requests_mock, emr_med_request_bundle):
+    """Confirm a failing next page ends paging w/ partial results, rather than failing"""
+    from sof_wrapper.paging import next_link
+    requests_mock.get(
+        '/'.join((emr_endpoint, 'MedicationRequest')),
+        json=emr_med_request_bundle)
+    requests_mock.get(next_link(emr_med_request_bundle), status_code=502)
+
+    result = app_w_iss.get('/v/r4/fhir/emr/MedicationRequest')
+    assert result.status_code == 200
+    assert result.json['entry'][:-1] == emr_med_request_bundle['entry']
+    assert result.json['entry'][-1]['resource']['resourceType'] == 'OperationOutcome'
+    assert next_link(result.json) == next_link(emr_med_request_bundle)
+
+
+def test_fhir_router_follow_next_non_bundle(
+        client, requests_mock, redis_session, patient_b_jackson):
+    """Confirm only Bundles are paged and merged"""
+    client.application.config['FHIR_ROUTER_FOLLOW_NEXT'] = True
+    requests_mock.get(f'{emr_endpoint}/Patient/{patient_id}', json=patient_b_jackson)
+
+    result = client.get(f'/fhir-router/{session_id}/Patient/{patient_id}')
+    assert result.json == patient_b_jackson
+    assert 'entry' not in result.json
 
 
 def test_pdmp_med_request(client, requests_mock, pdmp_med_request_bundle):
@@ -162,6 +201,62 @@ def test_patient_by_id(app_w_iss, requests_mock, patient_b_jackson):
     assert result.json == patient_b_jackson
 
 
+def test_patient_by_id_cached(app_w_iss, requests_mock, patient_b_jackson):
+    from sof_wrapper.patient_cache import invalidate_patient
+    with app_w_iss.application.test_request_context():
+        invalidate_patient(emr_endpoint, patient_id)
+
+    path = f'/v/r4/fhir/Patient/{patient_id}'
+    upstream = requests_mock.get(path, json=patient_b_jackson)
+
+    assert app_w_iss.get(path).json == patient_b_jackson
+    assert app_w_iss.get(path).json == patient_b_jackson
+    assert upstream.call_count == 1
+
+
+def test_patient_cache_scoped_to_credential(app, patient_b_jackson):
+    """Confirm a Patient cached for one caller isn't served to another"""
+    from sof_wrapper.patient_cache import cache_patient, get_cached_patient, invalidate_patient
+    with app.test_request_context(headers={'Authorization': 'Bearer abc'}):
+        invalidate_patient(emr_endpoint, patient_id)
+        cache_patient(emr_endpoint, patient_id, patient_b_jackson)
+        assert get_cached_patient(emr_endpoint, patient_id) == patient_b_jackson
+    with app.test_request_context(headers={'Authorization': 'Bearer xyz'}):
+        assert get_cached_patient(emr_endpoint, patient_id) is None
+    with app.test_request_context():
+        assert get_cached_patient(emr_endpoint, patient_id) is None
+
+
+def test_patient_cache_prunes_expired(app, mocker, redis_handle, patient_b_jackson):
+    """Confirm expired scopes are dropped as others are cached"""
+    from sof_wrapper.patient_cache import cache_patient, invalidate_patient, patient_cache_key
+    clock = mocker.patch('sof_wrapper.patient_cache.time')
+    clock.time.return_value = 1000.0
+    with app.test_request_context(headers={'Authorization': 'Bearer abc'}):
+        invalidate_patient(emr_endpoint, patient_id)
+        cache_patient(emr_endpoint, patient_id, patient_b_jackson)
+    clock.time.return_value += app.config['PATIENT_CACHE_TTL'] + 1
+    with app.test_request_context(headers={'Authorization': 'Bearer xyz'}):
+        cache_patient(emr_endpoint, patient_id, patient_b_jackson)
+        assert redis_handle.hlen(patient_cache_key(emr_endpoint, patient_id)) == 1
+
+
+def test_fhir_router_invalidates_patient(
+        client, requests_mock, redis_session, redis_handle, patient_b_jackson):
+    from sof_wrapper.patient_cache import cache_patient, get_cached_patient
+    headers = {'Authorization': 'Bearer abc'}
+    with client.application.test_request_context(headers=headers):
+        cache_patient(emr_endpoint, patient_id, patient_b_jackson)
+        assert get_cached_patient(emr_endpoint, patient_id) == patient_b_jackson
+
+    requests_mock.put(f'{emr_endpoint}/Patient/{patient_id}', json=patient_b_jackson)
+    client.put(
+        f'/fhir-router/{session_id}/Patient/{patient_id}', json=patient_b_jackson, headers=headers)
+
+    with client.application.test_request_context(headers=headers):
+        assert get_cached_patient(emr_endpoint, patient_id) is None
+
+
 def test_fhir_router_requires_patient(client):
     """Without a patient, expect 400"""
     result = client.get('/fhir-router/')
@@ -178,6 +273,174 @@ def test_fhir_router_with_patient_param(client, mocker, redis_session):
     fhir.medication_request.assert_called_once_with(patient_id=patient_id)
 
 
+def test_fhir_router_medication_request(
+        client, requests_mock, redis_session, patient_b_jackson,
+        emr_med_request_bundle, emr_med_request_last_page, pdmp_medication_request):
+    """Confirm PDMP and EMR results are fetched (concurrently) and collated"""
+    from sof_wrapper import tracing
+    client.application.config['REQUEST_TRACING'] = True
+    tracing.init_app(client.application)
+    pdmp_url = "https://cosri-pdmp.cirg.washington.edu"
+    client.application.config['PDMP_URL'] = pdmp_url
+    # empty SCRIPT_ENDPOINT_URL indicates demo deploy, with fake DEA
+    client.application.config['SCRIPT_ENDPOINT_URL'] = ""
+
+    requests_mock.get(
+        f'{emr_endpoint}/Patient/{patient_id}', json=patient_b_jackson)
+    requests_mock.get(
+        f'{emr_endpoint}/MedicationRequest', json=emr_med_request_bundle)
+    mock_next_page(requests_mock, emr_med_request_bundle, emr_med_request_last_page)
+    pdmp_mock = requests_mock.get(
+        f"{pdmp_url}/v/r4/fhir/MedicationOrder",
+        json={'resourceType': 'Bundle', 'entry': [{'resource': pdmp_medication_request}]})
+    requests_mock.get(
+        re.compile('/REST/rxclass/class/byRxcui.json'),
+        json={'rxclassDrugInfoList': {'rxclassDrugInfo': []}})
+
+    result = client.get(f'/fhir-router/{session_id}/MedicationRequest')
+    assert result.status_code == 200
+    assert result.json['total'] == (
+        len(emr_med_request_bundle['entry']) + len(emr_med_request_last_page['entry']) + 1)
+    # PDMP results are listed first
+    assert result.json['entry'][0]['resource']['requester'] == pdmp_medication_request['requester']
+    assert pdmp_mock.last_request.qs['subject:patient.name.family'] == ['jackson']
+    # upstream hops timed per source
+    server_timing = result.headers['Server-Timing']
+    for source in ('total', 'ehr', 'pdmp', 'redis'):
+        assert re.search(f'(^|, ){source};dur=', server_timing)
+
+
+def test_fhir_router_medication_request_deadline(
+        client, requests_mock, redis_session, patient_b_jackson, emr_med_request_last_page):
+    """Confirm partial results are returned when PDMP misses the deadline"""
+    pdmp_url = "https://cosri-pdmp.cirg.washington.edu"
+    client.application.config['PDMP_URL'] = pdmp_url
+    client.application.config['SCRIPT_ENDPOINT_URL'] = ""
+    client.application.config['MED_REQUEST_DEADLINE'] = 0.3
+    client.application.config['MED_ANNOTATION_BUDGET'] = 0.1
+
+    def slow_pdmp(request, context):
+        time.sleep(0.5)
+        return {'resourceType': 'Bundle', 'entry': []}
+
+    requests_mock.get(
+        f'{emr_endpoint}/Patient/{patient_id}', json=patient_b_jackson)
+    requests_mock.get(
+        f'{emr_endpoint}/MedicationRequest', json=emr_med_request_last_page)
+    requests_mock.get(f"{pdmp_url}/v/r4/fhir/MedicationOrder", json=slow_pdmp)
+    requests_mock.get(
+        re.compile('/REST/rxclass/class/byRxcui.json'),
+        json={'rxclassDrugInfoList': {'rxclassDrugInfo': []}})
+
+    result = client.get(f'/fhir-router/{session_id}/MedicationRequest')
+    assert result.status_code == 200
+    resource_types = [entry['resource']['resourceType'] for entry in result.json['entry']]
+    assert resource_types.count('MedicationRequest') == len(emr_med_request_last_page['entry'])
+    assert resource_types[-1] == 'OperationOutcome'
+    assert 'PDMP' in result.json['entry'][-1]['resource']['issue'][0]['diagnostics']
+    assert result.json['total'] == len(emr_med_request_last_page['entry'])
+
+
+def test_fhir_router_medication_request_connection_error(
+        client, requests_mock, redis_session, patient_b_jackson):
+    """Confirm partial results when the EMR connection fails while reading"""
+    from requests.exceptions import ConnectionError
+    pdmp_url = "https://cosri-pdmp.cirg.washington.edu"
+    client.application.config['PDMP_URL'] = pdmp_url
+    client.application.config['SCRIPT_ENDPOINT_URL'] = ""
+
+    requests_mock.get(
+        f'{emr_endpoint}/Patient/{patient_id}', json=patient_b_jackson)
+    requests_mock.get(f'{emr_endpoint}/MedicationRequest', exc=ConnectionError)
+    requests_mock.get(
+        f"{pdmp_url}/v/r4/fhir/MedicationOrder", json={'resourceType': 'Bundle', 'entry': []})
+
+    result = client.get(f'/fhir-router/{session_id}/MedicationRequest')
+    assert result.status_code == 200
+    assert 'EMR' in result.json['entry'][-1]['resource']['issue'][0]['diagnostics']
+    # outcomes aren't matches
+    assert result.json['total'] == 0
+
+
+def test_fhir_router_streaming(client, requests_mock, redis_session):
+    """Confirm streamed pass-through retains upstream status, headers and bytes"""
+    client.application.config['FHIR_ROUTER_STREAMING'] = True
+    body = b'{"resourceType": "OperationOutcome"}'
+    requests_mock.get(
+        f'{emr_endpoint}/Observation',
+        content=body,
+        status_code=404,
+        headers={'Content-Type': 'application/fhir+json', 'Content-Encoding': 'identity'},
+    )
+
+    result = client.get(f'/fhir-router/{session_id}/Observation')
+    assert result.status_code == 404
+    assert result.data == body
+    assert result.headers['Content-Type'] == 'application/fhir+json'
+    assert result.headers['Content-Encoding'] == 'identity'
+    assert requests_mock.last_request.stream
+
+
+def test_fhir_router_conditional_cache(client, requests_mock, redis_session):
+    """Confirm cached responses are revalidated and served on 304"""
+    from sof_wrapper.response_cache import stats
+    client.application.config['FHIR_ROUTER_CACHE_TTL'] = 60
+    stats.reset()
+    body = {'resourceType': 'Observation', 'id': 'cached-observation'}
+    url = f'{emr_endpoint}/Observation/cached-observation'
+    requests_mock.get(url, [
+        {'json': body, 'headers': {'ETag': 'W/"1"'}},
+        {'status_code': 304},
+        {'status_code': 304},
+    ])
+
+    path = f'/fhir-router/{session_id}/Observation/cached-observation'
+    first = client.get(path, headers={'Authorization': 'Bearer abc'})
+    second = client.get(path, headers={'Authorization': 'Bearer abc'})
+    assert first.json == second.json == body
+    assert requests_mock.last_request.headers['If-None-Match'] == 'W/"1"'
+
+    # client's own conditional request is answered in kind
+    third = client.get(
+        path, headers={'Authorization': 'Bearer abc', 'If-None-Match': 'W/"1"'})
+    assert third.status_code == 304
+    assert stats.snapshot() == {'miss': 1, 'revalidate': 2, 'hit': 2}
+
+
+def test_fhir_router_cache_if_none_match(client, requests_mock, redis_session):
+    """Confirm each listed ETag is compared exactly, w/ weak comparison"""
+    client.application.config['FHIR_ROUTER_CACHE_TTL'] = 60
+    body = {'resourceType': 'Observation', 'id': 'etag-observation'}
+    requests_mock.get(
+        f'{emr_endpoint}/Observation/etag-observation', json=body, headers={'ETag': 'W/"1"'})
+
+    path = f'/fhir-router/{session_id}/Observation/etag-observation'
+    for if_none_match, status_code in (
+            ('W/"11"', 200),
+            ('"2", "1"', 304),
+            ('"2", W/"1"', 304),
+            ('*', 304)):
+        result = client.get(
+            path, headers={'Authorization': 'Bearer abc', 'If-None-Match': if_none_match})
+        assert result.status_code == status_code
+
+
+def test_fhir_router_cache_repeated_params(client, requests_mock, redis_session):
+    """Confirm repeated query parameters are all sent upstream and cached apart"""
+    client.application.config['FHIR_ROUTER_CACHE_TTL'] = 60
+    requests_mock.get(
+        f'{emr_endpoint}/Observation',
+        json={'resourceType': 'Bundle'}, headers={'ETag': 'W/"1"'})
+
+    path = f'/fhir-router/{session_id}/Observation'
+    client.get(f'{path}?date=ge2020&date=le2021', headers={'Authorization': 'Bearer abc'})
+    assert requests_mock.last_request.qs['date'] == ['ge2020', 'le2021']
+    assert 'If-None-Match' not in requests_mock.last_request.headers
+
+    client.get(f'{path}?date=ge2020', headers={'Authorization': 'Bearer abc'})
+    assert 'If-None-Match' not in requests_mock.last_request.headers
+
+
 def test_extension_lookup(auth_extensions):
     """Test extension lookup by extension URL"""
     from sof_wrapper.auth.views import get_extension_value
@@ -202,3 +465,117 @@ def test_drug_classes(app, pdmp_medication_request):
     }
 
     assert drug_class_extension in annotated_pdmp_med['medicationCodeableConcept']['extension']
+
+
+def test_annotate_meds_batch(app, requests_mock, pdmp_medication_request):
+    """Confirm each distinct RxCUI is looked up once per bundle"""
+    from sof_wrapper.api.fhir import annotate_meds
+    rxcui = '999001'
+    pdmp_medication_request['medicationCodeableConcept']['coding'][1]['code'] = rxcui
+    rxnav = requests_mock.get(
+        re.compile(f'/REST/rxclass/class/byRxcui.json\\?rxcui={rxcui}'),
+        json={'rxclassDrugInfoList': {'rxclassDrugInfo': [
+            {'rxclassMinConceptItem': {'classId': 'CN309'}}]}})
+    bundle = {'resourceType': 'Bundle', 'entry': [
+        {'resource': deepcopy(pdmp_medication_request)} for _ in range(3)]}
+
+    with app.test_request_context():
+        annotated = annotate_meds(bundle)
+
+    assert rxnav.call_count == 1
+    for entry in annotated['entry']:
+        assert entry['resource']['medicationCodeableConcept']['extension'] == [{
+            "url": "http://cosri.org/fhir/drug_class",
+            "valueString": 'sedative',
+        }]
+
+
+def test_fhir_router_session_read_once(client, mocker, redis_session):
+    """Confirm the redis session is read once per request, however many values used"""
+    from sof_wrapper.api import fhir
+    from sof_wrapper.wrapped_session import get_session_value, stats
+
+    def medication_request(patient_id):
+        assert get_session_value('iss') == emr_endpoint
+        assert get_session_value('user') is None
+        return {'mock': 'results'}
+    mocker.patch.object(fhir, 'medication_request', side_effect=medication_request)
+
+    stats.reset()
+    client.get(f'/fhir-router/{session_id}/MedicationRequest')
+    assert stats.snapshot() == {'redis_read': 1}
+
+
+def test_session_fields(client, mocker, redis_session, redis_handle):
+    """Confirm hot session values are read from hash fields, once migrated"""
+    from sof_wrapper.api import fhir
+    from sof_wrapper.session_fields import migrate_sessions
+    from sof_wrapper.wrapped_session import get_session_value, stats
+    client.application.config['SESSION_FIELDS'] = True
+
+    def medication_request(patient_id):
+        assert get_session_value('iss') == emr_endpoint
+        assert get_session_value('token_response.patient') == patient_id
+        return {'mock': 'results'}
+    mocker.patch.object(fhir, 'medication_request', side_effect=medication_request)
+
+    stats.reset()
+    client.get(f'/fhir-router/{session_id}/MedicationRequest')
+    # read from blob session, not migrated on read
+    assert stats.snapshot()['fields_unmigrated'] == 1
+    client.get(f'/fhir-router/{session_id}/MedicationRequest')
+    assert stats.snapshot()['fields_unmigrated'] == 2
+
+    config = client.application.config
+    assert migrate_sessions(
+        redis_handle, key_prefix=config.get('SESSION_KEY_PREFIX', 'session:'),
+        fields_prefix=config['SESSION_FIELDS_PREFIX'], serializer=pickle)
+    stats.reset()
+    client.get(f'/fhir-router/{session_id}/MedicationRequest')
+    assert stats.snapshot() == {'redis_fields_read': 1}
+
+
+def test_session_fields_saved_when_modified(app, redis_handle):
+    from flask import Response, request
+    from sof_wrapper.session_fields import FieldsRedisSessionInterface
+    interface = FieldsRedisSessionInterface(
+        redis_handle, 'session:', fields_prefix='session-fields:')
+
+    with app.test_request_context():
+        session = interface.open_session(app, request)
+        session['iss'] = emr_endpoint
+        interface.save_session(app, session, Response())
+        fields_key = f'session-fields:{session.sid}'
+        assert json.loads(redis_handle.hget(fields_key, 'iss')) == emr_endpoint
+
+        # unmodified sessions only extend the hash's expiry
+        redis_handle.hset(fields_key, 'iss', json.dumps('unchanged'))
+        redis_handle.persist(fields_key)
+        session.modified = False
+        interface.save_session(app, session, Response())
+        assert json.loads(redis_handle.hget(fields_key, 'iss')) == 'unchanged'
+        assert redis_handle.ttl(fields_key) > 0
+
+
+def test_session_fields_saved_when_changed_in_place(app, redis_handle):
+    """Confirm changes to nested values, unseen by `session.modified`, are mirrored"""
+    from flask import Response, request
+    from sof_wrapper.session_fields import FieldsRedisSessionInterface
+    interface = FieldsRedisSessionInterface(
+        redis_handle, 'session:', fields_prefix='session-fields:')
+
+    with app.test_request_context():
+        session = interface.open_session(app, request)
+        session['token_response'] = {'patient': patient_id}
+        interface.save_session(app, session, Response())
+        sid = session.sid
+
+    with app.test_request_context(
+            headers={'Cookie': f"{app.session_cookie_name}={sid}"}):
+        session = interface.open_session(app, request)
+        session['token_response']['patient'] = 'other-patient'
+        assert not session.modified
+        interface.save_session(app, session, Response())
+        fields_key = f'session-fields:{sid}'
+        assert json.loads(
+            redis_handle.hget(fields_key, 'token_response.patient')) == 'other-patient'
@@ -0,0 +1,24 @@
+from pytest import fixture
+
+
+@fixture
+def metrics_app(monkeypatch):
+    """App w/ METRICS configured, its stats listener removed after"""
+    from sof_wrapper import config, stats
+    from sof_wrapper.app import create_app
+    monkeypatch.setattr(config, 'METRICS', True)
+    monkeypatch.setattr(stats, 'listeners', [])
+    return create_app(testing=True)
+
+
+def test_metrics(metrics_app):
+    from sof_wrapper.stats import get_stats
+    get_stats('test').incr('counted')
+
+    with metrics_app.test_client() as client:
+        client.get('/')
+        result = client.get('/metrics')
+    assert result.status_code == 200
+    assert b'sof_request_duration_seconds_count{endpoint="base.root",method="GET",status="200"}' \
+        in result.data
+    assert b'sof_stats_total{group="test",key="counted"}' in result.data
@@ -0,0 +1,133 @@
+import time
+
+from pytest import fixture, raises
+from requests.exceptions import HTTPError, ReadTimeout
+
+from sof_wrapper.pdmp_client import (
+    CLOSED,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    LatencyTracker,
+    PdmpClient,
+)
+
+pdmp_api = "https://cosri-pdmp.cirg.washington.edu/v/r4/fhir/MedicationOrder"
+
+
+@fixture
+def pdmp_app(app):
+    app.config['PDMP_BREAKER_THRESHOLD'] = 2
+    with app.app_context():
+        yield app
+
+
+def test_latency_percentile():
+    latency = LatencyTracker()
+    assert latency.percentile(95) is None
+    for ms in range(1, 101):
+        latency.record(ms / 1000)
+    assert latency.percentile(50) == 0.051
+    assert latency.percentile(95) == 0.096
+
+
+def test_breaker_opens_and_resets():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    breaker.reset_timeout = 0
+    # half-open; allows a trial request
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_last_good_served_when_failing(pdmp_app, requests_mock):
+    client = PdmpClient()
+    params = {'subject:Patient.name.family': 'Jackson'}
+    requests_mock.get(pdmp_api, [
+        {'json': {'resourceType': 'Bundle', 'entry': [{}]}},
+        {'status_code': 503},
+        {'status_code': 503},
+    ])
+
+    def is_stale(result):
+        # good result, noted as stale by an OperationOutcome
+        return (
+            result['entry'][:-1] == good['entry'] and
+            result['entry'][-1]['resource']['resourceType'] == 'OperationOutcome')
+
+    good = client.get(pdmp_api, params, timeout=1)
+    assert is_stale(client.get(pdmp_api, params, timeout=1))
+    assert is_stale(client.get(pdmp_api, params, timeout=1))
+    assert client.breaker.state == OPEN
+
+    # fails fast w/o a request
+    call_count = requests_mock.call_count
+    assert is_stale(client.get(pdmp_api, params, timeout=1))
+    assert requests_mock.call_count == call_count
+    with raises(CircuitOpenError):
+        client.get(pdmp_api, {'other': 'query'}, timeout=1)
+
+
+def test_client_errors_dont_trip_breaker(pdmp_app, requests_mock):
+    client = PdmpClient()
+    requests_mock.get(pdmp_api, status_code=400)
+    for _ in range(3):
+        with raises(HTTPError):
+            client.get(pdmp_api, {}, timeout=1)
+    assert client.breaker.state == CLOSED
+
+
+def test_client_error_completes_trial_request(pdmp_app, requests_mock):
+    client = PdmpClient()
+    client.breaker.record_failure()
+    client.breaker.record_failure()
+    client.breaker.reset_timeout = 0
+    requests_mock.get(pdmp_api, status_code=404)
+    with raises(HTTPError):
+        client.get(pdmp_api, {}, timeout=1)
+    assert client.breaker.state == CLOSED
+
+
+def test_hedge_timeout_capped_by_deadline(pdmp_app, mocker):
+    from sof_wrapper.deadline import start_deadline
+    pdmp_app.config['PDMP_HEDGE_MIN_SAMPLES'] = 1
+    client = PdmpClient()
+    client.latency.record(0.05)
+    timeouts = []
+
+    def slow_first_fetch(url, params, timeout):
+        timeouts.append(timeout)
+        if len(timeouts) == 1:
+            time.sleep(0.3)
+        return {'resourceType': 'Bundle', 'entry': []}, 0.01
+
+    mocker.patch('sof_wrapper.pdmp_client.fetch', side_effect=slow_first_fetch)
+    start_deadline(1)
+    client.get(pdmp_api, {}, timeout=(1, 1))
+    # hedge sent after the p95 latency, w/ only the time remaining
+    assert len(timeouts) == 2
+    assert all(t < 0.96 for t in timeouts[1])
+
+
+def test_deadline_timeouts_dont_trip_breaker(pdmp_app, mocker):
+    from sof_wrapper.deadline import start_deadline
+    client = PdmpClient()
+    mocker.patch('sof_wrapper.pdmp_client.fetch', side_effect=ReadTimeout)
+
+    # timeout capped by the request's deadline
+    start_deadline(0.5)
+    with raises(ReadTimeout):
+        client.get(pdmp_api, {}, timeout=(1, 1))
+    assert client.breaker.failures == 0
+
+    # full PDMP timeout expired
+    start_deadline(5)
+    with raises(ReadTimeout):
+        client.get(pdmp_api, {}, timeout=(1, 1))
+    assert client.breaker.failures == 1
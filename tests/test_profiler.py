@@ -0,0 +1,39 @@
+import os
+import pstats
+
+
+def test_profile_request(app, tmp_path):
+    from sof_wrapper import profiler
+    app.config['PROFILING'] = True
+    app.config['DEBUG_OUTPUT_DIR'] = str(tmp_path)
+    app.config['ENV'] = 'development'
+    profiler.init_app(app)
+
+    with app.test_client() as client:
+        assert 'X-Profile-Output' not in client.get('/').headers
+        name = client.get('/?_profile=collapsed').headers['X-Profile-Output']
+
+    stats = pstats.Stats(str(tmp_path / f"{name}.pstats"))
+    assert any(function == 'root' for _, _, function in stats.stats)
+    assert os.path.exists(tmp_path / f"{name}.collapsed")
+
+
+def test_profile_request_denied(app, tmp_path):
+    from sof_wrapper import profiler
+    app.config['PROFILING'] = True
+    app.config['DEBUG_OUTPUT_DIR'] = str(tmp_path)
+    profiler.init_app(app)
+
+    with app.test_client() as client:
+        assert 'X-Profile-Output' not in client.get('/', headers={'X-Profile': '1'}).headers
+
+
+def test_debug_output_path(app, tmp_path):
+    from pytest import raises
+    from sof_wrapper.debug_output import debug_output_path
+    app.config['DEBUG_OUTPUT_DIR'] = str(tmp_path)
+
+    with app.app_context():
+        assert debug_output_path('capture.json') == str(tmp_path / 'capture.json')
+        with raises(ValueError):
+            debug_output_path('../capture.json')
@@ -0,0 +1,254 @@
+import json
+import os
+import re
+
+from pytest import fixture
+
+from sof_wrapper.rxnav import DrugClassIndex, drug_class_map_path, get_drug_class_index
+
+
+def test_drug_class_index():
+    index = DrugClassIndex({'CN101': 'opioid', 'D000701': 'opioid', 'CN309': 'sedative'})
+    assert index.by_class_id['CN309'] == 'sedative'
+    assert index.class_ids_by_name['opioid'] == ('CN101', 'D000701')
+    assert index.class_names(['CN101', 'CN309', 'unmapped']) == {'opioid', 'sedative'}
+
+
+def test_drug_class_index_reload():
+    index = get_drug_class_index()
+    assert get_drug_class_index() is index
+    assert 'CN101' in index.class_ids_by_name['opioid']
+
+    # any change in mtime triggers reload
+    stat = os.stat(drug_class_map_path())
+    os.utime(drug_class_map_path(), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    try:
+        assert get_drug_class_index() is not index
+    finally:
+        os.utime(drug_class_map_path(), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def test_build_rxclass_index(tmp_path):
+    from sof_wrapper.rxclass_index import (
+        RxClassIndex,
+        build_index,
+        pairs_from_export,
+        pairs_from_rxnav_snapshot,
+    )
+    relevant = frozenset(('CN309', 'CN101'))
+    snapshot = [json.dumps({
+        'userInput': {'rxcui': '854873'},
+        'rxclassDrugInfoList': {'rxclassDrugInfo': [
+            {'rxclassMinConceptItem': {'classId': 'CN309'}},
+            {'rxclassMinConceptItem': {'classId': 'irrelevant'}},
+        ]}}),
+        json.dumps({'userInput': {'rxcui': '309362'}}),
+    ]
+    path = str(tmp_path / 'rxclass.sqlite')
+    assert build_index(path, pairs_from_rxnav_snapshot(snapshot), relevant) == 2
+
+    index = RxClassIndex(path, relevant)
+    assert not index.stale
+    assert index.lookup(['854873', '309362', 'unknown']) == {'854873': ('CN309',), '309362': ()}
+    assert RxClassIndex(path, frozenset(('CN309',))).stale
+
+    export = ['rxcui\tclassId\n', '835603\tCN101\n', '835603\tCN309\n']
+    build_index(path, pairs_from_export(export), relevant)
+    assert RxClassIndex(path, relevant).lookup(['835603']) == {'835603': ('CN101', 'CN309')}
+
+
+def test_drug_classes_from_index(app, tmp_path, pdmp_medication_request):
+    from sof_wrapper.rxclass_index import build_index
+    from sof_wrapper.rxnav import add_drug_classes
+
+    path = str(tmp_path / 'rxclass.sqlite')
+    app.config['RXCLASS_INDEX_PATH'] = path
+    with app.app_context():
+        build_index(path, [('854873', 'CN309')], get_drug_class_index().class_ids)
+        # no RxNav request necessary
+        annotated = add_drug_classes(pdmp_medication_request, rxnav_url="https://rxnav.invalid")
+
+    assert annotated['medicationCodeableConcept']['extension'] == [{
+        "url": "http://cosri.org/fhir/drug_class",
+        "valueString": 'sedative',
+    }]
+
+
+def test_lru_cache():
+    from sof_wrapper.drug_class_cache import LRUCache
+
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    # least recently used evicted
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+
+    cache.set('expired', 4, ttl=-1)
+    assert cache.get('expired') is None
+
+
+def test_drug_class_cache(app, requests_mock):
+    from sof_wrapper.drug_class_cache import stats
+    from sof_wrapper.rxnav import get_drug_class_ids_batch
+
+    rxnav = requests_mock.get(
+        re.compile('/REST/rxclass/class/byRxcui.json'),
+        json={'rxclassDrugInfoList': {'rxclassDrugInfo': [
+            {'rxclassMinConceptItem': {'classId': 'CN309'}},
+            {'rxclassMinConceptItem': {'classId': 'irrelevant'}}]}})
+    stats.reset()
+    with app.test_request_context():
+        assert get_drug_class_ids_batch(['999002'], "https://rxnav.test") == {'999002': ('CN309',)}
+        assert get_drug_class_ids_batch(['999002'], "https://rxnav.test") == {'999002': ('CN309',)}
+
+    assert rxnav.call_count == 1
+    assert stats.snapshot() == {'l1_hit': 1, 'miss': 1}
+
+
+@fixture
+def l2_cache(app, redis_handle):
+    """Enable the drug class cache's redis tier, disabled when TESTING"""
+    from sof_wrapper.extensions import drug_class_cache
+    drug_class_cache.l2 = redis_handle
+    yield drug_class_cache
+    drug_class_cache.l2 = None
+
+
+def test_drug_class_cache_l2(app, l2_cache, requests_mock):
+    from sof_wrapper.drug_class_cache import stats
+    from sof_wrapper.rxnav import get_drug_class_ids_batch
+
+    rxnav = requests_mock.get(
+        re.compile('/REST/rxclass/class/byRxcui.json'),
+        json={'rxclassDrugInfoList': {'rxclassDrugInfo': [
+            {'rxclassMinConceptItem': {'classId': 'CN309'}}]}})
+    stats.reset()
+    with app.test_request_context():
+        assert get_drug_class_ids_batch(['999004'], "https://rxnav.test") == {'999004': ('CN309',)}
+        # as from another worker
+        l2_cache.l1.clear()
+        assert get_drug_class_ids_batch(['999004'], "https://rxnav.test") == {'999004': ('CN309',)}
+        assert l2_cache.recently_seen(60) == ['999004']
+
+    assert rxnav.call_count == 1
+    assert stats.snapshot() == {'l2_hit': 1, 'miss': 1}
+    key, = l2_cache.l2.keys(f"{app.config['DRUG_CLASS_CACHE_PREFIX']}*:999004")
+    assert l2_cache.l2.ttl(key) > app.config['DRUG_CLASS_CACHE_STALE_TTL']
+
+
+def test_drug_class_cache_stale(app, l2_cache, requests_mock):
+    from sof_wrapper.rxnav import get_drug_class_ids_batch
+
+    requests_mock.get(re.compile('/REST/rxclass/class/byRxcui.json'), status_code=503)
+    with app.test_request_context():
+        assert get_drug_class_ids_batch(['999003'], "https://rxnav.test") == {}
+
+        # serve expired entry should RxNav fail
+        l2_cache.set('999003', get_drug_class_index().digest, ('CN101',), ttl=0)
+        l2_cache.l1.clear()
+        assert get_drug_class_ids_batch(['999003'], "https://rxnav.test") == {'999003': ('CN101',)}
+
+        l2_cache.evict(['999003'], get_drug_class_index().digest)
+        assert get_drug_class_ids_batch(['999003'], "https://rxnav.test") == {}
+
+
+def test_drug_class_cache_late_lookup(app, requests_mock):
+    """Confirm lookups complete after the timeout are cached all the same"""
+    import threading
+    import time
+    from sof_wrapper.extensions import drug_class_cache
+    from sof_wrapper.rxnav import get_drug_class_ids_batch
+
+    release = threading.Event()
+
+    def slow_response(request, context):
+        release.wait(5)
+        return {'rxclassDrugInfoList': {'rxclassDrugInfo': [
+            {'rxclassMinConceptItem': {'classId': 'CN309'}}]}}
+
+    rxnav = requests_mock.get(
+        re.compile('/REST/rxclass/class/byRxcui.json'), json=slow_response)
+    with app.test_request_context():
+        assert get_drug_class_ids_batch(['999005'], "https://rxnav.test", timeout=0.01) == {}
+        release.set()
+
+        deadline = time.monotonic() + 5
+        digest = get_drug_class_index().digest
+        while not drug_class_cache.get_many(['999005'], digest)[0]:
+            assert time.monotonic() < deadline, "late lookup not cached"
+            time.sleep(0.01)
+        assert get_drug_class_ids_batch(['999005'], "https://rxnav.test") == {'999005': ('CN309',)}
+    assert rxnav.call_count == 1
+
+
+def test_drug_classes_unavailable(app, mocker, requests_mock, pdmp_medication_request):
+    """RxNav failure leaves meds as is, not audited as lacking a drug class"""
+    from sof_wrapper.rxnav import add_drug_classes
+
+    requests_mock.get(re.compile('/REST/rxclass/class/byRxcui.json'), status_code=503)
+    audit_entry = mocker.patch('sof_wrapper.rxnav.audit_entry')
+    with app.test_request_context():
+        assert add_drug_classes(
+            pdmp_medication_request, rxnav_url="https://rxnav.test") == pdmp_medication_request
+    audit_entry.assert_not_called()
+
+
+def test_warm_up(app, requests_mock):
+    from sof_wrapper.rxnav import get_drug_class_ids_batch
+    from sof_wrapper.warmup import rxcuis_from_file, warm_up
+
+    rxnav = requests_mock.get(
+        re.compile('/REST/rxclass/class/byRxcui.json'),
+        json={'rxclassDrugInfoList': {'rxclassDrugInfo': [
+            {'rxclassMinConceptItem': {'classId': 'CN101'}}]}})
+    rxcuis = list(rxcuis_from_file(['# preload\n', '999101\n', '\n', '999102  # note\n']))
+    assert rxcuis == ['999101', '999102']
+
+    progress = []
+    with app.app_context():
+        loaded, failed, _ = warm_up(
+            rxcuis, "https://rxnav.test", rate=100, concurrency=2,
+            progress=lambda done, total: progress.append((done, total)))
+        assert (loaded, failed) == (2, 0)
+        assert progress[-1] == (2, 2)
+
+        # now served from cache
+        assert get_drug_class_ids_batch(rxcuis, "https://rxnav.test") == {
+            '999101': ('CN101',), '999102': ('CN101',)}
+        assert warm_up(rxcuis, "https://rxnav.test", rate=100, concurrency=2)[:2] == (0, 0)
+    assert rxnav.call_count == 2
+
+
+def test_warm_up_once(app, l2_cache):
+    from sof_wrapper.warmup import acquire_warmup_lock
+
+    # one worker of all sharing redis warms up
+    assert acquire_warmup_lock(app)
+    assert not acquire_warmup_lock(app)
+
+
+def test_add_drug_classes_copy_on_write(app, pdmp_medication_request):
+    from copy import deepcopy
+    from sof_wrapper.rxnav import add_drug_classes
+
+    original = deepcopy(pdmp_medication_request)
+    with app.app_context():
+        first = add_drug_classes(
+            pdmp_medication_request, rxnav_url="https://rxnav.invalid",
+            drug_class_ids={'854873': ('CN309',)})
+        second = add_drug_classes(
+            pdmp_medication_request, rxnav_url="https://rxnav.invalid",
+            drug_class_ids={'854873': ('CN309',)})
+
+    assert pdmp_medication_request == original
+    assert first == second
+    assert first['medicationCodeableConcept']['extension'] == [{
+        "url": "http://cosri.org/fhir/drug_class",
+        "valueString": 'sedative',
+    }]
+    # annotated meds don't share extensions
+    first['medicationCodeableConcept']['extension'][0]['valueString'] = 'modified'
+    assert second['medicationCodeableConcept']['extension'][0]['valueString'] == 'sedative'
@@ -0,0 +1,139 @@
+import threading
+import time
+
+from pytest import raises
+
+from sof_wrapper.singleflight import SingleFlight, flight_key
+
+
+def test_flight_key():
+    assert flight_key('emr', {'a': 1, 'b': 2}) == flight_key('emr', {'b': 2, 'a': 1})
+    assert flight_key('emr', 'Bearer one') != flight_key('emr', 'Bearer two')
+
+
+def run_concurrently(flight, fn, count=3):
+    """Call flight.do() from several threads while fn blocks; return results"""
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(flight.do('key', fn)))
+        for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def wait_for_followers(flight, count, timeout=5):
+    """Wait until `count` callers are waiting on the flight of 'key'"""
+    deadline = time.monotonic() + timeout
+    poll = threading.Event()
+    while flight._calls.get('key') is None or flight._calls['key'].followers < count:
+        assert time.monotonic() < deadline, "callers not waiting"
+        poll.wait(0.01)
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {'entry': []}
+
+    threads, results = run_concurrently(flight, fetch)
+    wait_for_followers(flight, 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{'entry': []}] * 3
+    # each caller receives its own copy
+    assert len(set(id(result) for result in results)) == 3
+
+
+def test_follower_timeout(mocker):
+    mocker.patch('sof_wrapper.singleflight.DEFAULT_TIMEOUT', 0.05)
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def stuck_fetch():
+        release.wait(5)
+        return {'entry': ['leader']}
+
+    threads, results = run_concurrently(flight, stuck_fetch, count=1)
+    wait_for_followers(flight, 0)
+    # follower gives up on the stuck leader, w/ its own call
+    assert flight.do('key', lambda: {'entry': []}) == {'entry': []}
+    release.set()
+    threads[0].join()
+    assert results == [{'entry': ['leader']}]
+
+
+def test_follower_wait_capped_by_deadline(app):
+    from sof_wrapper.deadline import start_deadline
+    flight = SingleFlight()
+    release = threading.Event()
+
+    threads, results = run_concurrently(
+        flight, lambda: release.wait(5) and {'entry': ['leader']}, count=1)
+    wait_for_followers(flight, 0)
+    with app.test_request_context():
+        start_deadline(0.05)
+        started = time.monotonic()
+        assert flight.do('key', lambda: {'entry': []}) == {'entry': []}
+        assert time.monotonic() - started < 1
+    release.set()
+    threads[0].join()
+
+
+def test_errors_raised():
+    flight = SingleFlight()
+
+    def fetch():
+        raise ValueError('upstream failure')
+
+    with raises(ValueError):
+        flight.do('key', fetch)
+    assert not flight._calls
+
+
+def test_redis_flight(app):
+    from sof_wrapper.singleflight import redis_flight
+    app.config['SINGLE_FLIGHT_REDIS'] = True
+    with app.app_context():
+        assert SingleFlight().do('redis-key', lambda: {'id': 1}) == {'id': 1}
+
+        # with the lock held by another worker's flight, its result is shared
+        redis_handle = app.config['SESSION_REDIS']
+        prefix = app.config['SINGLE_FLIGHT_PREFIX']
+        redis_handle.set(f"{prefix}redis-key:lock", 'other', px=1000)
+        redis_handle.set(f"{prefix}redis-key:other", '{"id": 2}', px=1000)
+        assert redis_flight('redis-key', lambda: {'id': 1}) == {'id': 2}
+
+        # lock of a later flight, acquired after this one's expired, is kept
+        def slow_fetch():
+            redis_handle.set(f"{prefix}slow-key:lock", 'later', px=1000)
+            return {'id': 3}
+
+        assert redis_flight('slow-key', slow_fetch) == {'id': 3}
+        assert redis_handle.get(f"{prefix}slow-key:lock") == b'later'
+
+
+def test_redis_follower_backs_off(app, mocker):
+    from sof_wrapper.deadline import start_deadline
+    from sof_wrapper.singleflight import redis_flight
+    redis_handle = app.config['SESSION_REDIS']
+    prefix = app.config['SINGLE_FLIGHT_PREFIX']
+    redis_handle.set(f"{prefix}stuck-key:lock", 'stuck', px=5000)
+    get = mocker.spy(redis_handle, 'get')
+
+    with app.test_request_context():
+        # follower gives up on the stuck leader at the request's deadline
+        start_deadline(0.5)
+        started = time.monotonic()
+        assert redis_flight('stuck-key', lambda: {'id': 1}) == {'id': 1}
+        assert time.monotonic() - started < 1
+    # polled w/ growing intervals, rather than every 10ms
+    assert get.call_count < 20
@@ -0,0 +1,46 @@
+from sof_wrapper.upstream import UpstreamSessions, origin
+
+
+def test_origin():
+    assert origin('https://EHR.example.com:9443/fhir/Patient/1') == 'https://ehr.example.com:9443'
+
+
+def test_session_per_origin():
+    sessions = UpstreamSessions()
+    ehr = sessions.session_for('https://ehr.example.com/fhir/Patient')
+    assert sessions.session_for('https://ehr.example.com/fhir/MedicationRequest') is ehr
+    assert sessions.session_for('https://pdmp.example.com/v/r4/fhir') is not ehr
+
+
+def test_idle_eviction():
+    sessions = UpstreamSessions()
+    sessions.idle_timeout = -1
+    ehr = sessions.session_for('https://ehr.example.com/fhir/Patient')
+    assert sessions.session_for('https://ehr.example.com/fhir/Patient') is not ehr
+
+
+def test_default_timeout_and_no_cookies(requests_mock):
+    url = 'https://ehr.example.com/fhir/metadata'
+    requests_mock.get(url, json={}, headers={'Set-Cookie': 'user=someone'})
+    sessions = UpstreamSessions()
+    sessions.timeout = (1, 2)
+
+    sessions.request('GET', url)
+    assert requests_mock.last_request.timeout == (1, 2)
+    # sessions are shared across users; upstream cookies must not persist
+    assert not sessions.session_for(url).cookies
+
+
+def test_url_template():
+    from sof_wrapper.tracing import url_template
+    assert url_template('https://ehr.test/fhir/Patient/12742400?_count=10') == '/fhir/Patient/{id}'
+    assert url_template('https://rxnav.test/REST/rxclass/class/byRxcui.json') == \
+        '/REST/rxclass/class/byRxcui.json'
+    # ids w/o digits are masked too
+    assert url_template('https://ehr.test/fhir/Patient/BJackson') == '/fhir/Patient/{id}'
+    assert url_template('https://ehr.test/fhir/Patient/BJackson/_history/2') == \
+        '/fhir/Patient/{id}/_history/{id}'
+    assert url_template('https://ehr.test/fhir/Patient/BJackson/MedicationRequest') == \
+        '/fhir/Patient/{id}/MedicationRequest'
+    assert url_template('https://ehr.test/fhir/Patient/BJackson/MedicationRequest/abc') == \
+        '/fhir/Patient/{id}/MedicationRequest/{id}'